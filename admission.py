@@ -0,0 +1,165 @@
+"""
+Receipt Processor API - Admission Control
+
+Under a traffic spike a server that takes every request only queues them,
+until the clients time out and every request is late. The Admission
+Controller caps the requests handled at once and sheds the others right
+away, with a 429 or a 503 and a Retry-After header, so the admitted
+requests keep their latency and the clients know when to come back.
+
+The points reads are cheap and the clients wait on them, so part of the
+capacity is reserved for them: the writes (and the other costly requests)
+are shed first, while the reads still get in.
+
+In the Flask app the Admission_Middleware wraps the WSGI application, so a
+shed request costs a few microseconds: it never reaches the routing, the
+hooks or the body logging of Flask, and its body is never read.
+
+Written in Python 3.11.5 and Flask 2.3.3
+"""
+import json
+import re
+import threading
+from typing import Callable, Iterable, Optional
+from metrics import REQUESTS_SHED
+
+
+# Paths of the requests with priority, the points reads
+PRIORITY_PATH = re.compile(r"^/receipts/[^/]+/points$")
+# Paths never shed, to watch an overload: the metrics and the admin
+UNLIMITED_PATH = re.compile(r"^/(metrics|admin/.*)$")
+
+
+class Overloaded(Exception):
+    """
+    A request was not admitted. `status` is 429 when the request class is
+    over its share of the capacity, 503 when the server is full.
+    """
+
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+
+class Admission_Controller:
+    """
+    Admits at most `max_in_flight` requests at once. The last `reserved`
+    slots are for the priority requests: the other requests are shed once
+    `max_in_flight - reserved` requests are in flight. A rejected request
+    doesn't wait, the clients retry after `retry_after` seconds.
+    """
+
+    def __init__(self, max_in_flight: int, reserved: int = 0,
+                 retry_after: int = 1):
+        if not 0 <= reserved < max_in_flight:
+            raise ValueError(
+                "The reserved slots must be fewer than the maximum of "
+                "requests in flight.")
+        self.max_in_flight = max_in_flight
+        self.max_regular = max_in_flight - reserved
+        self.retry_after = retry_after
+        self.lock = threading.Lock()
+        self.in_flight = 0
+
+    def acquire(self, priority: bool = False):
+        """
+        Admit a request, or raise Overloaded. An admitted request must be
+        released once it's done.
+        """
+        with self.lock:
+            if self.in_flight < (self.max_in_flight if priority
+                                 else self.max_regular):
+                self.in_flight += 1
+                return
+
+        if self.in_flight >= self.max_in_flight:
+            REQUESTS_SHED.labels("full").inc()
+            raise Overloaded(503, "The server is overloaded, retry later.")
+        REQUESTS_SHED.labels("over_share").inc()
+        raise Overloaded(429, "Too many requests, retry later.")
+
+    def release(self):
+        with self.lock:
+            self.in_flight -= 1
+
+    def __len__(self) -> int:
+        return self.in_flight
+
+
+class Admission_Middleware:
+    """
+    WSGI middleware of the admission control: sheds the requests over the
+    capacity of the controller before they reach the app, and the bodies
+    announced over `max_content_length` bytes (the app still checks the
+    bodies without a Content-Length). A request holds its slot until the
+    app returns its response (the responses of the app are not streamed,
+    their body is ready by then).
+    """
+
+    def __init__(self, wsgi_app: Callable, controller: Admission_Controller,
+                 max_content_length: int = None):
+        self.wsgi_app = wsgi_app
+        self.controller = controller
+        self.max_content_length = max_content_length
+
+    def __call__(self, environ: dict, start_response: Callable) -> Iterable:
+        if self.max_content_length and \
+                content_length(environ) > self.max_content_length:
+            return error_response(
+                start_response, 413, "The request body is too large.")
+
+        priority = admission_priority(environ.get("PATH_INFO", ""))
+        if priority is None:
+            return self.wsgi_app(environ, start_response)
+        try:
+            self.controller.acquire(priority)
+        except Overloaded as error:
+            return error_response(
+                start_response, error.status, str(error),
+                [("Retry-After", str(self.controller.retry_after))])
+
+        try:
+            return self.wsgi_app(environ, start_response)
+        finally:
+            self.controller.release()
+
+
+# Module helper functions
+
+def admission_priority(path: str) -> Optional[bool]:
+    """
+    Whether a request has priority in the admission control, by its path.
+    None if it's never shed.
+    """
+    if PRIORITY_PATH.match(path):
+        return True
+    if UNLIMITED_PATH.match(path):
+        return None
+    return False
+
+
+def content_length(environ: dict) -> int:
+    """The Content-Length of a WSGI request, 0 if it's not valid"""
+    try:
+        return max(0, int(environ.get("CONTENT_LENGTH") or 0))
+    except ValueError:
+        return 0
+
+
+STATUS_LINES = {
+    413: "413 Request Entity Too Large",
+    429: "429 Too Many Requests",
+    503: "503 Service Unavailable",
+}
+
+
+def error_response(start_response: Callable, status: int, message: str,
+                   headers: list = ()) -> list:
+    """Send a JSON error response, like the ones of the app"""
+    body = json.dumps({"error": message}).encode()
+    start_response(STATUS_LINES[status], [
+        ("Content-Type", "application/json"),
+        ("Content-Length", str(len(body))),
+        *headers,
+    ])
+    return [body]
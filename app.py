@@ -7,89 +7,437 @@ September 2023
 
 ------------------------------------------------------------------------
 
+The application is built by the create_app factory: the logging, the
+storage, the caches and the indexes are set up when an app is created, not
+when this module is imported. The `app` of this module (used by `flask
+run` and the WSGI servers) is created on first use.
+
+Each app has its own receipt pool and components, in its App_State. The
+points rules, the receipt validator, the JSON library, the memo caches
+and the metrics (their switch and their registry) are module globals of
+their modules, shared by the apps of the process: the last app created
+sets them.
+
 Written in Python 3.11.5 and Flask 2.3.3
 
 ------------------------------------------------------------------------
 """
 # Flask imports
-from flask import Flask, request
+from flask import Blueprint, Flask, current_app, g, has_app_context, request
+# JSON library of the requests and responses (orjson when installed)
+from json_provider import Fast_JSON_Provider, loads, set_json_library
 # Classes for the Receipt and Receipt_Pool
-from receipts import Receipt, Receipt_Pool
+from receipts import (
+    Receipt, Receipt_Pool, set_points_calculator, set_receipt_validator
+)
+# Rule engine used to calculate the points of the receipts
+from points_calculator import (
+    Points_Calculator, description_memo, retailer_memo, set_memo_sizes
+)
+# Application settings
+from config import Config
+# Storage backends for the Receipt_Pool
+from storage import create_storage
 # Marshmallow for data validation of the request payload
 from marshmallow import ValidationError
 # From Python standard library for unique ids
 from uuid import UUID
+# Other standard library imports
+import atexit
+import re
+import time
+from typing import Optional
+# Metrics of the application
+import metrics
+from metrics import (
+    IDEMPOTENT_REPLAYS, PARSE_JSON, POINTS_CACHE_HITS, POINTS_LOOKUPS,
+    POINTS_NOT_FOUND,
+    RECEIPTS_PROCESSED, REQUEST_SECONDS, REQUESTS, SCORE_BATCH,
+    VALIDATION_ERRORS, Gauge
+)
+# Indexes for the receipt queries and statistics
+from indexes import Receipt_Indexes
+# Cache of the serialized points responses
+from points_cache import Points_Cache, points_response
+# Retention policy that bounds the receipts kept in the pool
+from retention import Retention_Policy
+# Idempotency cache for the resubmitted receipts
+from idempotency import (
+    Idempotency_Cache, Idempotency_Conflict, idempotency_key
+)
 # Logging imports
 import logging
-from logging.handlers import RotatingFileHandler
+from app_logging import (
+    Body_Log_Policy, Dropping_Queue_Handler, configure_logging
+)
+# Bulk import/export commands of the receipt pool
+from cli import receipts_cli
+# Worker processes that score the large batches
+from scoring import Scoring_Pool
+# Background scoring of the receipts in the deferred mode
+from deferred_scoring import Deferred_Scorer
 # Other imports
-from receipts import verify_folder
+from validators import DATE_PATTERN
+
+from admission import Admission_Controller, Admission_Middleware
+
+from profiling import (
+    Request_Profiler, Slow_Request_Recorder, is_admin_token, stage_trace
+)
+
+
+# The logger of the application. It's the logger of the Flask app (named
+# after this module), and the parent of the loggers of the other modules.
+app_logger = logging.getLogger(__name__)
+
+# The routes of the API, registered on each app by create_app
+api = Blueprint("api", __name__)
+
+# Maximum number of receipts accepted in a single batch request
+MAX_BATCH_SIZE = 10000
+
+# Receipts returned by a query, by default and at most
+DEFAULT_QUERY_LIMIT = 100
+MAX_QUERY_LIMIT = 1000
+
+# Format of the dates of the queries
+DATE_FORMAT = re.compile(DATE_PATTERN)
+
+# Content types that mark a batch payload as newline delimited JSON
+NDJSON_CONTENT_TYPES = (
+    'application/x-ndjson',
+    'application/ndjson',
+    'application/jsonl'
+)
+
+
+class App_State:
+    """
+    The receipt pool of an app and the components around it, created by
+    create_app and kept in `app.extensions["receipts"]`.
+    """
+
+    def __init__(self):
+        self.receipt_pool: Optional[Receipt_Pool] = None
+        self.scoring_pool: Optional[Scoring_Pool] = None
+        self.receipt_indexes: Optional[Receipt_Indexes] = None
+        self.points_cache: Optional[Points_Cache] = None
+        self.retention_policy: Optional[Retention_Policy] = None
+        self.idempotency_cache: Optional[Idempotency_Cache] = None
+        self.deferred_scorer: Optional[Deferred_Scorer] = None
+        self.log_queue_handler: Optional[Dropping_Queue_Handler] = None
+        self.body_log_policy: Optional[Body_Log_Policy] = None
+        self.admission: Optional[Admission_Controller] = None
+        self.slow_requests: Optional[Slow_Request_Recorder] = None
+        self.request_profiler: Optional[Request_Profiler] = None
+
+
+def create_app(config: dict = None) -> Flask:
+    """
+    Create and configure an instance of the application. The settings are
+    the ones of Config (and the environment), overridden by `config`. The
+    process-wide settings (POINTS_RULES_FILE, RECEIPT_VALIDATOR,
+    JSON_LIBRARY, the memo sizes and METRICS_ENABLED) apply to all the
+    apps of the process.
+    """
+    # Initialize and config the Flask application
+    app = Flask(__name__)
+    app.config.from_object(Config)
+    if config:
+        app.config.update(config)
+    app.cli.add_command(receipts_cli)
+
+    # Process-wide settings, shared with the other apps of the process.
+    # Decode the requests and encode the responses with the configured
+    # library
+    set_json_library(app.config['JSON_LIBRARY'])
+    app.json = Fast_JSON_Provider(app)
+
+    # Compile the points rules once, at startup
+    set_points_calculator(
+        Points_Calculator.from_file(app.config['POINTS_RULES_FILE']))
+    set_memo_sizes(app.config['RETAILER_MEMO_SIZE'],
+                   app.config['DESCRIPTION_MEMO_SIZE'])
+    # Select the validator for the receipts
+    set_receipt_validator(app.config['RECEIPT_VALIDATOR'])
+
+    state = App_State()
+    app.extensions["receipts"] = state
+
+    # Start the worker processes that score the large batches first, before
+    # any thread of the application (the log writer, the storage writers,
+    # the deferred scorer, the retention sweeper): on Linux they are
+    # forked, and a process forked while another thread holds a lock
+    # inherits it locked. Only when SCORING_WORKERS is set.
+    if app.config['SCORING_WORKERS'] > 0:
+        state.scoring_pool = Scoring_Pool(
+            app.config['SCORING_WORKERS'], app.config['RECEIPT_VALIDATOR'],
+            app.config['SCORING_CHUNK_SIZE'])
+        atexit.register(state.scoring_pool.close)
+
+    # Write the logs to the log file (none without LOG_FILE), through a
+    # background writer thread in the queue mode, so the request threads
+    # don't wait on the file I/O.
+    state.log_queue_handler = configure_logging(app.logger, app.config)
+    # Sampling and truncation of the request bodies in the logs
+    state.body_log_policy = Body_Log_Policy(
+        app.config['LOG_BODY_SAMPLE_RATE'], app.config['LOG_BODY_MAX_BYTES'])
+
+    # Initialize the Receipt_Pool object to store the receipts in the
+    # configured storage backend. It's closed on exit, so the pending
+    # writes of the persistent backends are saved.
+    receipt_pool = state.receipt_pool = Receipt_Pool(
+        create_storage(app.config), app.config['RECEIPT_KEEP_PAYLOAD'])
+    atexit.register(receipt_pool.close)
+
+    # Indexes of the receipts by retailer, purchase date and points, for
+    # the queries and the statistics. The receipts already stored
+    # (persistent backends) are indexed at startup, the new ones as they
+    # are added.
+    if app.config['INDEXES_ENABLED']:
+        state.receipt_indexes = Receipt_Indexes()
+        state.receipt_indexes.rebuild(receipt_pool.iter_receipts())
+        receipt_pool.add_listener(state.receipt_indexes)
+
+    # Cache of the serialized points responses, invalidated when a receipt
+    # is deleted from the pool. Off when POINTS_CACHE_SIZE is 0.
+    if app.config['POINTS_CACHE_SIZE'] > 0:
+        state.points_cache = Points_Cache(app.config['POINTS_CACHE_SIZE'])
+        receipt_pool.add_listener(state.points_cache)
+
+    # Retention of the receipts: a background sweeper evicts the receipts
+    # over RETENTION_MAX_RECEIPTS, or older than RETENTION_MAX_AGE seconds.
+    # Only when one of the limits is set.
+    if app.config['RETENTION_MAX_RECEIPTS'] or \
+            app.config['RETENTION_MAX_AGE']:
+        retention_policy = state.retention_policy = Retention_Policy(
+            receipt_pool, app.config['RETENTION_MAX_RECEIPTS'],
+            app.config['RETENTION_MAX_AGE'], app.config['RETENTION_POLICY'],
+            app.config['RETENTION_SWEEP_INTERVAL'])
+        retention_policy.rebuild(receipt_pool.iter_receipts())
+        receipt_pool.add_listener(retention_policy)
+        retention_policy.start()
+        atexit.register(retention_policy.stop)
+
+    # Cache of the processed receipts, so the retries of the clients get
+    # the same id. Only when the idempotency mode is on.
+    if app.config['IDEMPOTENCY_ENABLED']:
+        state.idempotency_cache = Idempotency_Cache(
+            app.config['IDEMPOTENCY_MAX_ENTRIES'],
+            app.config['IDEMPOTENCY_TTL'])
+
+    # Deferred scoring: the submitted receipts are validated and scored by
+    # a background thread. It scores the receipts still queued on exit.
+    if app.config['SCORING_MODE'] == 'deferred':
+        state.deferred_scorer = Deferred_Scorer(
+            receipt_pool, app.config['DEFERRED_QUEUE_SIZE'],
+            app.config['DEFERRED_MAX_FAILURES'])
+        state.deferred_scorer.start()
+        atexit.register(state.deferred_scorer.stop)
+    elif app.config['SCORING_MODE'] != 'eager':
+        raise ValueError(
+            f"Unknown scoring mode: {app.config['SCORING_MODE']}")
 
+    # Admission control: the requests over MAX_IN_FLIGHT are shed, the
+    # reads last, by a middleware in front of the app, before Flask reads
+    # (and logs) their body. Off when MAX_IN_FLIGHT is 0.
+    if app.config['MAX_IN_FLIGHT'] > 0:
+        state.admission = Admission_Controller(
+            app.config['MAX_IN_FLIGHT'], app.config['ADMISSION_RESERVED'],
+            app.config['ADMISSION_RETRY_AFTER'])
+        app.wsgi_app = Admission_Middleware(
+            app.wsgi_app, state.admission, app.config['MAX_CONTENT_LENGTH'])
 
-# Verify that the logs directory exists. The logs will be stored there.
-# This is very important because the logging module will not create it.
-verify_folder('logs')
+    # The slowest requests, with their stage timings, and the profiles of
+    # the requests the admin asks for. The profiles need ADMIN_TOKEN.
+    if app.config['SLOW_REQUESTS_SIZE'] > 0:
+        state.slow_requests = Slow_Request_Recorder(
+            app.config['SLOW_REQUESTS_SIZE'],
+            app.config['SLOW_REQUEST_THRESHOLD'])
+    if app.config['ADMIN_TOKEN']:
+        state.request_profiler = Request_Profiler(
+            app.config['PROFILE_DIR'], app.config['ADMIN_TOKEN'])
 
-# Initialize and config the Flask application
-app = Flask(__name__)
+    # Turn the metrics on or off, for the whole process. The gauges read
+    # the state of the app that serves the metrics.
+    metrics.set_enabled(app.config['METRICS_ENABLED'])
 
-# Initialize the Receipt_Pool object to store the receipts
-receipt_pool = Receipt_Pool()
+    app.register_blueprint(api)
 
-# Set up logging
+    # Initializaton log message
+    app_logger.info('Receipt Processor API started successfully.')
+    return app
 
-# Create an alias for the Flask app logger
-app_logger = app.logger
 
-# Configure the logging settings to determine how logs should be handled.
-log_formatter = logging.Formatter('%(asctime)s - %(levelname)s: %(message)s')
-log_file = 'logs/app.log'  # Define the path to the log file
+def get_state(app: Flask = None) -> App_State:
+    """Get the state of an app, the current one by default"""
+    return (app or current_app).extensions["receipts"]
 
-# Create a rotating file handler to handle the logs in development
-log_handler = RotatingFileHandler(log_file, maxBytes=100000, backupCount=3)
 
-# Set up the log handler and add it to the Flask app
-log_handler.setFormatter(log_formatter)
-log_handler.setLevel(logging.DEBUG)
-app_logger.addHandler(log_handler)
+def metrics_state() -> Optional[App_State]:
+    """
+    Get the state read by the gauges: the one of the current app, or of
+    the default app outside of a request (the ASGI application). None
+    before the default app is created.
+    """
+    if has_app_context():
+        return get_state()
+    default_app = globals().get("app")
+    return get_state(default_app) if default_app is not None else None
 
-# Initializaton log message
-app_logger.info('Receipt Processor API started successfully.')
+
+def state_gauge(name: str, help_text: str, read) -> Gauge:
+    """A gauge that reads the state of the app serving the metrics"""
+    def value():
+        state = metrics_state()
+        return read(state) if state is not None else 0
+    return Gauge(name, help_text, value)
+
+
+def register_gauges():
+    """
+    Add the gauges read when the metrics are collected. The registry is
+    shared by the apps of the process, so they are registered once.
+    """
+    metrics.registry.register(state_gauge(
+        "receipt_pool_size", "Receipts stored in the pool.",
+        lambda state: len(state.receipt_pool)))
+    metrics.registry.register(Gauge(
+        "receipt_validation_error_ratio",
+        "Fraction of the submitted receipts rejected by the validation.",
+        lambda: ratio(VALIDATION_ERRORS.value,
+                      VALIDATION_ERRORS.value + RECEIPTS_PROCESSED.value)))
+    metrics.registry.register(Gauge(
+        "points_not_found_ratio",
+        "Fraction of the points requests for an unknown receipt.",
+        lambda: ratio(POINTS_NOT_FOUND.value, POINTS_LOOKUPS.value)))
+    metrics.registry.register(state_gauge(
+        "log_records_dropped",
+        "Log records dropped because the queue was full.",
+        lambda state: (state.log_queue_handler.dropped
+                       if state.log_queue_handler else 0)))
+    metrics.registry.register(state_gauge(
+        "deferred_receipts_pending",
+        "Receipts submitted in the deferred mode and not scored yet.",
+        lambda state: (len(state.deferred_scorer)
+                       if state.deferred_scorer else 0)))
+    metrics.registry.register(state_gauge(
+        "requests_in_flight",
+        "Requests admitted by the admission control and not done yet.",
+        lambda state: len(state.admission) if state.admission else 0))
+    for name, memo in (("retailer", retailer_memo),
+                       ("description", description_memo)):
+        metrics.registry.register(Gauge(
+            f"{name}_memo_hit_ratio",
+            f"Fraction of the {name} memo lookups found in the cache.",
+            lambda memo=memo: memo.stats()["hit_ratio"]))
+        metrics.registry.register(Gauge(
+            f"{name}_memo_size", f"Entries of the {name} memo cache.",
+            lambda memo=memo: memo.stats()["size"]))
+
+
+register_gauges()
+
+
+# The default app, and the attributes of its state, are created on first
+# use: `from app import app, receipt_pool` works as before, but importing
+# the module alone doesn't build anything.
+def __getattr__(name: str):
+    if name == "app":
+        app = globals()["app"] = create_app()
+        return app
+    if name in vars(App_State()):
+        default_app = globals().get("app") or __getattr__("app")
+        return getattr(get_state(default_app), name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 # API routes
 
+# Start timing the request, for the metrics, and tracing its stages for
+# the slow request recorder
+@api.before_app_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+    state = get_state()
+    if state.slow_requests is not None:
+        g.stage_trace = {}
+        g.stage_trace_token = stage_trace.set(g.stage_trace)
+
+    # Profile the request if the admin asks for it
+    profiler = state.request_profiler
+    if profiler is not None and profiler.wanted(
+            request.headers.get('X-Profile')):
+        g.profile = profiler.start()
+
+
 # Monitor/Log the types of requests your server is receiving
-@app.before_request
+@api.before_app_request
 def log_request_info():
-    app_logger.debug('Headers: %s', request.headers)
-    app_logger.info('Body: %s', request.get_data())
+    body_log_policy = get_state().body_log_policy
+    if app_logger.isEnabledFor(logging.DEBUG):
+        app_logger.debug('Headers: %s', request.headers)
+    # Only the sampled bodies are read here, and they are truncated
+    if app_logger.isEnabledFor(logging.INFO) and body_log_policy.should_log():
+        app_logger.info(
+            'Body: %s', body_log_policy.truncate(request.get_data()))
 
 
-@app.route('/receipts/process', methods=['POST'])
+@api.route('/receipts/process', methods=['POST'])
 def process_receipt():
+    state = get_state()
+
     # Get the request data and transforming it into a dictionary
-    receipt_data = request.get_json()
+    with PARSE_JSON.time():
+        receipt_data = request.get_json()
+
+    # A resubmitted receipt gets the id it got the first time, without
+    # validating and scoring it again.
+    if state.idempotency_cache is not None:
+        key, fingerprint = idempotency_key(
+            receipt_data, request.headers.get('Idempotency-Key'))
+        try:
+            receipt_id = state.idempotency_cache.get(key, fingerprint)
+        except Idempotency_Conflict as error:
+            return {"error": str(error)}, 422
+
+        if receipt_id is not None and (
+                receipt_id in state.receipt_pool
+                or is_pending(state, receipt_id)):
+            IDEMPOTENT_REPLAYS.inc()
+            return {"id": receipt_id}, 200, {"Idempotent-Replayed": "true"}
 
     # Validate the receipt data from the request payload
     # and process the receipt
     try:
-        # Process the receipt: it will assing it an unique id,
-        # calculate the points it was awarded, and store it in memory.
-        receipt = Receipt(receipt_data)
+        if state.deferred_scorer is not None:
+            # Deferred mode: only the structure of the receipt is checked
+            # now, it's validated and scored in the background.
+            receipt_id = state.deferred_scorer.submit(receipt_data)
+            app_logger.info(f"Accepted receipt with ID: {receipt_id}")
+        else:
+            # Process the receipt: it will assing it an unique id,
+            # calculate the points it was awarded, and store it in memory.
+            receipt = Receipt(receipt_data)
+            receipt_id = receipt.id
 
-        # Logs the if og the processed receipt
-        app_logger.info(f"Processed receipt with ID: {receipt.id}")
+            # Logs the if og the processed receipt
+            app_logger.info(f"Processed receipt with ID: {receipt.id}")
 
-        # Add the receipt to the receipt pool
-        receipt_pool.add_receipt(receipt)
+            # Add the receipt to the receipt pool
+            state.receipt_pool.add_receipt(receipt)
+            RECEIPTS_PROCESSED.inc()
+
+        if state.idempotency_cache is not None:
+            state.idempotency_cache.put(key, fingerprint, receipt_id)
 
         # Return the receipt id as a response
-        return {"id": receipt.id}, 200
+        return {"id": receipt_id}, 200
 
     except ValidationError as error:
         # If there's a validation error, log it, return the error message
         # and a 400 status code
+        VALIDATION_ERRORS.inc()
         app_logger.warning(f"Validation error occurred: {error}")
         return {"error": str(error)}, 400
 
@@ -102,25 +450,367 @@ def process_receipt():
         )
 
 
-@app.route('/receipts/<receipt_id>/points', methods=['GET'])
+@api.route('/receipts/process/batch', methods=['POST'])
+def process_receipt_batch():
+    state = get_state()
+
+    # Get the batch of receipts: a JSON array, or one receipt per line
+    # when the client sends NDJSON.
+    try:
+        with PARSE_JSON.time():
+            batch = parse_batch_payload()
+    except ValueError as error:
+        app_logger.warning(f"Invalid batch payload: {error}")
+        return {"error": str(error)}, 400
+
+    if len(batch) > MAX_BATCH_SIZE:
+        return (
+            {"error": f"Batch exceeds the maximum of {MAX_BATCH_SIZE} "
+                      "receipts."},
+            413
+        )
+
+    # Validate and score every receipt in a single pass. An invalid
+    # receipt only records its own error, it doesn't fail the batch. The
+    # large batches are scored in the worker processes, if there are any.
+    if state.scoring_pool is not None and \
+            len(batch) >= current_app.config['SCORING_MIN_BATCH']:
+        results, errors, processed = score_batch_in_workers(batch)
+    else:
+        results, errors, processed = score_batch(batch)
+
+    # Store all the valid receipts at once. The ids are read after
+    # insertion, because the pool may reassign one on a collision.
+    state.receipt_pool.add_receipts(processed)
+    RECEIPTS_PROCESSED.inc(len(processed))
+    VALIDATION_ERRORS.inc(len(errors))
+    app_logger.info(
+        f"Processed batch of {len(batch)} receipts "
+        f"({len(processed)} valid, {len(errors)} invalid)."
+    )
+
+    return {
+        "ids": [
+            str(receipt.id) if receipt else None for receipt in results
+        ],
+        "errors": errors
+    }, 200
+
+
+@api.route('/receipts/<receipt_id>/points', methods=['GET'])
 def get_points(receipt_id):
+    POINTS_LOOKUPS.inc()
+    state = get_state()
+    points_cache = state.points_cache
+
+    # Fast path: the serialized response of a receipt already requested
+    cached = points_cache.get(receipt_id) if points_cache else None
+    if cached is not None:
+        POINTS_CACHE_HITS.inc()
+        state.receipt_pool.touch(cached[2])
+        return send_points(cached)
+
     # Validate the receipt id
     try:
-        receipt_id = UUID(str(receipt_id), version=4)
+        parsed_id = UUID(str(receipt_id), version=4)
     except ValueError:
         return {"error": "Invalid receipt id."}, 400
 
+    # A receipt still pending in the deferred mode is scored now
+    deferred_scorer = state.deferred_scorer
+    if deferred_scorer is not None:
+        deferred_scorer.score(parsed_id)
+
     # Get the receipt from the receipt pool
-    receipt = receipt_pool.get_receipt(receipt_id)
+    receipt = state.receipt_pool.get_receipt(parsed_id)
     # If the receipt is not found, return a 404 status code
     if not receipt:
+        # A deferred receipt that failed its validation gets its error
+        error = (deferred_scorer.get_failure(parsed_id)
+                 if deferred_scorer is not None else None)
+        if error is not None:
+            return {"error": error}, 422
+        POINTS_NOT_FOUND.inc()
         return {"error": "Receipt not found."}, 404
 
+    response = points_response(receipt)
+    if points_cache is not None and receipt_id == str(parsed_id):
+        points_cache.put(receipt_id, response)
+        # A delete between the lookup and the put has already invalidated
+        # the cache, so the response it just got must be dropped.
+        if parsed_id not in state.receipt_pool:
+            points_cache.discard(receipt_id)
+
     # Return the receipt as a response
-    return {"points": str(receipt.points)}, 200
+    return send_points(response)
+
+
+@api.route('/receipts', methods=['GET'])
+def query_receipts():
+    receipt_indexes = get_state().receipt_indexes
+    if receipt_indexes is None:
+        return {"error": "The receipt indexes are disabled."}, 501
+
+    # Filters of the query, read from the indexes
+    try:
+        filters = parse_query_args()
+    except ValueError as error:
+        return {"error": str(error)}, 400
+
+    count, results = receipt_indexes.query(**filters)
+    return {
+        "count": count,
+        "receipts": [
+            {
+                "id": str(receipt_id),
+                "retailer": retailer,
+                "purchaseDate": date,
+                "points": points
+            }
+            for receipt_id, retailer, date, points in results
+        ]
+    }, 200
+
+
+@api.route('/stats/points', methods=['GET'])
+def get_points_stats():
+    receipt_indexes = get_state().receipt_indexes
+    if receipt_indexes is None:
+        return {"error": "The receipt indexes are disabled."}, 501
+
+    group_by = request.args.get('group_by')
+    if group_by not in (None, 'retailer', 'date'):
+        return {"error": "group_by must be retailer or date."}, 400
+
+    # Read from the running totals of the indexes
+    return receipt_indexes.stats(group_by), 200
+
+
+# Query helpers
+
+def parse_query_args() -> dict:
+    """
+    Read the filters of a receipts query from the request arguments.
+    Raise a ValueError with the reason when one is invalid.
+    """
+    args = request.args
+    filters = {
+        "retailer": args.get('retailer'),
+        "date_from": args.get('from'),
+        "date_to": args.get('to'),
+    }
+    for name in ('from', 'to'):
+        if args.get(name) is not None and not DATE_FORMAT.match(args[name]):
+            raise ValueError(f"{name} must be a date like 2022-01-01.")
+
+    for name, argument, default in (
+            ("min_points", 'min_points', None),
+            ("max_points", 'max_points', None),
+            ("limit", 'limit', DEFAULT_QUERY_LIMIT),
+            ("offset", 'offset', 0)):
+        value = args.get(argument)
+        if value is None:
+            filters[name] = default
+            continue
+        try:
+            filters[name] = int(value)
+        except ValueError:
+            raise ValueError(f"{argument} must be an integer.")
+
+    if not 1 <= filters["limit"] <= MAX_QUERY_LIMIT:
+        raise ValueError(f"limit must be between 1 and {MAX_QUERY_LIMIT}.")
+    if filters["offset"] < 0:
+        raise ValueError("offset must not be negative.")
+    return filters
+
+
+# Points helpers
+
+def send_points(response: tuple):
+    """
+    Send a serialized points response, or a 304 when the client already
+    has it (If-None-Match).
+    """
+    body, etag, _ = response
+    headers = {
+        "ETag": f'"{etag}"',
+        "Cache-Control": current_app.config['POINTS_CACHE_CONTROL']
+    }
+    if request.if_none_match.contains(etag):
+        return current_app.response_class(status=304, headers=headers)
+    return current_app.response_class(
+        body, status=200, headers=headers, mimetype="application/json")
+
+
+# Deferred scoring helpers
+
+def is_pending(state: App_State, receipt_id: UUID) -> bool:
+    """Whether a receipt is waiting for its deferred scoring"""
+    return (state.deferred_scorer is not None
+            and receipt_id in state.deferred_scorer)
+
+
+# Metrics helpers
 
+def ratio(part: float, total: float) -> float:
+    """Get a ratio, 0 when the total is 0"""
+    return part / total if total else 0.0
 
-@app.teardown_appcontext
+
+# Batch helpers
+
+class BatchEntryError(str):
+    """
+    Marks an NDJSON line that could not be decoded, so the error is
+    reported for that entry instead of failing the whole batch.
+    """
+
+
+def score_batch(batch: list) -> tuple:
+    """
+    Validate and score the entries of a batch. Return the receipt (or None)
+    of each entry, the errors, and the valid receipts.
+    """
+    results = []
+    errors = []
+    processed = []
+    for index, entry in enumerate(batch):
+        try:
+            if isinstance(entry, BatchEntryError):
+                raise ValidationError(str(entry))
+            receipt = Receipt(entry)
+            processed.append(receipt)
+            results.append(receipt)
+
+        except ValidationError as error:
+            results.append(None)
+            errors.append({"index": index, "error": str(error)})
+
+        except Exception:
+            app_logger.exception(
+                f"An unexpected error occurred in batch entry {index}.")
+            results.append(None)
+            errors.append({
+                "index": index,
+                "error": "An error occurred processing the receipt."
+            })
+    return results, errors, processed
+
+
+def score_batch_in_workers(batch: list) -> tuple:
+    """
+    Validate and score the entries of a batch in the scoring pool. Return
+    the same results as score_batch.
+    """
+    payloads = [
+        entry for entry in batch if not isinstance(entry, BatchEntryError)]
+    with SCORE_BATCH.time():
+        scores = iter(get_state().scoring_pool.score(payloads))
+
+    results = []
+    errors = []
+    processed = []
+    for index, entry in enumerate(batch):
+        if isinstance(entry, BatchEntryError):
+            score = str(entry)
+        else:
+            score = next(scores)
+        if isinstance(score, str):
+            results.append(None)
+            errors.append({"index": index, "error": score})
+            continue
+        id_bytes, points = score
+        receipt = Receipt.from_stored(UUID(bytes=id_bytes), points, entry)
+        processed.append(receipt)
+        results.append(receipt)
+    return results, errors, processed
+
+
+def parse_batch_payload() -> list:
+    """
+    Parse the body of a batch request into a list of receipt entries.
+    Accepts a JSON array, or NDJSON (one receipt per line) when the
+    request uses an NDJSON content type.
+    """
+    if request.mimetype in NDJSON_CONTENT_TYPES:
+        batch = []
+        for line in request.get_data().splitlines():
+            if not line.strip():
+                continue
+            try:
+                batch.append(loads(line))
+            except ValueError as error:
+                batch.append(BatchEntryError(f"Invalid JSON line: {error}"))
+        return batch
+
+    batch = request.get_json(silent=True)
+    if not isinstance(batch, list):
+        raise ValueError("Batch payload must be a JSON array of receipts.")
+    return batch
+
+
+# Bodies over MAX_CONTENT_LENGTH, rejected before they are read
+@api.app_errorhandler(413)
+def request_too_large(error):
+    return {"error": "The request body is too large."}, 413
+
+
+@api.route('/metrics', methods=['GET'])
+def get_metrics():
+    # Metrics in the Prometheus text format
+    return (
+        metrics.registry.render(),
+        200,
+        {"Content-Type": "text/plain; version=0.0.4; charset=utf-8"}
+    )
+
+
+@api.route('/admin/slow-requests', methods=['GET', 'DELETE'])
+def get_slow_requests():
+    # The slowest requests with their stage timings, for the admin only.
+    # Not found when there is no admin token or no recorder.
+    state = get_state()
+    if not current_app.config['ADMIN_TOKEN'] or state.slow_requests is None:
+        return {"error": "Not found."}, 404
+    if not is_admin_token(request.headers.get('X-Admin-Token'),
+                          current_app.config['ADMIN_TOKEN']):
+        return {"error": "Invalid admin token."}, 403
+
+    if request.method == 'DELETE':
+        state.slow_requests.clear()
+        return "", 204
+    return {"requests": state.slow_requests.slowest()}, 200
+
+
+# Save the profile of a profiled request, its file name is sent back in the
+# Profile-File header
+@api.after_app_request
+def save_request_profile(response):
+    profile = g.pop("profile", None)
+    if profile is not None:
+        response.headers['Profile-File'] = \
+            get_state().request_profiler.stop(
+                profile, request.method, request.path)
+    return response
+
+
+# Record the requests and their latency, by endpoint
+@api.after_app_request
+def record_request_metrics(response):
+    # The status of the request, for the slow request recorder
+    g.response_status = response.status_code
+    if metrics.enabled:
+        # The endpoint without the name of the blueprint
+        endpoint = (request.endpoint or "unknown").rpartition(".")[2]
+        REQUESTS.labels(endpoint, str(response.status_code)).inc()
+        start = g.get("request_start")
+        if start is not None:
+            REQUEST_SECONDS.labels(endpoint).observe(
+                time.perf_counter() - start)
+    return response
+
+
+@api.teardown_app_request
 def cleanup(error=None):
     if error:
         app_logger.error(f"Error during shutdown: {error}")
@@ -130,3 +820,12 @@ def cleanup(error=None):
     #     "Cleanup operations go here."
     # )
     app_logger.info("Application/Request context ended.")
+
+    # Record the request if it's one of the slowest, with the time of its
+    # stages up to here (including the log records of the teardown)
+    token = g.pop("stage_trace_token", None)
+    if token is not None:
+        stage_trace.reset(token)
+        get_state().slow_requests.record(
+            time.perf_counter() - g.request_start, request.method,
+            request.path, g.get("response_status"), g.stage_trace)
@@ -0,0 +1,141 @@
+"""
+Receipt Processor API - Logging
+
+Sets up the logging of the application. In the "queue" mode the request
+threads only put the log records in a bounded queue, and a background
+thread writes them to the log file, so the file I/O stays off the
+critical path of the requests.
+
+Written in Python 3.11.5 and Flask 2.3.3
+"""
+import atexit
+import logging
+import os
+import queue
+import random
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from typing import Optional
+from metrics import LOG_RECORD
+
+
+class Dropping_Queue_Handler(QueueHandler):
+    """
+    A queue handler that never blocks the request thread. When the queue is
+    full the new record is dropped and counted: records below WARNING are
+    dropped right away, warnings and errors wait up to `block_timeout`
+    seconds for room in the queue before being dropped.
+    """
+
+    def __init__(self, log_queue: queue.Queue, block_timeout: float = 0.05):
+        super().__init__(log_queue)
+        self.block_timeout = block_timeout
+        self.dropped = 0
+
+    def handle(self, record: logging.LogRecord) -> bool:
+        # Timed as the log_record stage of the request
+        with LOG_RECORD.time():
+            return super().handle(record)
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Snapshot the message, its arguments may change after the request,
+        # but leave the formatting of the record to the writer thread.
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            if record.levelno >= logging.WARNING:
+                self.queue.put(record, timeout=self.block_timeout)
+            else:
+                self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class Timed_File_Handler(RotatingFileHandler):
+    """
+    The rotating file handler of the "sync" mode, where the request threads
+    write the log file: the writes are timed as the log_record stage.
+    """
+
+    def handle(self, record: logging.LogRecord) -> bool:
+        with LOG_RECORD.time():
+            return super().handle(record)
+
+
+class Body_Log_Policy:
+    """
+    Decides which request bodies are logged and how much of them: a body is
+    logged with a probability of `sample_rate`, truncated to `max_bytes`.
+    """
+
+    def __init__(self, sample_rate: float = 1.0, max_bytes: int = 2048):
+        self.sample_rate = sample_rate
+        self.max_bytes = max_bytes
+
+    def should_log(self) -> bool:
+        return self.sample_rate >= 1 or random.random() < self.sample_rate
+
+    def truncate(self, body: bytes) -> bytes:
+        if self.max_bytes and len(body) > self.max_bytes:
+            return body[:self.max_bytes] + \
+                f"... ({len(body)} bytes)".encode()
+        return body
+
+
+def configure_logging(logger: logging.Logger, config) -> Optional[
+        Dropping_Queue_Handler]:
+    """
+    Add the log file handler to the logger, directly ("sync" mode) or
+    behind a queue and a background writer ("queue" mode). Return the
+    queue handler in the queue mode. Without a LOG_FILE nothing is added.
+
+    A logger is only configured once: the apps that share it (like the
+    apps of the tests) share its handlers.
+    """
+    for handler in logger.handlers:
+        if isinstance(handler, Dropping_Queue_Handler):
+            return handler
+        if isinstance(handler, RotatingFileHandler):
+            return None
+
+    log_file = config.get("LOG_FILE", "logs/app.log")
+    if not log_file:
+        return None
+
+    # Configure the logging settings to determine how logs should be handled
+    log_formatter = logging.Formatter(
+        '%(asctime)s - %(levelname)s: %(message)s')
+
+    # Create a rotating file handler to handle the logs in development. The
+    # logging module will not create the folder of the log file.
+    if os.path.dirname(log_file):
+        os.makedirs(os.path.dirname(log_file), exist_ok=True)
+    # In the "sync" mode the writes are made by the request threads, and
+    # timed for their stage traces.
+    mode = config.get("LOG_MODE", "queue")
+    handler_class = (Timed_File_Handler if mode == "sync"
+                     else RotatingFileHandler)
+    file_handler = handler_class(log_file, maxBytes=100000, backupCount=3)
+    file_handler.setFormatter(log_formatter)
+    file_handler.setLevel(logging.DEBUG)
+
+    if mode == "sync":
+        logger.addHandler(file_handler)
+        return None
+    if mode != "queue":
+        raise ValueError(f"Unknown logging mode: {mode}")
+
+    log_queue = queue.Queue(maxsize=int(config.get("LOG_QUEUE_SIZE", 10000)))
+    queue_handler = Dropping_Queue_Handler(log_queue)
+    queue_handler.setLevel(logging.DEBUG)
+    logger.addHandler(queue_handler)
+
+    # The writer thread. It's stopped on exit, after writing the records
+    # still in the queue.
+    listener = QueueListener(
+        log_queue, file_handler, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+    return queue_handler
@@ -0,0 +1,445 @@
+"""
+Receipt Processor API - Receipt Archive
+
+A columnar binary file of the receipts, for the offline analytics. Going
+over the pool for a nightly report builds a Python object for every
+receipt and parses its JSON fields again; the archive stores each field
+once, as a column of fixed-width integers, and the reader memory-maps the
+file, so an aggregation reads only the columns it needs, straight from the
+page cache, without loading the receipts.
+
+Columns of an archive of n receipts with m items, in this order, each one
+aligned to 8 bytes:
+
+    ids                     16 bytes per receipt, the UUID bytes
+    points                  int64 per receipt
+    total_cents             int64 per receipt
+    purchase_days           int32 per receipt, the date.toordinal()
+    retailer_codes          int32 per receipt, index of the retailer name
+    item_offsets            int64 per receipt + 1, the items of receipt i
+                            are the items item_offsets[i]:item_offsets[i+1]
+    item_description_codes  int32 per item, index of the description
+    item_price_cents        int64 per item
+    retailer_offsets        int64 per name + 1, then the UTF-8 names
+    retailer_strings
+    description_offsets     int64 per description + 1, then the UTF-8
+    description_strings     descriptions
+
+The retailers and the descriptions are dictionary-encoded: each distinct
+string is stored once, and the receipts and items store its index. The
+receipts stored without their payload (KEEP_PAYLOAD=false) only have an id
+and points: their other columns are MISSING (-1). The validation only
+checks the format of the dates, so the purchase day of a date that doesn't
+exist (2022-02-30) is MISSING too. The amounts of the receipts have no
+limit: the receipts whose points or cents don't fit in 64 bits are left
+out of the archive, and counted.
+
+    write_archive("receipts.rca", receipt_pool.iter_receipts())
+    with Receipt_Archive("receipts.rca") as archive:
+        archive.totals(by="retailer")  # {"Target": 1234, ...}
+
+The aggregations use NumPy when it's installed, and loops over the zero
+copy memoryviews of the columns when it's not, with the same results.
+
+Written in Python 3.11.5 and Flask 2.3.3
+"""
+import mmap
+import os
+import struct
+import sys
+from array import array
+from datetime import date
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional, Union
+from uuid import UUID
+from points_calculator import parse_cents
+
+# NumPy is optional, it's only needed for the vectorized aggregations
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+ARCHIVE_MAGIC = b"RCPTARC1"
+ARCHIVE_VERSION = 1
+
+# The columns, with the typecode of their values (array and memoryview)
+COLUMNS = {
+    "ids": "B",
+    "points": "q",
+    "total_cents": "q",
+    "purchase_days": "i",
+    "retailer_codes": "i",
+    "item_offsets": "q",
+    "item_description_codes": "i",
+    "item_price_cents": "q",
+    "retailer_offsets": "q",
+    "retailer_strings": "B",
+    "description_offsets": "q",
+    "description_strings": "B",
+}
+
+# The magic, the version, the number of columns, of receipts and of items,
+# followed by the (offset, length) in bytes of each column
+HEADER = struct.Struct("<8sIIQQ")
+SECTION = struct.Struct("<QQ")
+ALIGNMENT = 8
+
+# Value of the columns of the receipts stored without their payload, and
+# of the purchase days of the dates that don't exist
+MISSING = -1
+
+# The columns of the receipts and of the items, with a value per receipt
+# or per item
+RECEIPT_COLUMNS = (
+    "points", "total_cents", "purchase_days", "retailer_codes")
+ITEM_COLUMNS = ("item_description_codes", "item_price_cents")
+
+# Bounds of the 64-bit integer columns
+INT64_MIN = -2 ** 63
+INT64_MAX = 2 ** 63 - 1
+
+# The groups and the values of the aggregations
+GROUPS = ("retailer", "day")
+VALUES = ("points", "total_cents", "receipts")
+
+
+class Archived_Receipt(NamedTuple):
+    """A receipt of an archive, as read by Receipt_Archive.__iter__"""
+    id: UUID
+    points: int
+    total_cents: Optional[int]
+    purchase_date: Optional[date]
+    retailer: Optional[str]
+    # Pairs of (short description, price in cents)
+    items: List[tuple]
+
+
+class String_Dictionary:
+    """
+    The dictionary encoding of a string column: each distinct string gets
+    a code, its index in the table of the distinct strings.
+    """
+
+    def __init__(self):
+        self.codes: Dict[str, int] = {}
+
+    def encode(self, value: str) -> int:
+        code = self.codes.get(value)
+        if code is None:
+            code = self.codes[value] = len(self.codes)
+        return code
+
+    def tables(self) -> tuple:
+        """Get the offsets and the UTF-8 strings of the table"""
+        offsets = array("q", [0])
+        strings = bytearray()
+        # The dictionaries keep their insertion order, the order of codes
+        for value in self.codes:
+            strings += value.encode()
+            offsets.append(len(strings))
+        return offsets, strings
+
+
+def write_archive(path: str, receipts: Iterable) -> tuple:
+    """
+    Write the receipts (Receipt objects, like the ones of iter_receipts)
+    to an archive file. The columns are built in compact arrays, a few
+    bytes per receipt, then written at once. Return the number of receipts
+    written, and of the ones left out because their points or cents don't
+    fit in 64 bits.
+    """
+    columns = {name: array(typecode)
+               for name, typecode in COLUMNS.items()}
+    columns["item_offsets"].append(0)
+    retailers = String_Dictionary()
+    descriptions = String_Dictionary()
+
+    ids = columns["ids"]
+    points = columns["points"]
+    total_cents = columns["total_cents"]
+    purchase_days = columns["purchase_days"]
+    retailer_codes = columns["retailer_codes"]
+    item_offsets = columns["item_offsets"]
+    description_codes = columns["item_description_codes"]
+    price_cents = columns["item_price_cents"]
+
+    skipped = 0
+    for receipt in receipts:
+        data = receipt.data
+        items = []
+        total = MISSING
+        if data is not None:
+            # The stored receipts were validated, their amounts parse
+            total = parse_cents(data["total"])
+            items = [(item["shortDescription"], parse_cents(item["price"]))
+                     for item in data["items"]]
+        if not all(INT64_MIN <= value <= INT64_MAX for value in (
+                receipt.points, total, *(price for _, price in items))):
+            skipped += 1
+            continue
+
+        ids.frombytes(receipt.id.bytes)
+        points.append(receipt.points)
+        total_cents.append(total)
+        if data is None:
+            purchase_days.append(MISSING)
+            retailer_codes.append(MISSING)
+        else:
+            purchase_days.append(purchase_day(data["purchaseDate"]))
+            retailer_codes.append(retailers.encode(data["retailer"]))
+            for description, price in items:
+                description_codes.append(descriptions.encode(description))
+                price_cents.append(price)
+        item_offsets.append(len(price_cents))
+
+    (columns["retailer_offsets"],
+     columns["retailer_strings"]) = retailers.tables()
+    (columns["description_offsets"],
+     columns["description_strings"]) = descriptions.tables()
+
+    count = len(points)
+    temporary_path = path + ".tmp"
+    with open(temporary_path, "wb") as file:
+        # The header is written at the end, once the offsets are known
+        position = HEADER.size + SECTION.size * len(COLUMNS)
+        file.write(bytes(position))
+        sections = []
+        for name in COLUMNS:
+            column = columns[name]
+            if isinstance(column, array) and sys.byteorder != "little":
+                column.byteswap()
+            padding = -position % ALIGNMENT
+            file.write(bytes(padding))
+            position += padding
+            data = memoryview(column).cast("B")
+            file.write(data)
+            sections.append(SECTION.pack(position, len(data)))
+            position += len(data)
+
+        file.seek(0)
+        file.write(HEADER.pack(ARCHIVE_MAGIC, ARCHIVE_VERSION, len(COLUMNS),
+                               count, len(price_cents)))
+        file.write(b"".join(sections))
+    os.replace(temporary_path, path)
+    return count, skipped
+
+
+class Receipt_Archive:
+    """
+    Reads an archive file, memory-mapped. `column(name)` gets a column
+    without copying it: a NumPy array when NumPy is installed (and
+    `use_numpy` is not False), else a memoryview of the integers.
+    """
+
+    def __init__(self, path: str, use_numpy: bool = None):
+        if sys.byteorder != "little":
+            raise ValueError("The receipt archives are little-endian.")
+        if use_numpy is None:
+            use_numpy = numpy is not None
+        elif use_numpy and numpy is None:
+            raise ValueError("NumPy is not installed.")
+        self.path = path
+        self.use_numpy = use_numpy
+        with open(path, "rb") as file:
+            size = os.fstat(file.fileno()).st_size
+            if size < HEADER.size:
+                raise ValueError(f"Not a receipt archive file: {path}")
+            self.data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, column_count, self.count, self.item_count = \
+            HEADER.unpack_from(self.data)
+        if magic != ARCHIVE_MAGIC:
+            self.data.close()
+            raise ValueError(f"Not a receipt archive file: {path}")
+        if version != ARCHIVE_VERSION or column_count != len(COLUMNS) or \
+                size < HEADER.size + SECTION.size * column_count:
+            self.data.close()
+            raise ValueError(f"Unsupported receipt archive file: {path}")
+
+        self.sections = {}
+        for index, name in enumerate(COLUMNS):
+            offset, length = SECTION.unpack_from(
+                self.data, HEADER.size + SECTION.size * index)
+            if offset + length > size:
+                self.data.close()
+                raise ValueError(f"Truncated receipt archive file: {path}")
+            self.sections[name] = (offset, length)
+
+        # The columns hold a value per receipt or per item, of their size
+        expected = {"ids": 16 * self.count,
+                    "item_offsets": 8 * (self.count + 1)}
+        for name in RECEIPT_COLUMNS:
+            expected[name] = array(COLUMNS[name]).itemsize * self.count
+        for name in ITEM_COLUMNS:
+            expected[name] = array(COLUMNS[name]).itemsize * self.item_count
+        if any(self.sections[name][1] != length
+               for name, length in expected.items()):
+            self.data.close()
+            raise ValueError(f"Invalid receipt archive file: {path}")
+
+        self.view = memoryview(self.data)
+        # The views of the columns, released on close
+        self.columns: Dict[str, object] = {}
+        self.retailer_names: Optional[List[str]] = None
+        self.description_names: Optional[List[str]] = None
+
+    def column(self, name: str):
+        """Get a column, a zero copy view of the mapped file"""
+        column = self.columns.get(name)
+        if column is None:
+            offset, length = self.sections[name]
+            typecode = COLUMNS[name]
+            if self.use_numpy:
+                # The array codes of the columns are valid NumPy dtypes
+                column = numpy.frombuffer(
+                    self.data, numpy.dtype(typecode),
+                    length // numpy.dtype(typecode).itemsize, offset)
+            else:
+                column = self.view[offset:offset + length].cast(typecode)
+            self.columns[name] = column
+        return column
+
+    def strings(self, name: str) -> List[str]:
+        """Decode a table of strings, "retailer" or "description" """
+        offsets = self.column(f"{name}_offsets")
+        offset, _ = self.sections[f"{name}_strings"]
+        data = self.data
+        return [data[offset + start:offset + end].decode()
+                for start, end in zip(offsets[:-1], offsets[1:])]
+
+    def retailers(self) -> List[str]:
+        """Get the retailer names, by code"""
+        if self.retailer_names is None:
+            self.retailer_names = self.strings("retailer")
+        return self.retailer_names
+
+    def descriptions(self) -> List[str]:
+        """Get the item descriptions, by code"""
+        if self.description_names is None:
+            self.description_names = self.strings("description")
+        return self.description_names
+
+    def __iter__(self) -> Iterator[Archived_Receipt]:
+        ids = self.column("ids")
+        retailers = self.retailers()
+        descriptions = self.descriptions()
+        item_offsets = self.column("item_offsets")
+        description_codes = self.column("item_description_codes")
+        price_cents = self.column("item_price_cents")
+        rows = zip(self.column("points"), self.column("total_cents"),
+                   self.column("purchase_days"),
+                   self.column("retailer_codes"))
+        for index, (points, cents, day, code) in enumerate(rows):
+            start, end = int(item_offsets[index]), int(item_offsets[index + 1])
+            items = [(descriptions[description], int(price))
+                     for description, price in zip(
+                         description_codes[start:end], price_cents[start:end])]
+            yield Archived_Receipt(
+                UUID(bytes=bytes(ids[index * 16:index * 16 + 16])),
+                int(points),
+                None if cents == MISSING else int(cents),
+                None if day == MISSING else date.fromordinal(int(day)),
+                None if code == MISSING else retailers[code],
+                items)
+
+    def __len__(self) -> int:
+        return self.count
+
+    def totals(self, by: str = "retailer",
+               value: str = "points") -> Dict[Union[str, date], int]:
+        """
+        Sum a value ("points", "total_cents" or "receipts", their count)
+        by retailer or by day of purchase. The receipts without payload
+        are left out, and the dates that don't exist from the days.
+        """
+        if by not in GROUPS:
+            raise ValueError(f"Unknown group: {by}, use one of {GROUPS}.")
+        if value not in VALUES:
+            raise ValueError(f"Unknown value: {value}, use one of {VALUES}.")
+        keys = self.column(
+            "retailer_codes" if by == "retailer" else "purchase_days")
+        values = None if value == "receipts" else self.column(value)
+
+        if self.use_numpy:
+            totals = vectorized_totals(keys, values)
+        else:
+            totals = looped_totals(keys, values)
+        if by == "retailer":
+            names = self.retailers()
+            return {names[code]: total for code, total in totals.items()}
+        return {date.fromordinal(day): total for day, total in totals.items()}
+
+    def close(self):
+        """
+        Release the views and unmap the file. The file stays mapped while
+        the NumPy arrays returned by column() are referenced.
+        """
+        for column in self.columns.values():
+            if isinstance(column, memoryview):
+                column.release()
+        self.columns.clear()
+        self.view.release()
+        try:
+            self.data.close()
+        except BufferError:
+            pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+# Module helper functions
+
+def purchase_day(date_str: str) -> int:
+    """
+    Get the day of a purchase date (a date.toordinal()), MISSING if the
+    date doesn't exist. The validation only checks the format 2022-01-31.
+    """
+    try:
+        return date.fromisoformat(date_str).toordinal()
+    except ValueError:
+        return MISSING
+
+
+def looped_totals(keys, values) -> Dict[int, int]:
+    """
+    Sum the values (or count the keys, if values is None) by key, skipping
+    the MISSING keys, in a loop over the memoryviews
+    """
+    totals: Dict[int, int] = {}
+    get = totals.get
+    if values is None:
+        for key in keys:
+            totals[key] = get(key, 0) + 1
+    else:
+        for key, value in zip(keys, values):
+            totals[key] = get(key, 0) + value
+    totals.pop(MISSING, None)
+    return totals
+
+
+def vectorized_totals(keys, values) -> Dict[int, int]:
+    """
+    Sum the values (or count the keys, if values is None) by key, skipping
+    the MISSING keys, with NumPy
+    """
+    known = keys != MISSING
+    unique_keys, inverse = numpy.unique(keys[known], return_inverse=True)
+    if values is None:
+        sums = numpy.bincount(inverse, minlength=len(unique_keys))
+    else:
+        values = values[known]
+        # The sums are exact in int64, unlike the float64 weights of
+        # bincount past 2**53. When they could overflow, the loop sums
+        # them in Python integers.
+        largest = (max(-int(values.min()), int(values.max()))
+                   if len(values) else 0)
+        if largest * len(values) > INT64_MAX:
+            return looped_totals(keys[known].tolist(), values.tolist())
+        sums = numpy.zeros(len(unique_keys), numpy.int64)
+        numpy.add.at(sums, inverse, values)
+    return dict(zip(unique_keys.tolist(), sums.tolist()))
@@ -0,0 +1,404 @@
+"""
+------------------------------------------------------------------------
+Receipt Processor API - ASGI Application
+Production entry point with an asyncio event loop.
+
+------------------------------------------------------------------------
+
+Serves the same two routes as the Flask application (app.py) as a native
+ASGI application, with the same Receipt and Receipt_Pool classes. Run it
+with N worker processes using uvicorn:
+
+    python asgi.py --workers 4 --port 8000
+
+Each worker is a separate process with its own receipt pool, so with more
+than one worker the receipts must live in a shared store: this entry point
+selects the SQLite backend (RECEIPT_STORAGE=sqlite) and commits every
+write (SQLITE_COMMIT_EVERY=1) unless they are configured otherwise. The
+deferred scoring mode keeps the pending receipts in the worker that
+accepted them, so it needs a single worker.
+
+------------------------------------------------------------------------
+"""
+import argparse
+import asyncio
+import os
+import re
+import time
+from typing import Optional
+from uuid import UUID
+from marshmallow import ValidationError
+from admission import Overloaded, admission_priority
+from idempotency import Idempotency_Conflict, idempotency_key
+from json_provider import dumps, loads
+from receipts import Receipt
+import metrics
+from metrics import (
+    IDEMPOTENT_REPLAYS, PARSE_JSON, POINTS_CACHE_HITS, POINTS_LOOKUPS,
+    POINTS_NOT_FOUND, RECEIPTS_PROCESSED, REQUEST_SECONDS, REQUESTS,
+    VALIDATION_ERRORS
+)
+from points_cache import points_response
+from profiling import stage_trace
+
+
+# Route of the points endpoint
+POINTS_PATH = re.compile(r"^/receipts/([^/]+)/points$")
+
+
+async def application(scope, receive, send):
+    """The ASGI application of the receipt API"""
+    if scope["type"] == "lifespan":
+        await lifespan(receive, send)
+        return
+    if scope["type"] != "http":
+        return
+
+    # Count and time the request by endpoint and status, like the Flask
+    # app, and trace its stages for the slow request recorder of the app,
+    # when it has one
+    from app import app, get_state
+    slow_requests = get_state(app).slow_requests
+    if slow_requests is None and not metrics.enabled:
+        await route(scope, receive, send)
+        return
+
+    token = None
+    if slow_requests is not None:
+        trace = {}
+        token = stage_trace.set(trace)
+    start = time.perf_counter()
+    status = None
+
+    async def send_traced(message):
+        nonlocal status
+        if message["type"] == "http.response.start":
+            status = message["status"]
+        await send(message)
+
+    try:
+        await route(scope, receive, send_traced)
+    finally:
+        duration = time.perf_counter() - start
+        if token is not None:
+            stage_trace.reset(token)
+            slow_requests.record(duration, scope["method"], scope["path"],
+                                 status, trace)
+        if metrics.enabled:
+            # A request that failed before its response is a server error
+            endpoint = endpoint_name(scope["path"])
+            REQUESTS.labels(endpoint, str(status or 500)).inc()
+            REQUEST_SECONDS.labels(endpoint).observe(duration)
+
+
+async def route(scope, receive, send):
+    """
+    Route an HTTP request to its handler, if the admission control of the
+    app admits it: the points reads have priority, and the metrics are
+    never shed.
+    """
+    from app import app, get_state
+    admission = get_state(app).admission
+    priority = admission_priority(scope["path"])
+    if admission is None or priority is None:
+        await dispatch(scope, receive, send)
+        return
+
+    try:
+        admission.acquire(priority)
+    except Overloaded as error:
+        await send_json(send, {"error": str(error)}, error.status, [
+            (b"retry-after", str(admission.retry_after).encode())])
+        return
+    try:
+        await dispatch(scope, receive, send)
+    finally:
+        admission.release()
+
+
+async def dispatch(scope, receive, send):
+    """Send an HTTP request to its handler"""
+    from app import app
+    path = scope["path"]
+    method = scope["method"]
+
+    if path == "/receipts/process":
+        if method != "POST":
+            await send_json(send, {"error": "Method not allowed."}, 405)
+            return
+        body = await read_body(receive, app.config["MAX_CONTENT_LENGTH"])
+        if body is None:
+            await send_json(
+                send, {"error": "The request body is too large."}, 413)
+            return
+        await send_json(send, *await process_receipt(
+            body, get_header(scope, b"idempotency-key").decode("latin-1")))
+        return
+
+    if path == "/metrics" and method == "GET":
+        await send_response(
+            send, metrics.registry.render().encode(), 200,
+            b"text/plain; version=0.0.4; charset=utf-8")
+        return
+
+    match = POINTS_PATH.match(path)
+    if match:
+        if method != "GET":
+            await send_json(send, {"error": "Method not allowed."}, 405)
+            return
+        await send_response(send, *await get_points(
+            match.group(1), get_header(scope, b"if-none-match")))
+        return
+
+    await send_json(send, {"error": "Not found."}, 404)
+
+
+async def process_receipt(body: bytes, idempotency_header: str = "") -> tuple:
+    """
+    Validate, score and store a receipt. Return the response: its content,
+    status and extra headers.
+    """
+    from app import app, get_state, is_pending
+
+    app_logger, receipt_pool = get_app_state()
+    state = get_state(app)
+    deferred_scorer = state.deferred_scorer
+    idempotency_cache = state.idempotency_cache
+
+    try:
+        with PARSE_JSON.time():
+            receipt_data = loads(body)
+    except ValueError:
+        return {"error": "The request body is not valid JSON."}, 400
+
+    # A resubmitted receipt gets the id it got the first time, like in the
+    # Flask app. The cache is local to each worker process.
+    if idempotency_cache is not None:
+        key, fingerprint = idempotency_key(receipt_data, idempotency_header)
+        try:
+            receipt_id = idempotency_cache.get(key, fingerprint)
+        except Idempotency_Conflict as error:
+            return {"error": str(error)}, 422
+
+        if receipt_id is not None and (
+                is_pending(state, receipt_id) or await run_storage(
+                    receipt_pool, receipt_pool.__contains__, receipt_id)):
+            IDEMPOTENT_REPLAYS.inc()
+            return ({"id": str(receipt_id)}, 200,
+                    [(b"idempotent-replayed", b"true")])
+
+    try:
+        if deferred_scorer is not None:
+            # Deferred mode: scored in the background thread of the app
+            receipt_id = deferred_scorer.submit(receipt_data)
+            app_logger.info(f"Accepted receipt with ID: {receipt_id}")
+        else:
+            # Process the receipt: it will assing it an unique id and
+            # calculate the points it was awarded.
+            receipt = Receipt(receipt_data)
+            receipt_id = receipt.id
+            app_logger.info(f"Processed receipt with ID: {receipt.id}")
+
+            # Add the receipt to the receipt pool. Blocking backends run in
+            # a thread, so they don't stall the event loop.
+            await run_storage(
+                receipt_pool, receipt_pool.add_receipt, receipt)
+            RECEIPTS_PROCESSED.inc()
+
+        if idempotency_cache is not None:
+            idempotency_cache.put(key, fingerprint, receipt_id)
+        return {"id": str(receipt_id)}, 200
+
+    except ValidationError as error:
+        VALIDATION_ERRORS.inc()
+        app_logger.warning(f"Validation error occurred: {error}")
+        return {"error": str(error)}, 400
+
+    except Exception:
+        app_logger.exception("An unexpected error occurred.")
+        return {"error": "An error occurred processing the receipt."}, 500
+
+
+async def get_points(receipt_id: str, if_none_match: bytes = b"") -> tuple:
+    """
+    Get the points of a receipt, from the points cache of the app when it
+    has them. Return the body, status, content type and extra headers of
+    the response.
+    """
+    from app import app, get_state
+
+    POINTS_LOOKUPS.inc()
+    _, receipt_pool = get_app_state()
+    points_cache = get_state(app).points_cache
+    deferred_scorer = get_state(app).deferred_scorer
+    response = points_cache.get(receipt_id) if points_cache else None
+    if response is not None:
+        POINTS_CACHE_HITS.inc()
+        receipt_pool.touch(response[2])
+    else:
+        try:
+            parsed_id = UUID(receipt_id, version=4)
+        except ValueError:
+            return error_response("Invalid receipt id.", 400)
+
+        # A receipt still pending in the deferred mode is scored now
+        if deferred_scorer is not None:
+            await run_storage(receipt_pool, deferred_scorer.score, parsed_id)
+
+        receipt = await run_storage(
+            receipt_pool, receipt_pool.get_receipt, parsed_id)
+        if not receipt:
+            error = (deferred_scorer.get_failure(parsed_id)
+                     if deferred_scorer is not None else None)
+            if error is not None:
+                return error_response(error, 422)
+            POINTS_NOT_FOUND.inc()
+            return error_response("Receipt not found.", 404)
+
+        response = points_response(receipt)
+        if points_cache is not None and receipt_id == str(parsed_id):
+            points_cache.put(receipt_id, response)
+            if parsed_id not in receipt_pool:
+                points_cache.discard(receipt_id)
+
+    body, etag, _ = response
+    headers = [
+        (b"etag", f'"{etag}"'.encode()),
+        (b"cache-control", app.config["POINTS_CACHE_CONTROL"].encode()),
+    ]
+    tags = [tag.strip() for tag in if_none_match.split(b",")]
+    if b"*" in tags or f'"{etag}"'.encode() in tags:
+        return b"", 304, b"application/json", headers
+    return body, 200, b"application/json", headers
+
+
+def error_response(message: str, status: int) -> tuple:
+    return (dumps({"error": message}), status,
+            b"application/json", [])
+
+
+def get_app_state() -> tuple:
+    """
+    Get the app logger and the receipt pool of the default app. It's
+    created on first use, in the worker processes only, with the same
+    rules, validator, storage and logging as the Flask application.
+    """
+    from app import app, app_logger, get_state
+    return app_logger, get_state(app).receipt_pool
+
+
+async def run_storage(receipt_pool, function, *args):
+    """Run a receipt pool operation, in a thread if the storage blocks"""
+    if getattr(receipt_pool.data, "blocking", False):
+        return await asyncio.to_thread(function, *args)
+    return function(*args)
+
+
+async def lifespan(receive, send):
+    """Handle the startup and shutdown of the worker"""
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            from app import app, get_state
+            state = get_state(app)
+            # Score the deferred receipts still queued, they were already
+            # accepted, then save the pending writes of the persistent
+            # backends
+            if state.deferred_scorer is not None:
+                await asyncio.to_thread(state.deferred_scorer.stop)
+            state.receipt_pool.close()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+def endpoint_name(path: str) -> str:
+    """The endpoint of a path, named after the view of the Flask app"""
+    if path == "/receipts/process":
+        return "process_receipt"
+    if path == "/metrics":
+        return "get_metrics"
+    if POINTS_PATH.match(path):
+        return "get_points"
+    return "unknown"
+
+
+def get_header(scope, name: bytes) -> bytes:
+    """Get a request header, empty if it's not there"""
+    for header, value in scope.get("headers", ()):
+        if header == name:
+            return value
+    return b""
+
+
+async def read_body(receive, max_bytes: int = None) -> Optional[bytes]:
+    """
+    Read the whole body of the request. None if it's over `max_bytes`, the
+    rest of the body is then left unread.
+    """
+    chunks = []
+    size = 0
+    while True:
+        message = await receive()
+        chunk = message.get("body", b"")
+        size += len(chunk)
+        if max_bytes and size > max_bytes:
+            return None
+        chunks.append(chunk)
+        if not message.get("more_body", False):
+            return b"".join(chunks)
+
+
+async def send_json(send, content: dict, status: int, headers: list = ()):
+    """Send a JSON response"""
+    await send_response(
+        send, dumps(content), status, b"application/json", headers)
+
+
+async def send_response(send, body: bytes, status: int, content_type: bytes,
+                        headers: list = ()):
+    """Send a response"""
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [
+            (b"content-type", content_type),
+            (b"content-length", str(len(body)).encode()),
+            *headers,
+        ],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Run the receipt API on uvicorn with N workers.")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                        help="Number of worker processes (default: cores)")
+    args = parser.parse_args()
+
+    if args.workers > 1:
+        # The workers share the receipts through the SQLite database, and
+        # every write is committed so the other workers can read it.
+        os.environ.setdefault("RECEIPT_STORAGE", "sqlite")
+        os.environ.setdefault("SQLITE_COMMIT_EVERY", "1")
+        if os.environ["RECEIPT_STORAGE"] != "sqlite":
+            parser.error("More than one worker needs RECEIPT_STORAGE=sqlite, "
+                         "the other backends are local to each worker.")
+        # A pending receipt is only known by the worker that accepted it,
+        # the other workers would answer 404 for its id
+        if os.environ.get("SCORING_MODE", "eager") == "deferred":
+            parser.error("SCORING_MODE=deferred needs --workers 1, the "
+                         "pending receipts are local to each worker.")
+
+    # uvicorn is only needed to serve the ASGI application
+    import uvicorn
+    uvicorn.run("asgi:application", host=args.host, port=args.port,
+                workers=args.workers, lifespan="on")
+
+
+if __name__ == "__main__":
+    main()
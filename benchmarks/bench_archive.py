@@ -0,0 +1,142 @@
+"""
+Receipt Processor API - Archive Benchmark
+
+Times a nightly report, the total points by retailer and by day, computed
+over the receipt pool (its Receipt objects and their JSON payloads) and
+over the columnar archive of the same receipts, memory-mapped, with the
+loops of the standard library and, when it's installed, with NumPy. Also
+reports the size of the archive, the time to write it, and the peak of
+the Python memory allocated by each report.
+
+Run it from the project root:
+
+    python -m benchmarks.bench_archive --receipts 200000 --output archive.json
+"""
+import argparse
+import os
+import tempfile
+import time
+import timeit
+import tracemalloc
+from uuid import uuid4
+from benchmarks.common import write_report
+from benchmarks.workload import load_workload
+
+
+def pool_report(receipt_pool, all_receipts: bool = True) -> tuple:
+    """
+    The report over the pool, read with get_all_receipts or with the
+    iterator of the pool
+    """
+    receipts = (receipt_pool.get_all_receipts().values() if all_receipts
+                else receipt_pool.iter_receipts())
+    by_retailer = {}
+    by_day = {}
+    for receipt in receipts:
+        data = receipt.data
+        retailer = data["retailer"]
+        day = data["purchaseDate"]
+        by_retailer[retailer] = by_retailer.get(retailer, 0) + receipt.points
+        by_day[day] = by_day.get(day, 0) + receipt.points
+    return by_retailer, by_day
+
+
+def archive_report(path: str, use_numpy: bool) -> tuple:
+    """The report over the archive file, opened for the report"""
+    from archive import Receipt_Archive
+
+    with Receipt_Archive(path, use_numpy=use_numpy) as archive:
+        return archive.totals("retailer"), archive.totals("day")
+
+
+def peak_memory(function) -> int:
+    """Get the peak of the Python memory allocated by a call, in bytes"""
+    tracemalloc.start()
+    try:
+        function()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def main():
+    import archive
+    from archive import write_archive
+    from points_calculator import Points_Calculator
+    from receipts import Receipt, Receipt_Pool
+
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1])
+    parser.add_argument("--receipts", type=int, default=200000,
+                        help="Receipts of the pool")
+    parser.add_argument("--input",
+                        help="Replay the receipts of an NDJSON file")
+    parser.add_argument("--repeat", type=int, default=5,
+                        help="Runs of each report, the best one counts")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write the results to a JSON file")
+    args = parser.parse_args()
+
+    calculator = Points_Calculator.from_file()
+    receipt_pool = Receipt_Pool()
+    receipt_pool.add_receipts([
+        Receipt.from_stored(uuid4(), calculator.calculate(data), data)
+        for data in load_workload(args.receipts, args.input, args.seed)])
+
+    directory = tempfile.mkdtemp()
+    path = os.path.join(directory, "receipts.rca")
+    start = time.perf_counter()
+    write_archive(path, receipt_pool.iter_receipts())
+    write_seconds = time.perf_counter() - start
+    size = os.path.getsize(path)
+    print(f"Archive of {len(receipt_pool)} receipts: {size:,} bytes "
+          f"({size / len(receipt_pool):.1f} per receipt), written in "
+          f"{write_seconds:.2f} s")
+
+    reports = {
+        "get_all_receipts": lambda: pool_report(receipt_pool),
+        "iter_receipts": lambda: pool_report(receipt_pool, False),
+        "archive loops": lambda: archive_report(path, use_numpy=False),
+    }
+    if archive.numpy is not None:
+        reports["archive numpy"] = lambda: archive_report(path, True)
+
+    # The same report everywhere, the days of the pool are ISO strings
+    retailers, days = reports["archive loops"]()
+    expected = (retailers, {day.isoformat(): total
+                            for day, total in days.items()})
+    for name, report in reports.items():
+        retailers, days = report()
+        days = {str(day): total for day, total in days.items()}
+        if (retailers, days) != expected:
+            raise SystemExit(f"The {name} report differs.")
+
+    # The reports are interleaved in each run, so they share the noise
+    best = dict.fromkeys(reports, float("inf"))
+    for _ in range(args.repeat):
+        for name, report in reports.items():
+            best[name] = min(best[name], timeit.timeit(report, number=1))
+
+    results = []
+    print(f"{'report':<18}{'ms':>10}{'ns/receipt':>12}{'peak KiB':>12}")
+    for name, report in reports.items():
+        peak = peak_memory(report)
+        per_receipt = best[name] / len(receipt_pool)
+        results.append({
+            "report": name,
+            "ms": round(best[name] * 1000, 2),
+            "ns_per_receipt": round(per_receipt * 1e9, 1),
+            "peak_bytes": peak,
+        })
+        print(f"{name:<18}{best[name] * 1000:>10.1f}"
+              f"{per_receipt * 1e9:>12,.0f}{peak / 1024:>12,.0f}")
+
+    os.remove(path)
+    os.rmdir(directory)
+    if args.output:
+        write_report(args.output, "archive", results, {
+            **vars(args), "archive_bytes": size,
+            "write_seconds": round(write_seconds, 3)})
+
+
+if __name__ == "__main__":
+    main()
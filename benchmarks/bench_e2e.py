@@ -0,0 +1,150 @@
+"""
+Receipt Processor API - End-to-end Benchmark
+
+Replays or synthesizes a receipt workload against the API and reports the
+p50/p90/p99 latencies and the requests per second of each endpoint. The
+requests go to the Flask test client (in process), or to a live server
+with --url.
+
+Run it from the project root:
+
+    python -m benchmarks.bench_e2e --receipts 2000 --output e2e.json
+    python -m benchmarks.bench_e2e --url http://localhost:5000 \\
+        --concurrency 8 --input receipts.ndjson
+
+Compare a run against a previous report with --baseline; the command
+exits with an error if a p99 latency got worse than --threshold.
+"""
+import argparse
+import json
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Tuple
+from benchmarks.common import (
+    compare_reports, summarize_latencies, write_report
+)
+from benchmarks.workload import load_workload
+
+
+def test_client_sender() -> Callable:
+    """Send the requests to the Flask test client, one per thread"""
+    from app import app
+    clients = threading.local()
+
+    def send(method: str, path: str, body: bytes = None) -> Tuple[int, dict]:
+        if not hasattr(clients, "client"):
+            clients.client = app.test_client()
+        response = clients.client.open(
+            path, method=method, data=body,
+            content_type="application/json")
+        return response.status_code, response.get_json(silent=True)
+    return send
+
+
+def live_sender(url: str) -> Callable:
+    """Send the requests to a live server"""
+    def send(method: str, path: str, body: bytes = None) -> Tuple[int, dict]:
+        request = urllib.request.Request(
+            url.rstrip("/") + path, data=body, method=method,
+            headers={"Content-Type": "application/json"})
+        try:
+            with urllib.request.urlopen(request) as response:
+                return response.status, json.loads(response.read())
+        except urllib.error.HTTPError as error:
+            return error.code, None
+    return send
+
+
+def run_phase(send: Callable, requests: List[tuple],
+              concurrency: int) -> Tuple[List[float], list, float]:
+    """
+    Send the requests with `concurrency` threads. Return the latencies,
+    the responses and the elapsed time.
+    """
+    def timed(request):
+        start = time.perf_counter()
+        response = send(*request)
+        return time.perf_counter() - start, response
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(timed, requests))
+    elapsed = time.perf_counter() - start
+    return [latency for latency, _ in results], [
+        response for _, response in results], elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1])
+    parser.add_argument("--receipts", type=int, default=2000,
+                        help="Number of receipts to process")
+    parser.add_argument("--input", help="NDJSON file of receipts to replay")
+    parser.add_argument("--reads", type=int, default=1,
+                        help="GET /points requests per processed receipt")
+    parser.add_argument("--url", help="Base URL of a live server")
+    parser.add_argument("--concurrency", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write the results to a JSON file")
+    parser.add_argument("--baseline", help="JSON report to compare with")
+    parser.add_argument("--threshold", type=float, default=0.1,
+                        help="Allowed p99 increase against the baseline")
+    args = parser.parse_args()
+
+    send = live_sender(args.url) if args.url else test_client_sender()
+    receipts = load_workload(args.receipts, args.input, args.seed)
+    results = []
+
+    # Process the receipts
+    latencies, responses, elapsed = run_phase(send, [
+        ("POST", "/receipts/process", json.dumps(receipt).encode())
+        for receipt in receipts
+    ], args.concurrency)
+    errors = sum(1 for status, _ in responses if status != 200)
+    results.append(dict(
+        endpoint="POST /receipts/process", errors=errors,
+        **summarize_latencies(latencies, elapsed)))
+    all_latencies, total_elapsed = list(latencies), elapsed
+
+    # Read the points of the processed receipts
+    ids = [body["id"] for status, body in responses if status == 200]
+    if ids and args.reads:
+        latencies, responses, elapsed = run_phase(send, [
+            ("GET", f"/receipts/{receipt_id}/points")
+            for receipt_id in ids for _ in range(args.reads)
+        ], args.concurrency)
+        errors = sum(1 for status, _ in responses if status != 200)
+        results.append(dict(
+            endpoint="GET /receipts/{id}/points", errors=errors,
+            **summarize_latencies(latencies, elapsed)))
+        all_latencies += latencies
+        total_elapsed += elapsed
+
+    results.append(dict(
+        endpoint="all", errors=sum(result["errors"] for result in results),
+        **summarize_latencies(all_latencies, total_elapsed)))
+
+    print(f"{'endpoint':<28}{'req/s':>10}{'p50 ms':>10}{'p99 ms':>10}"
+          f"{'errors':>8}")
+    for result in results:
+        print(f"{result['endpoint']:<28}{result['requests_per_second']:>10}"
+              f"{result['p50_ms']:>10.3f}{result['p99_ms']:>10.3f}"
+              f"{result['errors']:>8}")
+
+    if args.output:
+        write_report(args.output, "e2e", results, vars(args))
+
+    if args.baseline:
+        regressions = compare_reports(
+            args.baseline, results, "endpoint", "p99_ms", args.threshold)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""
+Receipt Processor API - JSON Benchmark
+
+Times the JSON work of the requests with each JSON library (orjson, when
+installed, and the standard library): decoding the sample receipts of the
+test suite, encoding the {"id": ...} responses, and whole POST
+/receipts/process requests with the Flask test client.
+
+Run it from the project root:
+
+    python -m benchmarks.bench_json --repeat 5 --output json.json
+"""
+import argparse
+import json
+import timeit
+from benchmarks.common import write_report
+from benchmarks.workload import SAMPLE_RECEIPTS
+
+
+def get_benchmarks(bodies: list) -> dict:
+    """Get the functions to time, each one runs over all the bodies"""
+    from app import app
+    from json_provider import dumps, loads
+
+    client = app.test_client()
+    response = {"id": "7fb1377b-b223-49d9-a31a-5a02701dd310"}
+
+    def decode():
+        for body in bodies:
+            loads(body)
+
+    def encode():
+        for _ in bodies:
+            dumps(response)
+
+    def process():
+        for body in bodies:
+            client.post("/receipts/process", data=body,
+                        content_type="application/json")
+
+    return {"decode": decode, "encode": encode, "process": process}
+
+
+def main():
+    from json_provider import JSON_LIBRARIES, orjson, set_json_library
+
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1])
+    parser.add_argument("--copies", type=int, default=1000,
+                        help="Copies of the sample receipts per run")
+    parser.add_argument("--repeat", type=int, default=5,
+                        help="Runs of each benchmark, the best one counts")
+    parser.add_argument("--output", help="Write the results to a JSON file")
+    args = parser.parse_args()
+
+    bodies = [json.dumps(receipt).encode()
+              for receipt in SAMPLE_RECEIPTS] * args.copies
+    libraries = [name for name in JSON_LIBRARIES[1:]
+                 if name != "orjson" or orjson is not None]
+
+    results = []
+    print(f"{'library':<10}{'benchmark':<12}{'ns/receipt':>14}"
+          f"{'receipts/s':>14}")
+    for library in libraries:
+        set_json_library(library)
+        for name, function in get_benchmarks(bodies).items():
+            best = min(timeit.repeat(function, number=1, repeat=args.repeat))
+            per_receipt = best / len(bodies)
+            results.append({
+                "library": library,
+                "benchmark": name,
+                "ns_per_receipt": round(per_receipt * 1e9, 1),
+                "receipts_per_second": round(1 / per_receipt),
+            })
+            print(f"{library:<10}{name:<12}{per_receipt * 1e9:>14,.0f}"
+                  f"{1 / per_receipt:>14,.0f}")
+
+    if args.output:
+        write_report(args.output, "json", results, vars(args))
+
+
+if __name__ == "__main__":
+    main()
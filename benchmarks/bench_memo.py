@@ -0,0 +1,132 @@
+"""
+Receipt Processor API - Memo Cache Benchmark
+
+Times the points calculation with and without the memo caches of the
+retailer alphanumeric counts and the description lengths, on a skewed
+workload: the retailers and the descriptions are drawn from vocabularies
+with Zipf-like frequencies, so a few of them come back most of the time,
+like the big retailers and their best sellers.
+
+Run it from the project root:
+
+    python -m benchmarks.bench_memo --receipts 50000 --output memo.json
+
+The receipts are decoded from JSON, so their strings are new objects with
+no cached hash, like the ones of the requests.
+"""
+import argparse
+import json
+import random
+import timeit
+from benchmarks.common import write_report
+from benchmarks.workload import synthesize
+
+
+# Memo sizes compared, as (retailer, description) maximum entries
+MEMO_CONFIGS = {
+    "no memo": (0, 0),
+    "retailer memo": (65536, 0),
+    "both memos": (65536, 65536),
+}
+
+
+def zipf_choices(rng: random.Random, vocabulary: list, count: int,
+                 exponent: float) -> list:
+    """Draw `count` words, the k-th one with a weight of 1 / k**exponent"""
+    weights = [1 / rank ** exponent for rank in range(1, len(vocabulary) + 1)]
+    return rng.choices(vocabulary, weights, k=count)
+
+
+def skewed_workload(count: int, retailers: int, descriptions: int,
+                    exponent: float, seed: int = 0) -> list:
+    """
+    Get `count` receipts with retailers and descriptions from vocabularies
+    of the given sizes, with Zipf-like frequencies
+    """
+    rng = random.Random(seed)
+    retailer_names = [f"Retailer & Sons #{rank} Market"
+                      for rank in range(retailers)]
+    description_names = [f"  Product {rank} - 12 FL OZ  "
+                         for rank in range(descriptions)]
+
+    receipts = list(synthesize(count, seed))
+    names = iter(zipf_choices(rng, retailer_names, count, exponent))
+    item_count = sum(len(receipt["items"]) for receipt in receipts)
+    items = iter(zipf_choices(rng, description_names, item_count, exponent))
+    for receipt in receipts:
+        receipt["retailer"] = next(names)
+        for item in receipt["items"]:
+            item["shortDescription"] = next(items)
+    # New strings, as decoded from the request bodies
+    return [json.loads(json.dumps(receipt)) for receipt in receipts]
+
+
+def main():
+    from points_calculator import (
+        Points_Calculator, description_memo, memo_stats, retailer_memo,
+        set_memo_sizes
+    )
+
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1])
+    parser.add_argument("--receipts", type=int, default=50000,
+                        help="Receipts of the workload")
+    parser.add_argument("--retailers", type=int, default=10000,
+                        help="Distinct retailers of the workload")
+    parser.add_argument("--descriptions", type=int, default=50000,
+                        help="Distinct item descriptions of the workload")
+    parser.add_argument("--exponent", type=float, default=1.1,
+                        help="Skew of the frequencies (0 for uniform)")
+    parser.add_argument("--repeat", type=int, default=5,
+                        help="Runs of each benchmark, the best one counts")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write the results to a JSON file")
+    args = parser.parse_args()
+
+    receipts = skewed_workload(args.receipts, args.retailers,
+                               args.descriptions, args.exponent, args.seed)
+    calculator = Points_Calculator.from_file()
+    previous = (retailer_memo.max_size, description_memo.max_size)
+
+    def calculate():
+        for receipt in receipts:
+            calculator.calculate(receipt)
+
+    # The configurations are interleaved in each run, so they share the
+    # noise of the machine. Each run starts with a warm-up of the caches.
+    best = dict.fromkeys(MEMO_CONFIGS, float("inf"))
+    stats = {}
+    try:
+        for _ in range(args.repeat):
+            for name, sizes in MEMO_CONFIGS.items():
+                set_memo_sizes(*sizes)
+                calculate()
+                best[name] = min(best[name], timeit.timeit(calculate,
+                                                           number=1))
+                stats[name] = memo_stats()
+    finally:
+        set_memo_sizes(*previous)
+
+    results = []
+    print(f"{'memo':<16}{'ns/receipt':>14}{'receipts/s':>14}"
+          f"{'retailer hits':>16}{'description hits':>18}")
+    for name in MEMO_CONFIGS:
+        per_receipt = best[name] / len(receipts)
+        retailer = stats[name]["retailer"]["hit_ratio"]
+        description = stats[name]["description"]["hit_ratio"]
+        results.append({
+            "memo": name,
+            "ns_per_receipt": round(per_receipt * 1e9, 1),
+            "receipts_per_second": round(1 / per_receipt),
+            "retailer_hit_ratio": round(retailer, 4),
+            "description_hit_ratio": round(description, 4),
+        })
+        print(f"{name:<16}{per_receipt * 1e9:>14,.0f}"
+              f"{1 / per_receipt:>14,.0f}{retailer:>16.1%}"
+              f"{description:>18.1%}")
+
+    if args.output:
+        write_report(args.output, "memo", results, vars(args))
+
+
+if __name__ == "__main__":
+    main()
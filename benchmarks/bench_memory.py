@@ -0,0 +1,123 @@
+"""
+Receipt Processor API - Memory Benchmark
+
+Compares the memory used by the receipt pool storage layouts: today's
+dictionary of Receipt objects ("memory"), and the packed columns of the
+"compact" backend, with and without the compressed payloads.
+
+Each measurement runs in its own process, so the sizes don't interfere.
+Run it from the project root:
+
+    python -m benchmarks.bench_memory --sizes 1000000,10000000
+
+Note that the dictionary layout keeps a payload dictionary per receipt
+and needs around 26 GB of memory for 10M receipts.
+"""
+import argparse
+import json
+import resource
+import subprocess
+import sys
+import time
+from uuid import uuid4
+from benchmarks.common import write_report
+
+
+# Receipt used as the payload of every stored receipt
+SAMPLE_RECEIPT = json.dumps({
+    "retailer": "M&M Corner Market",
+    "purchaseDate": "2022-03-20",
+    "purchaseTime": "14:33",
+    "items": [
+        {"shortDescription": "Gatorade", "price": "2.25"},
+        {"shortDescription": "Gatorade", "price": "2.25"},
+        {"shortDescription": "Gatorade", "price": "2.25"},
+        {"shortDescription": "Gatorade", "price": "2.25"}
+    ],
+    "total": "9.00"
+})
+
+LAYOUTS = ("memory", "compact", "compact+payload")
+
+
+def current_rss() -> int:
+    """Get the resident memory of the process in bytes"""
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * resource.getpagesize()
+    except OSError:
+        # Peak memory (in KB on Linux, in bytes on macOS) as a fallback
+        usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return usage if sys.platform == "darwin" else usage * 1024
+
+
+def measure(layout: str, size: int) -> dict:
+    """Fill a storage backend with receipts and measure its memory"""
+    from receipts import Receipt
+    from storage import Compact_Storage, Dict_Storage
+
+    before = current_rss()
+    if layout == "memory":
+        storage = Dict_Storage()
+    else:
+        storage = Compact_Storage(
+            store_payload=layout == "compact+payload", capacity=size)
+
+    start = time.perf_counter()
+    for points in range(size):
+        # A new payload per receipt, like the ones parsed from the requests
+        receipt = Receipt.from_stored(
+            uuid4(), points % 1000, json.loads(SAMPLE_RECEIPT))
+        storage.add(receipt)
+    elapsed = time.perf_counter() - start
+    used = current_rss() - before
+
+    return {
+        "layout": layout,
+        "receipts": size,
+        "bytes": used,
+        "bytes_per_receipt": round(used / size, 1),
+        "seconds": round(elapsed, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1])
+    parser.add_argument("--sizes", default="1000000,10000000",
+                        help="Comma separated numbers of receipts")
+    parser.add_argument("--layouts", default=",".join(LAYOUTS),
+                        help="Comma separated storage layouts")
+    parser.add_argument("--output", help="Write the results to a JSON file")
+    parser.add_argument("--child", nargs=2, metavar=("LAYOUT", "SIZE"),
+                        help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        layout, size = args.child
+        print(json.dumps(measure(layout, int(size))))
+        return
+
+    results = []
+    print(f"{'layout':<18}{'receipts':>12}{'MB':>10}{'B/receipt':>12}")
+    for size in [int(size) for size in args.sizes.split(",")]:
+        for layout in args.layouts.split(","):
+            process = subprocess.run(
+                [sys.executable, "-m", "benchmarks.bench_memory",
+                 "--child", layout, str(size)],
+                capture_output=True, text=True
+            )
+            if process.returncode != 0:
+                print(f"{layout:<18}{size:>12}  failed: "
+                      f"{process.stderr.strip().splitlines()[-1:]}")
+                continue
+            result = json.loads(process.stdout)
+            results.append(result)
+            print(f"{layout:<18}{size:>12}{result['bytes'] / 2**20:>10.1f}"
+                  f"{result['bytes_per_receipt']:>12}")
+
+    if args.output:
+        write_report(args.output, "memory", results, vars(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+"""
+Receipt Processor API - Micro-benchmarks
+
+Times the building blocks of the receipt processing on a workload of
+receipts: Receipt.validate_receipt (with each validator),
+Receipt.calculate_points, the whole Receipt constructor and the helper
+functions of the receipts module.
+
+Run it from the project root:
+
+    python -m benchmarks.bench_micro --receipts 1000 --output micro.json
+
+Compare a run against a previous report with --baseline; the command
+exits with an error if a benchmark got slower than --threshold.
+"""
+import argparse
+import sys
+import timeit
+from benchmarks.common import compare_reports, write_report
+from benchmarks.workload import load_workload
+
+
+def get_benchmarks(receipts: list) -> dict:
+    """Get the functions to time, each one runs over all the receipts"""
+    from receipts import (
+        Receipt, count_alphanumeric, get_day, has_zero_cents,
+        set_receipt_validator, split_time
+    )
+
+    # A receipt instance to call the methods with
+    receipt = Receipt(receipts[0])
+
+    def validate(name):
+        def run():
+            set_receipt_validator(name)
+            for data in receipts:
+                receipt.validate_receipt(data)
+        return run
+
+    def calculate_points():
+        for data in receipts:
+            receipt.calculate_points(data)
+
+    def create_receipt(name):
+        def run():
+            set_receipt_validator(name)
+            for data in receipts:
+                Receipt(data)
+        return run
+
+    def helpers(function, field):
+        def run():
+            for data in receipts:
+                function(data[field])
+        return run
+
+    return {
+        "validate_receipt[fast]": validate("fast"),
+        "validate_receipt[marshmallow]": validate("marshmallow"),
+        "calculate_points": calculate_points,
+        "Receipt[fast]": create_receipt("fast"),
+        "Receipt[marshmallow]": create_receipt("marshmallow"),
+        "count_alphanumeric": helpers(count_alphanumeric, "retailer"),
+        "has_zero_cents": helpers(has_zero_cents, "total"),
+        "get_day": helpers(get_day, "purchaseDate"),
+        "split_time": helpers(split_time, "purchaseTime"),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1])
+    parser.add_argument("--receipts", type=int, default=1000,
+                        help="Number of receipts in the workload")
+    parser.add_argument("--input", help="NDJSON file of receipts to replay")
+    parser.add_argument("--repeat", type=int, default=5,
+                        help="Runs of each benchmark, the best one counts")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write the results to a JSON file")
+    parser.add_argument("--baseline", help="JSON report to compare with")
+    parser.add_argument("--threshold", type=float, default=0.1,
+                        help="Allowed slowdown against the baseline")
+    args = parser.parse_args()
+
+    receipts = load_workload(args.receipts, args.input, args.seed)
+    results = []
+    print(f"{'benchmark':<32}{'ns/receipt':>14}{'receipts/s':>14}")
+    for name, function in get_benchmarks(receipts).items():
+        best = min(timeit.repeat(function, number=1, repeat=args.repeat))
+        per_receipt = best / len(receipts)
+        results.append({
+            "benchmark": name,
+            "ns_per_receipt": round(per_receipt * 1e9, 1),
+            "receipts_per_second": round(1 / per_receipt),
+        })
+        print(f"{name:<32}{per_receipt * 1e9:>14,.0f}"
+              f"{1 / per_receipt:>14,.0f}")
+
+    if args.output:
+        write_report(args.output, "micro", results, vars(args))
+
+    if args.baseline:
+        regressions = compare_reports(
+            args.baseline, results, "benchmark", "ns_per_receipt",
+            args.threshold)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,164 @@
+"""
+Receipt Processor API - Overload Benchmark
+
+Overloads the app with more concurrent requests than it can serve, with
+and without the admission control, and reports the latency of the
+admitted requests and the number of shed ones, for the writes (POST
+/receipts/process) and the reads (GET /receipts/{id}/points).
+
+Each client is a thread that calls the WSGI app directly, like the worker
+threads of a server with one thread per connection, and sends its
+requests one after the other. Without admission control every client is
+in flight and each request shares the interpreter with all the others;
+with it the shed requests get a fast 429/503 and their clients wait for
+the Retry-After, so the latency of the admitted requests stays bounded.
+
+Run it from the project root:
+
+    python -m benchmarks.bench_overload --clients 64 --seconds 5 \\
+        --max-in-flight 8 --reserved 2 --output overload.json
+"""
+import argparse
+import io
+import json
+import random
+import threading
+import time
+from collections import defaultdict
+from typing import Callable, List, Tuple
+from werkzeug.test import EnvironBuilder
+from benchmarks.common import summarize_latencies, write_report
+from benchmarks.workload import load_workload
+
+
+def make_requests(count: int, read_ratio: float, bodies: list, ids: list,
+                  seed: int = 0) -> List[Tuple[str, dict, bytes]]:
+    """Build the (kind, WSGI environ, body) of `count` requests"""
+    rng = random.Random(seed)
+    requests = []
+    for _ in range(count):
+        if rng.random() < read_ratio:
+            builder = EnvironBuilder(
+                path=f"/receipts/{rng.choice(ids)}/points")
+            requests.append(("read", builder.get_environ(), b""))
+        else:
+            body = rng.choice(bodies)
+            builder = EnvironBuilder(
+                path="/receipts/process", method="POST", data=body,
+                content_type="application/json")
+            requests.append(("write", builder.get_environ(), body))
+    return requests
+
+
+def call(wsgi_app: Callable, environ: dict, body: bytes) -> Tuple[int, dict]:
+    """Call the WSGI app with a request, get the status and the headers"""
+    responses = []
+
+    def start_response(status, headers, exc_info=None):
+        responses.append((int(status.split()[0]), dict(headers)))
+
+    response = wsgi_app(dict(environ, **{"wsgi.input": io.BytesIO(body)}),
+                        start_response)
+    try:
+        for _ in response:
+            pass
+    finally:
+        if hasattr(response, "close"):
+            response.close()
+    return responses[0]
+
+
+def run_clients(wsgi_app: Callable, clients: int, seconds: float,
+                requests: list, seed: int = 0) -> dict:
+    """
+    Send requests from `clients` threads for `seconds`, each one after the
+    other. A shed client waits for the Retry-After. Get the latencies by
+    (kind, outcome).
+    """
+    latencies = defaultdict(list)
+    start = threading.Barrier(clients)
+    deadline = time.perf_counter() + seconds
+
+    def client(number: int):
+        rng = random.Random(seed + number)
+        start.wait()
+        while time.perf_counter() < deadline:
+            kind, environ, body = rng.choice(requests)
+            sent = time.perf_counter()
+            status, headers = call(wsgi_app, environ, body)
+            shed = status in (429, 503)
+            # list.append is atomic, the threads share the lists
+            latencies[(kind, "shed" if shed else "admitted")].append(
+                time.perf_counter() - sent)
+            if shed:
+                time.sleep(float(headers["Retry-After"]))
+
+    threads = [threading.Thread(target=client, args=(number,))
+               for number in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies
+
+
+def main():
+    from app import create_app
+
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1])
+    parser.add_argument("--clients", type=int, default=64,
+                        help="Concurrent clients, one thread each")
+    parser.add_argument("--seconds", type=float, default=5,
+                        help="Duration of each run")
+    parser.add_argument("--read-ratio", type=float, default=0.5,
+                        help="Fraction of the requests that are reads")
+    parser.add_argument("--max-in-flight", type=int, default=8,
+                        help="MAX_IN_FLIGHT of the run with admission")
+    parser.add_argument("--reserved", type=int, default=2,
+                        help="ADMISSION_RESERVED of the run with admission")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write the results to a JSON file")
+    args = parser.parse_args()
+
+    bodies = [json.dumps(receipt).encode()
+              for receipt in load_workload(1000, seed=args.seed)]
+    runs = {
+        "no admission": {"MAX_IN_FLIGHT": 0},
+        "admission": {"MAX_IN_FLIGHT": args.max_in_flight,
+                      "ADMISSION_RESERVED": args.reserved},
+    }
+
+    results = []
+    print(f"{'run':<14}{'requests':<16}{'count':>8}{'req/s':>10}"
+          f"{'p50 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    for run, config in runs.items():
+        flask_app = create_app({**config, "LOG_FILE": ""})
+        client = flask_app.test_client()
+        ids = [client.post("/receipts/process", data=body,
+                           content_type="application/json").get_json()["id"]
+               for body in bodies[:100]]
+        requests = make_requests(
+            1000, args.read_ratio, bodies, ids, args.seed)
+        latencies = run_clients(
+            flask_app, args.clients, args.seconds, requests, args.seed)
+
+        for kind in ("write", "read"):
+            for outcome in ("admitted", "shed"):
+                if not latencies[(kind, outcome)]:
+                    continue
+                summary = summarize_latencies(
+                    latencies[(kind, outcome)], args.seconds)
+                results.append({"run": run, "kind": kind,
+                                "outcome": outcome, **summary})
+                print(f"{run:<14}{kind + ' ' + outcome:<16}"
+                      f"{summary['requests']:>8}"
+                      f"{summary['requests_per_second']:>10}"
+                      f"{summary['p50_ms']:>10.2f}{summary['p99_ms']:>10.2f}"
+                      f"{summary['max_ms']:>10.2f}")
+
+    if args.output:
+        write_report(args.output, "overload", results, vars(args))
+
+
+if __name__ == "__main__":
+    main()
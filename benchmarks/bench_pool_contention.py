@@ -0,0 +1,107 @@
+"""
+Receipt Processor API - Pool Contention Benchmark
+
+Measures the throughput of the receipt pool storage backends when several
+threads add and get receipts at the same time, from 1 to 32 threads.
+
+Run it from the project root:
+
+    python -m benchmarks.bench_pool_contention --operations 200000
+
+Each thread adds its share of receipts in bulks and reads back a random
+sample of the receipts stored so far, like a threaded WSGI server with a
+mix of POST /receipts/process and GET /receipts/{id}/points requests.
+"""
+import argparse
+import random
+import threading
+import time
+from uuid import uuid4
+from benchmarks.common import write_report
+
+
+def run(backend: str, threads: int, operations: int, bulk: int,
+        shards: int) -> dict:
+    """Run the workload on a backend and measure its throughput"""
+    from receipts import Receipt
+    from storage import create_storage
+
+    storage = create_storage(
+        {"RECEIPT_STORAGE": backend, "RECEIPT_SHARDS": shards})
+    per_thread = operations // threads
+    # Prepare the receipts beforehand, the benchmark only times the pool
+    work = [
+        [Receipt.from_stored(uuid4(), 10, None) for _ in range(per_thread)]
+        for _ in range(threads)
+    ]
+    barrier = threading.Barrier(threads + 1)
+
+    def worker(receipts):
+        rng = random.Random()
+        barrier.wait()
+        for start in range(0, len(receipts), bulk):
+            group = receipts[start:start + bulk]
+            if bulk > 1:
+                storage.add_many(group)
+                storage.get_many([
+                    receipts[rng.randrange(start + len(group))].id
+                    for _ in group
+                ])
+            else:
+                storage.add(group[0])
+                storage.get(receipts[rng.randrange(start + 1)].id)
+
+    workers = [
+        threading.Thread(target=worker, args=(receipts,))
+        for receipts in work
+    ]
+    for thread in workers:
+        thread.start()
+    barrier.wait()
+    start = time.perf_counter()
+    for thread in workers:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    # Every receipt is added once and read once
+    total = per_thread * threads * 2
+    return {
+        "backend": backend,
+        "threads": threads,
+        "bulk": bulk,
+        "operations": total,
+        "seconds": round(elapsed, 4),
+        "ops_per_second": round(total / elapsed),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1])
+    parser.add_argument("--operations", type=int, default=200000,
+                        help="Receipts added (and read) per run")
+    parser.add_argument("--threads", default="1,2,4,8,16,32",
+                        help="Comma separated numbers of threads")
+    parser.add_argument("--backends", default="memory,sharded",
+                        help="Comma separated storage backends")
+    parser.add_argument("--bulk", type=int, default=1,
+                        help="Receipts per add/get call (1 = single calls)")
+    parser.add_argument("--shards", type=int, default=16)
+    parser.add_argument("--output", help="Write the results to a JSON file")
+    args = parser.parse_args()
+
+    results = []
+    print(f"{'backend':<10}{'threads':>8}{'bulk':>6}{'ops/s':>14}")
+    for backend in args.backends.split(","):
+        for threads in [int(count) for count in args.threads.split(",")]:
+            result = run(backend, threads, args.operations, args.bulk,
+                         args.shards)
+            results.append(result)
+            print(f"{backend:<10}{threads:>8}{args.bulk:>6}"
+                  f"{result['ops_per_second']:>14,}")
+
+    if args.output:
+        write_report(args.output, "pool_contention", results, vars(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+"""
+Receipt Processor API - Scoring Pool Benchmark
+
+Measures the throughput of the scoring pool, validating and scoring the
+same receipts with 0 (in this process), 1, 2, 4 and 8 worker processes.
+
+Run it from the project root:
+
+    python -m benchmarks.bench_scoring --receipts 200000
+
+The workers are started before the timing, like the warm pool of the app,
+so the runs only measure the scoring and the transfer of the chunks.
+"""
+import argparse
+import time
+from benchmarks.common import write_report
+from benchmarks.workload import synthesize
+
+
+def run(workers: int, payloads: list, chunk_size: int) -> dict:
+    """Score the receipts with some workers and measure the throughput"""
+    from scoring import Scoring_Pool
+
+    scoring_pool = Scoring_Pool(workers, chunk_size=chunk_size)
+    try:
+        start = time.perf_counter()
+        scoring_pool.score(payloads)
+        elapsed = time.perf_counter() - start
+    finally:
+        scoring_pool.close()
+
+    return {
+        "workers": workers,
+        "chunk_size": chunk_size,
+        "receipts": len(payloads),
+        "seconds": round(elapsed, 4),
+        "receipts_per_second": round(len(payloads) / elapsed),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1])
+    parser.add_argument("--receipts", type=int, default=200000,
+                        help="Receipts scored per run")
+    parser.add_argument("--workers", default="0,1,2,4,8",
+                        help="Comma separated numbers of worker processes")
+    parser.add_argument("--chunk-size", type=int, default=1000)
+    parser.add_argument("--output", help="Write the results to a JSON file")
+    args = parser.parse_args()
+
+    payloads = list(synthesize(args.receipts))
+    results = []
+    print(f"{'workers':>8}{'receipts/s':>14}")
+    for workers in [int(count) for count in args.workers.split(",")]:
+        result = run(workers, payloads, args.chunk_size)
+        results.append(result)
+        print(f"{workers:>8}{result['receipts_per_second']:>14,}")
+
+    if args.output:
+        write_report(args.output, "scoring", results, vars(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""
+Receipt Processor API - Startup Benchmark
+
+Measures the cold start of the application, in fresh processes: the time
+to import the app module, to create the app with create_app, and to serve
+the first request (a POST /receipts/process of a sample receipt), with
+the time from the start of the process to the first response.
+
+Run it from the project root:
+
+    python -m benchmarks.bench_startup --runs 10 --output startup.json
+
+The settings come from the environment, like the app, so the storage
+backends and the other options can be compared (RECEIPT_STORAGE=sqlite,
+SCORING_WORKERS=2, ...).
+"""
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+import time
+from benchmarks.common import write_report
+from benchmarks.workload import SAMPLE_RECEIPTS
+
+
+# Run in a fresh interpreter for each measure, it prints the timings
+STARTUP_SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+import app as app_module
+imported = time.perf_counter()
+app = app_module.create_app()
+created = time.perf_counter()
+response = app.test_client().post("/receipts/process", json=json.loads(
+    sys.argv[1]))
+served = time.perf_counter()
+assert response.status_code == 200, response.data
+print(json.dumps({
+    "import_ms": (imported - start) * 1000,
+    "create_app_ms": (created - imported) * 1000,
+    "first_request_ms": (served - created) * 1000,
+}))
+"""
+
+
+def run(receipt: dict) -> dict:
+    """Start a process, and get its timings and its time to first request"""
+    start = time.perf_counter()
+    output = subprocess.run(
+        [sys.executable, "-c", STARTUP_SCRIPT, json.dumps(receipt)],
+        capture_output=True, text=True, check=True).stdout
+    elapsed = time.perf_counter() - start
+    timings = json.loads(output.splitlines()[-1])
+    # The process exits right after the first request
+    timings["time_to_first_request_ms"] = elapsed * 1000
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1])
+    parser.add_argument("--runs", type=int, default=10,
+                        help="Processes started, the median counts")
+    parser.add_argument("--output", help="Write the results to a JSON file")
+    args = parser.parse_args()
+
+    runs = [run(SAMPLE_RECEIPTS[0]) for _ in range(args.runs)]
+    results = []
+    print(f"{'phase':<28}{'median ms':>12}{'min ms':>12}")
+    for phase in ("import_ms", "create_app_ms", "first_request_ms",
+                  "time_to_first_request_ms"):
+        values = [timings[phase] for timings in runs]
+        result = {
+            "phase": phase,
+            "median_ms": round(statistics.median(values), 2),
+            "min_ms": round(min(values), 2),
+        }
+        results.append(result)
+        print(f"{phase:<28}{result['median_ms']:>12,.1f}"
+              f"{result['min_ms']:>12,.1f}")
+
+    if args.output:
+        write_report(args.output, "startup", results, vars(args))
+
+
+if __name__ == "__main__":
+    main()
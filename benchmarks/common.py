@@ -0,0 +1,94 @@
+"""
+Receipt Processor API - Benchmark Reporting
+
+Shared helpers of the benchmarks: latency percentiles, JSON reports that
+record the environment of the run, and the comparison of a run against a
+baseline report to catch regressions.
+"""
+import json
+import platform
+import subprocess
+import sys
+import time
+from typing import Dict, List, Optional
+
+
+def percentile(sorted_values: List[float], fraction: float) -> float:
+    """Get a percentile (0-1) of sorted values, by nearest rank"""
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1,
+                max(0, round(fraction * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def summarize_latencies(latencies: List[float], elapsed: float) -> dict:
+    """Summarize request latencies (seconds) of a run of `elapsed` seconds"""
+    latencies = sorted(latencies)
+    count = len(latencies)
+    return {
+        "requests": count,
+        "seconds": round(elapsed, 4),
+        "requests_per_second": round(count / elapsed, 1) if elapsed else 0,
+        "mean_ms": round(sum(latencies) / count * 1000, 4) if count else 0,
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 4),
+        "p90_ms": round(percentile(latencies, 0.90) * 1000, 4),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 4),
+        "max_ms": round(latencies[-1] * 1000, 4) if count else 0,
+    }
+
+
+def git_commit() -> Optional[str]:
+    """Get the current git commit, if the benchmark runs in a checkout"""
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def write_report(path: str, benchmark: str, results: List[dict],
+                 parameters: Optional[dict] = None):
+    """Write the results of a benchmark to a JSON report"""
+    report = {
+        "benchmark": benchmark,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "commit": git_commit(),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "parameters": parameters or {},
+        "results": results,
+    }
+    with open(path, "w") as output:
+        json.dump(report, output, indent=2)
+
+
+def compare_reports(baseline_path: str, results: List[dict], key: str,
+                    metric: str, threshold: float,
+                    higher_is_better: bool = False) -> List[str]:
+    """
+    Compare results with the ones of a baseline report. Return a message
+    for every result whose metric is worse than the baseline by more than
+    `threshold` (a fraction, 0.1 for 10%).
+    """
+    with open(baseline_path) as baseline_file:
+        baseline: Dict[str, dict] = {
+            result[key]: result
+            for result in json.load(baseline_file)["results"]
+        }
+
+    regressions = []
+    for result in results:
+        previous = baseline.get(result[key])
+        if not previous or not previous.get(metric):
+            continue
+        change = (result[metric] - previous[metric]) / previous[metric]
+        if higher_is_better:
+            change = -change
+        if change > threshold:
+            regressions.append(
+                f"{result[key]}: {metric} {previous[metric]} -> "
+                f"{result[metric]} ({change:+.1%} worse)")
+    return regressions
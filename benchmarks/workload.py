@@ -0,0 +1,123 @@
+"""
+Receipt Processor API - Benchmark Workloads
+
+Receipt workloads for the benchmarks: the sample receipts of the test
+suite, synthetic receipts of any size, and the replay of NDJSON files with
+one receipt per line.
+"""
+import json
+import random
+from typing import Iterator, List, Optional
+
+
+# The sample receipts of tests/conftest.py and the challenge examples
+SAMPLE_RECEIPTS = [
+    {
+        "retailer": "Target",
+        "purchaseDate": "2022-01-01",
+        "purchaseTime": "13:01",
+        "items": [
+            {"price": "6.49", "shortDescription": "Mountain Dew 12PK"}
+        ],
+        "total": "6.49"
+    },
+    {
+        "retailer": "M&M Corner Market",
+        "purchaseDate": "2022-03-20",
+        "purchaseTime": "14:33",
+        "items": [
+            {"shortDescription": "Gatorade", "price": "2.25"},
+            {"shortDescription": "Gatorade", "price": "2.25"},
+            {"shortDescription": "Gatorade", "price": "2.25"},
+            {"shortDescription": "Gatorade", "price": "2.25"}
+        ],
+        "total": "9.00"
+    },
+    {
+        "retailer": "Target",
+        "purchaseDate": "2022-01-01",
+        "purchaseTime": "13:01",
+        "items": [
+            {"shortDescription": "Mountain Dew 12PK", "price": "6.49"},
+            {"shortDescription": "Emils Cheese Pizza", "price": "12.25"},
+            {"shortDescription": "Knorr Creamy Chicken", "price": "1.26"},
+            {"shortDescription": "Doritos Nacho Cheese", "price": "3.35"},
+            {
+                "shortDescription": "   Klarbrunn 12-PK 12 FL OZ  ",
+                "price": "12.00"
+            }
+        ],
+        "total": "35.35"
+    }
+]
+
+RETAILERS = [
+    "Target", "Walgreens", "M&M Corner Market", "Walmart", "Costco",
+    "Whole Foods Market", "7-Eleven", "Trader Joe's", "CVS Pharmacy",
+]
+DESCRIPTIONS = [
+    "Mountain Dew 12PK", "Emils Cheese Pizza", "Knorr Creamy Chicken",
+    "Doritos Nacho Cheese", "   Klarbrunn 12-PK 12 FL OZ  ", "Gatorade",
+    "Pepsi - 12-oz", "Dasani", "Organic Bananas", "Whole Milk 1 Gal",
+]
+
+
+def synthesize(count: int, seed: int = 0,
+               max_items: int = 8) -> Iterator[dict]:
+    """Generate `count` valid random receipts, reproducibly for a seed"""
+    rng = random.Random(seed)
+    for _ in range(count):
+        items = []
+        total = 0
+        for _ in range(rng.randint(1, max_items)):
+            cents = rng.choice([rng.randrange(50, 5000), 225, 1200, 500])
+            total += cents
+            items.append({
+                "shortDescription": rng.choice(DESCRIPTIONS),
+                "price": f"{cents // 100}.{cents % 100:02d}",
+            })
+        yield {
+            "retailer": rng.choice(RETAILERS),
+            "purchaseDate": f"2022-{rng.randint(1, 12):02d}-"
+                            f"{rng.randint(1, 28):02d}",
+            "purchaseTime": f"{rng.randint(0, 23):02d}:"
+                            f"{rng.randint(0, 59):02d}",
+            "items": items,
+            "total": f"{total // 100}.{total % 100:02d}",
+        }
+
+
+def replay(path: str) -> Iterator[dict]:
+    """
+    Read the receipts of an NDJSON file, one per line. Lines exported from
+    a receipt pool, with the receipt under a "receipt" key, are accepted.
+    """
+    with open(path) as lines:
+        for line in lines:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            if isinstance(record, dict) and "receipt" in record:
+                record = record["receipt"]
+            yield record
+
+
+def load_workload(count: int, input_path: Optional[str] = None,
+                  seed: int = 0) -> List[dict]:
+    """
+    Get a workload of `count` receipts: replayed from an NDJSON file (in a
+    loop if the file has fewer receipts), or synthesized.
+    """
+    if not input_path:
+        return list(synthesize(count, seed))
+
+    receipts = []
+    while len(receipts) < count:
+        before = len(receipts)
+        for receipt in replay(input_path):
+            receipts.append(receipt)
+            if len(receipts) == count:
+                break
+        if len(receipts) == before:
+            raise ValueError(f"No receipts found in {input_path}")
+    return receipts
@@ -0,0 +1,295 @@
+"""
+Receipt Processor API - Command Line Interface
+
+The `flask receipts` commands, to load receipts in bulk, to snapshot the
+receipt pool and to archive it for the analytics:
+
+    flask receipts import receipts.jsonl --workers 4
+    flask receipts export snapshot.jsonl
+    flask receipts snapshot
+    flask receipts archive receipts.rca
+    flask receipts totals receipts.rca --by day
+
+The import and the export stream NDJSON files (one JSON object per line)
+through a generator pipeline, parse -> validate -> score -> store, a chunk
+of lines at a time, so the memory used doesn't grow with the size of the
+file. The archive is the columnar file of archive.py.
+
+Written in Python 3.11.5 and Flask 2.3.3
+"""
+import time
+from typing import Callable, Iterable, Iterator, Optional
+from uuid import UUID
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from archive import GROUPS, VALUES, Receipt_Archive, write_archive
+from json_provider import dumps, loads
+from receipts import Receipt
+from scoring import Scoring_Pool, chunked
+
+
+receipts_cli = AppGroup(
+    "receipts", help="Import and export the receipts of the receipt pool.")
+
+
+class Import_Progress:
+    """
+    Counts the imported receipts, and reports the throughput every
+    `interval` seconds while the import runs.
+    """
+
+    def __init__(self, interval: float = 2.0):
+        self.interval = interval
+        self.imported = 0
+        self.invalid = 0
+        self.existing = 0
+        self.start = time.perf_counter()
+        self.last_report = self.start
+
+    def update(self, imported: int, invalid: int, existing: int = 0):
+        self.imported += imported
+        self.invalid += invalid
+        self.existing += existing
+        now = time.perf_counter()
+        if self.interval and now - self.last_report >= self.interval:
+            self.last_report = now
+            self.report()
+
+    def rate(self) -> float:
+        elapsed = time.perf_counter() - self.start
+        return self.imported / elapsed if elapsed else 0.0
+
+    def report(self, final: bool = False):
+        label = "Imported" if final else "Importing:"
+        click.echo(
+            f"{label} {self.imported} receipts, {self.invalid} invalid, "
+            f"{self.existing} already in the pool "
+            f"({self.rate():,.0f} receipts/s)", err=True)
+
+
+@receipts_cli.command("import")
+@click.argument("source", type=click.File("r"))
+@click.option("--workers", type=int, default=0, show_default=True,
+              help="Processes that validate and score the receipts "
+                   "(0 scores them in this process).")
+@click.option("--chunk-size", type=int, default=1000, show_default=True,
+              help="Receipts validated, scored and stored at a time.")
+@click.option("--errors", "errors_file", type=click.File("w"),
+              help="Write the invalid lines and their errors to this file.")
+@click.option("--rescore", is_flag=True,
+              help="Score the exported receipts again, with new ids.")
+@click.option("--progress", type=float, default=2.0, show_default=True,
+              help="Seconds between progress reports (0 for none).")
+def import_receipts(source, workers, chunk_size, errors_file, rescore,
+                    progress):
+    """
+    Import the receipts of an NDJSON file (- for stdin). Each line is a
+    receipt, or a receipt exported by `flask receipts export`, which keeps
+    its id and points unless --rescore is given. The exported receipts
+    whose id is already in the pool are skipped.
+    """
+    receipt_pool = get_receipt_pool()
+
+    tracker = Import_Progress(progress)
+    scoring_pool = Scoring_Pool(
+        workers, current_app.config["RECEIPT_VALIDATOR"], chunk_size)
+    try:
+        for receipts, errors, existing in import_chunks(
+                source, scoring_pool, chunk_size, rescore,
+                receipt_pool.__contains__):
+            receipt_pool.add_receipts(receipts)
+            if errors_file is not None:
+                for line_number, error in errors:
+                    errors_file.write(dumps(
+                        {"line": line_number, "error": error}).decode() + "\n")
+            tracker.update(len(receipts), len(errors), existing)
+    finally:
+        scoring_pool.close()
+
+    tracker.report(final=True)
+
+
+@receipts_cli.command("export")
+@click.argument("target", type=click.File("w"))
+@click.option("--receipts-only", is_flag=True,
+              help="Write only the receipts, without their ids and points.")
+def export_receipts(target, receipts_only):
+    """
+    Export the receipts of the pool to an NDJSON file (- for stdout),
+    iterating over the pool instead of loading it all at once.
+    """
+    receipt_pool = get_receipt_pool()
+
+    exported = 0
+    for receipt in receipt_pool.iter_receipts():
+        if receipts_only:
+            if receipt.data is None:
+                continue
+            record = receipt.data
+        else:
+            record = {
+                "id": str(receipt.id),
+                "points": receipt.points,
+                "receipt": receipt.data
+            }
+        target.write(dumps(record).decode() + "\n")
+        exported += 1
+
+    click.echo(f"Exported {exported} receipts.", err=True)
+
+
+@receipts_cli.command("snapshot")
+def snapshot_receipts():
+    """
+    Write a snapshot of the journaled pool and start a new journal, so the
+    next startup replays a shorter journal.
+    """
+    receipt_pool = get_receipt_pool()
+
+    if not hasattr(receipt_pool.data, "snapshot"):
+        raise click.ClickException(
+            "The receipt pool has no journal, set JOURNAL_DIR.")
+    receipt_pool.data.snapshot()
+    click.echo(f"Snapshot of {len(receipt_pool)} receipts written.", err=True)
+
+
+@receipts_cli.command("archive")
+@click.argument("target", type=click.Path(dir_okay=False, writable=True))
+def archive_receipts(target):
+    """
+    Write the receipts of the pool to a columnar archive file, for the
+    offline analytics (see `flask receipts totals`).
+    """
+    receipt_pool = get_receipt_pool()
+
+    count, skipped = write_archive(target, receipt_pool.iter_receipts())
+    click.echo(f"Archived {count} receipts.", err=True)
+    if skipped:
+        click.echo(f"Left out {skipped} receipts, their points or amounts "
+                   "don't fit in 64 bits.", err=True)
+
+
+@receipts_cli.command("totals")
+@click.argument("source", type=click.Path(exists=True, dir_okay=False))
+@click.option("--by", type=click.Choice(GROUPS), default="retailer",
+              show_default=True, help="Group the receipts by.")
+@click.option("--value", type=click.Choice(VALUES), default="points",
+              show_default=True, help="Value summed in each group.")
+def archive_totals(source, by, value):
+    """
+    Sum the points, totals or receipts of an archive file by retailer or
+    by day, and write them as NDJSON, the largest first.
+    """
+    with Receipt_Archive(source) as archive:
+        totals = archive.totals(by, value)
+    for key, total in sorted(totals.items(), key=lambda entry: -entry[1]):
+        key = key if by == "retailer" else key.isoformat()
+        click.echo(dumps({by: key, value: total}).decode())
+
+
+# Pipeline stages
+
+def parse_lines(lines: Iterable[str]) -> Iterator[tuple]:
+    """
+    Parse the lines of an NDJSON file. Yield the (line number, entry)
+    pairs, the entry is the decoded object or the error of the line.
+    """
+    for line_number, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        try:
+            yield line_number, loads(line)
+        except ValueError as error:
+            yield line_number, Line_Error(f"Invalid JSON line: {error}")
+
+
+def import_chunks(lines: Iterable[str], scoring_pool: Scoring_Pool,
+                  chunk_size: int = 1000, rescore: bool = False,
+                  is_stored: Callable[[UUID], bool] = lambda _: False
+                  ) -> Iterator[tuple]:
+    """
+    Validate and score the receipts of the lines, a chunk at a time, in
+    the scoring pool. Yield the (receipts, errors, existing) of each
+    chunk, in the order of the lines; the errors are (line number, error)
+    pairs, and `existing` counts the exported receipts skipped because
+    `is_stored` tells their id is already stored.
+    """
+    chunks = (
+        (chunk, [get_payload(entry) for _, entry in chunk
+                 if needs_scoring(entry, rescore)])
+        for chunk in chunked(parse_lines(lines), chunk_size)
+    )
+    for chunk, scores in scoring_pool.score_chunks(chunks):
+        yield collect_chunk(chunk, iter(scores), rescore, is_stored)
+
+
+def collect_chunk(chunk: list, scores: Iterator, rescore: bool,
+                  is_stored: Callable[[UUID], bool] = lambda _: False
+                  ) -> tuple:
+    """
+    Rebuild the receipts of a scored chunk. The exported receipts keep
+    their ids and points, unless they were scored again, and are skipped
+    when their id is already stored, or earlier in the chunk: a file
+    imported twice doesn't add its receipts twice.
+    """
+    receipts = []
+    errors = []
+    kept_ids = set()
+    existing = 0
+    for line_number, entry in chunk:
+        if isinstance(entry, Line_Error):
+            errors.append((line_number, str(entry)))
+            continue
+        if needs_scoring(entry, rescore):
+            score = next(scores)
+            if isinstance(score, str):
+                errors.append((line_number, score))
+                continue
+            id_bytes, points = score
+        else:
+            try:
+                id_bytes = UUID(entry["id"]).bytes
+                points = int(entry["points"])
+            except (KeyError, TypeError, ValueError) as error:
+                errors.append(
+                    (line_number, f"Invalid exported receipt: {error}"))
+                continue
+            receipt_id = UUID(bytes=id_bytes)
+            if receipt_id in kept_ids or is_stored(receipt_id):
+                existing += 1
+                continue
+            kept_ids.add(receipt_id)
+        receipts.append(Receipt.from_stored(
+            UUID(bytes=id_bytes), points, get_payload(entry)))
+    return receipts, errors, existing
+
+
+# Module helper functions
+
+def get_receipt_pool():
+    """Get the receipt pool of the app of the command"""
+    return current_app.extensions["receipts"].receipt_pool
+
+
+class Line_Error(str):
+    """Marks a line that could not be decoded"""
+
+
+def needs_scoring(entry, rescore: bool) -> bool:
+    """Whether an entry is a receipt to validate and score"""
+    if isinstance(entry, Line_Error):
+        return False
+    return rescore or not is_exported(entry)
+
+
+def is_exported(entry) -> bool:
+    """Whether the entry is a receipt written by `flask receipts export`"""
+    return isinstance(entry, dict) and "receipt" in entry and "id" in entry
+
+
+def get_payload(entry) -> Optional[dict]:
+    """Get the receipt of an entry, exported or not"""
+    if is_exported(entry):
+        return entry["receipt"]
+    return entry
@@ -0,0 +1,155 @@
+"""
+Receipt Processor API - Configuration
+
+The settings of the application. Each one can be overridden with an
+environment variable of the same name.
+
+Written in Python 3.11.5 and Flask 2.3.3
+"""
+import os
+from points_calculator import DEFAULT_RULES_FILE
+
+
+def get_flag(name: str, default: bool) -> bool:
+    """Read a boolean setting from the environment"""
+    value = os.environ.get(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+
+class Config:
+    # JSON (or YAML) file with the rules used to calculate the points
+    POINTS_RULES_FILE = os.environ.get("POINTS_RULES_FILE", DEFAULT_RULES_FILE)
+
+    # Maximum entries of the memo caches of the points rules (0 for no
+    # cache): the alphanumeric count of the retailers, and the trimmed
+    # length of the item descriptions (off by default, a lookup costs about
+    # as much as the strip it saves).
+    RETAILER_MEMO_SIZE = int(os.environ.get("RETAILER_MEMO_SIZE", 65536))
+    DESCRIPTION_MEMO_SIZE = int(os.environ.get("DESCRIPTION_MEMO_SIZE", 0))
+
+    # Validator used for the receipts: "fast" for the precompiled fast path
+    # validator, or "marshmallow" for the ReceiptSchema.
+    RECEIPT_VALIDATOR = os.environ.get("RECEIPT_VALIDATOR", "fast")
+
+    # JSON library of the requests and responses: "orjson", "stdlib", or
+    # "auto" for orjson when it's installed
+    JSON_LIBRARY = os.environ.get("JSON_LIBRARY", "auto")
+
+    # Storage backend of the receipt pool: "memory" keeps the receipts in a
+    # dictionary, "sharded" in RECEIPT_SHARDS dictionaries with their own
+    # lock, "compact" in packed columns, and "sqlite" persists them in the
+    # SQLITE_PATH database.
+    RECEIPT_STORAGE = os.environ.get("RECEIPT_STORAGE", "memory")
+    RECEIPT_SHARDS = int(os.environ.get("RECEIPT_SHARDS", 16))
+    SQLITE_PATH = os.environ.get("SQLITE_PATH", "receipts.db")
+    # The SQLite writes are committed every SQLITE_COMMIT_EVERY writes, or
+    # when the last commit is older than SQLITE_COMMIT_INTERVAL seconds (a
+    # background thread commits the writes left pending).
+    SQLITE_COMMIT_EVERY = int(os.environ.get("SQLITE_COMMIT_EVERY", 100))
+    SQLITE_COMMIT_INTERVAL = float(
+        os.environ.get("SQLITE_COMMIT_INTERVAL", 1.0))
+    # Keep the raw payload of the receipts, compressed, in the "compact"
+    # backend. Only the ids and points are kept otherwise.
+    COMPACT_STORE_PAYLOAD = get_flag("COMPACT_STORE_PAYLOAD", False)
+    # Durability of the in-memory backends: with a JOURNAL_DIR, every add
+    # and delete is appended to a journal, "group" synced (the writes wait
+    # for a shared fsync) or "interval" synced (every JOURNAL_SYNC_INTERVAL
+    # seconds). A snapshot replaces the journal every
+    # JOURNAL_SNAPSHOT_EVERY records.
+    JOURNAL_DIR = os.environ.get("JOURNAL_DIR", "")
+    JOURNAL_SYNC = os.environ.get("JOURNAL_SYNC", "group")
+    JOURNAL_SYNC_INTERVAL = float(os.environ.get("JOURNAL_SYNC_INTERVAL", 1.0))
+    JOURNAL_SNAPSHOT_EVERY = int(
+        os.environ.get("JOURNAL_SNAPSHOT_EVERY", 1000000))
+
+    # Logging: "queue" writes the log file from a background thread, fed by
+    # a queue of LOG_QUEUE_SIZE records (new records are dropped when it's
+    # full), and "sync" writes it from the request threads. An empty
+    # LOG_FILE writes no log file.
+    LOG_FILE = os.environ.get("LOG_FILE", "logs/app.log")
+    LOG_MODE = os.environ.get("LOG_MODE", "queue")
+    LOG_QUEUE_SIZE = int(os.environ.get("LOG_QUEUE_SIZE", 10000))
+    # Fraction of the request bodies that are logged, and their maximum
+    # logged size (0 for no limit).
+    LOG_BODY_SAMPLE_RATE = float(os.environ.get("LOG_BODY_SAMPLE_RATE", 1.0))
+    LOG_BODY_MAX_BYTES = int(os.environ.get("LOG_BODY_MAX_BYTES", 2048))
+
+    # Worker processes that validate and score the batches of at least
+    # SCORING_MIN_BATCH receipts, SCORING_CHUNK_SIZE receipts per task. 0
+    # scores all the batches in the request thread.
+    SCORING_WORKERS = int(os.environ.get("SCORING_WORKERS", 0))
+    SCORING_CHUNK_SIZE = int(os.environ.get("SCORING_CHUNK_SIZE", 1000))
+    SCORING_MIN_BATCH = int(os.environ.get("SCORING_MIN_BATCH", 1000))
+
+    # Scoring of the receipts of POST /receipts/process: "eager" validates
+    # and scores them before the response, "deferred" only checks their
+    # structure and gives them their id, and a background thread scores
+    # them (or the first points request, if it comes first). Up to
+    # DEFERRED_QUEUE_SIZE receipts wait for the thread, and the errors of
+    # the last DEFERRED_MAX_FAILURES invalid receipts are kept.
+    SCORING_MODE = os.environ.get("SCORING_MODE", "eager")
+    DEFERRED_QUEUE_SIZE = int(os.environ.get("DEFERRED_QUEUE_SIZE", 10000))
+    DEFERRED_MAX_FAILURES = int(
+        os.environ.get("DEFERRED_MAX_FAILURES", 100000))
+
+    # Keep the indexes of the receipts by retailer, purchase date and
+    # points, for the GET /receipts queries and GET /stats/points
+    INDEXES_ENABLED = get_flag("INDEXES_ENABLED", True)
+
+    # Points responses cached for the GET /receipts/{id}/points requests (0
+    # for no cache), and the Cache-Control header of the responses. They
+    # have a strong ETag, so "no-cache" clients revalidate with a 304.
+    POINTS_CACHE_SIZE = int(os.environ.get("POINTS_CACHE_SIZE", 100000))
+    POINTS_CACHE_CONTROL = os.environ.get("POINTS_CACHE_CONTROL", "no-cache")
+
+    # Retention of the receipts in the pool: at most RETENTION_MAX_RECEIPTS
+    # receipts, for at most RETENTION_MAX_AGE seconds (0 for no limit). The
+    # oldest receipts are evicted first, by addition ("fifo") or by last
+    # read ("lru"), by a sweeper that runs every RETENTION_SWEEP_INTERVAL
+    # seconds, or as soon as the pool is over its maximum.
+    RETENTION_MAX_RECEIPTS = int(os.environ.get("RETENTION_MAX_RECEIPTS", 0))
+    RETENTION_MAX_AGE = float(os.environ.get("RETENTION_MAX_AGE", 0))
+    RETENTION_POLICY = os.environ.get("RETENTION_POLICY", "fifo")
+    RETENTION_SWEEP_INTERVAL = float(
+        os.environ.get("RETENTION_SWEEP_INTERVAL", 1.0))
+    # Keep the payload of the receipts in the pool. Without it only their
+    # ids and points are stored, once they are scored and indexed.
+    RECEIPT_KEEP_PAYLOAD = get_flag("RECEIPT_KEEP_PAYLOAD", True)
+
+    # Record the metrics served by /metrics
+    METRICS_ENABLED = get_flag("METRICS_ENABLED", True)
+
+    # Admission control: at most MAX_IN_FLIGHT requests are handled at once
+    # (0 for no limit), and the last ADMISSION_RESERVED of them are only for
+    # the GET /receipts/{id}/points reads. The other requests get a 429, or
+    # a 503 when the server is full, with a Retry-After of
+    # ADMISSION_RETRY_AFTER seconds. The request bodies are limited to
+    # MAX_CONTENT_LENGTH bytes (a 413), a batch of MAX_BATCH_SIZE receipts
+    # fits.
+    MAX_IN_FLIGHT = int(os.environ.get("MAX_IN_FLIGHT", 64))
+    ADMISSION_RESERVED = int(os.environ.get("ADMISSION_RESERVED", 16))
+    ADMISSION_RETRY_AFTER = int(os.environ.get("ADMISSION_RETRY_AFTER", 1))
+    MAX_CONTENT_LENGTH = int(
+        os.environ.get("MAX_CONTENT_LENGTH", 16 * 1024 * 1024))
+
+    # Slow request recorder: the SLOW_REQUESTS_SIZE slowest requests (0 to
+    # turn it off) of at least SLOW_REQUEST_THRESHOLD seconds are kept,
+    # with the time of each stage, for GET /admin/slow-requests.
+    SLOW_REQUESTS_SIZE = int(os.environ.get("SLOW_REQUESTS_SIZE", 50))
+    SLOW_REQUEST_THRESHOLD = float(
+        os.environ.get("SLOW_REQUEST_THRESHOLD", 0))
+    # Token of the admin endpoints (sent in the X-Admin-Token header) and
+    # of the profiled requests (sent in the X-Profile header), their
+    # cProfile stats are saved in PROFILE_DIR. Empty turns them off.
+    ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN", "")
+    PROFILE_DIR = os.environ.get("PROFILE_DIR", "logs/profiles")
+
+    # Idempotency mode: a resubmitted receipt (same payload, or same
+    # Idempotency-Key header) gets the id it already has. The cache keeps
+    # up to IDEMPOTENCY_MAX_ENTRIES receipts for IDEMPOTENCY_TTL seconds.
+    IDEMPOTENCY_ENABLED = get_flag("IDEMPOTENCY_ENABLED", False)
+    IDEMPOTENCY_MAX_ENTRIES = int(
+        os.environ.get("IDEMPOTENCY_MAX_ENTRIES", 100000))
+    IDEMPOTENCY_TTL = float(os.environ.get("IDEMPOTENCY_TTL", 86400))
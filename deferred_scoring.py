@@ -0,0 +1,157 @@
+"""
+Receipt Processor API - Deferred Scoring
+
+In the deferred scoring mode a submitted receipt only gets a structural
+check and its id: the full validation and the points are left to a
+background thread, so POST /receipts/process returns before the scoring.
+A receipt requested before its turn is scored right away, by the points
+request, so the clients never see a receipt "in progress": they get its
+points, or the validation error found when it was scored.
+
+Written in Python 3.11.5 and Flask 2.3.3
+"""
+import logging
+import queue
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional
+from uuid import UUID
+from marshmallow import ValidationError
+from metrics import RECEIPTS_PROCESSED, VALIDATION_ERRORS
+from receipts import Receipt, Receipt_Pool
+
+
+# Logger of the deferred scoring, a child of the app logger (app.py)
+logger = logging.getLogger("app.scoring")
+
+
+class Deferred_Scorer:
+    """
+    Scores the submitted receipts in a background thread, and adds them to
+    the pool once scored. Until then they are pending: kept here, and not
+    in the pool. Up to `queue_size` receipts wait for the thread; when the
+    queue is full they are scored by the submitting request. The errors of
+    the last `max_failures` invalid receipts are kept for their requests.
+    """
+
+    def __init__(self, pool: Receipt_Pool, queue_size: int = 10000,
+                 max_failures: int = 100000):
+        self.pool = pool
+        self.max_failures = max_failures
+        self.lock = threading.Lock()
+        self.pending: Dict[UUID, Receipt] = {}
+        # Set when a pending receipt is scored, by the receipt being scored
+        self.scoring: Dict[UUID, threading.Event] = {}
+        self.failures: Dict[UUID, str] = OrderedDict()
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.thread = None
+        # The queued receipts are scored before the pool is closed
+        pool.on_close(self.stop)
+
+    def submit(self, data: dict) -> UUID:
+        """
+        Check the structure of a receipt and give it its id, to score it
+        later. Raises a ValidationError if the structure is invalid.
+        """
+        receipt = Receipt.deferred(data)
+        with self.lock:
+            # Safety check to avoid id collisions, with the pool and the
+            # other pending receipts
+            while receipt.id in self.pending or receipt.id in self.pool:
+                receipt.id = receipt.generate_id()
+            self.pending[receipt.id] = receipt
+
+        try:
+            self.queue.put_nowait(receipt.id)
+        except queue.Full:
+            self.score(receipt.id)
+        return receipt.id
+
+    def score(self, receipt_id: UUID):
+        """
+        Score a pending receipt now, and add it to the pool (or record its
+        error). If another thread is scoring it, wait for it to finish.
+        Nothing to do if the receipt is not pending.
+        """
+        with self.lock:
+            receipt = self.pending.get(receipt_id)
+            if receipt is None:
+                return
+            done = self.scoring.get(receipt_id)
+            owner = done is None
+            if owner:
+                done = self.scoring[receipt_id] = threading.Event()
+        if not owner:
+            done.wait()
+            return
+
+        try:
+            receipt.score()
+            if self.pool.closed:
+                # Scored on demand during the shutdown, it can't be stored
+                logger.warning(
+                    f"Deferred receipt {receipt_id} was not stored: the "
+                    "receipt pool is closed.")
+                self.add_failure(receipt_id, "The receipt pool is closed.")
+                return
+            self.pool.add_receipt(receipt)
+            RECEIPTS_PROCESSED.inc()
+
+        except ValidationError as error:
+            VALIDATION_ERRORS.inc()
+            logger.warning(
+                f"Deferred receipt {receipt_id} is invalid: {error}")
+            self.add_failure(receipt_id, str(error))
+
+        except Exception:
+            logger.exception(
+                f"An unexpected error occurred scoring receipt {receipt_id}.")
+            self.add_failure(
+                receipt_id, "An error occurred processing the receipt.")
+
+        finally:
+            # Removed once it's in the pool (or failed), so a receipt is
+            # always pending, stored, or failed.
+            with self.lock:
+                del self.pending[receipt_id]
+                del self.scoring[receipt_id]
+            done.set()
+
+    def add_failure(self, receipt_id: UUID, error: str):
+        with self.lock:
+            self.failures[receipt_id] = error
+            while len(self.failures) > self.max_failures:
+                self.failures.popitem(last=False)
+
+    def get_failure(self, receipt_id: UUID) -> Optional[str]:
+        """Get the validation error of a receipt that failed its scoring"""
+        return self.failures.get(receipt_id)
+
+    def __contains__(self, receipt_id: UUID) -> bool:
+        return receipt_id in self.pending
+
+    def __len__(self) -> int:
+        return len(self.pending)
+
+    # Background thread
+
+    def start(self):
+        """Start the background scoring thread"""
+        if self.thread is None:
+            self.thread = threading.Thread(
+                target=self.run, name="deferred-scoring", daemon=True)
+            self.thread.start()
+
+    def stop(self):
+        """Score the receipts still queued, then stop the thread"""
+        if self.thread is not None:
+            self.queue.put(None)
+            self.thread.join()
+            self.thread = None
+
+    def run(self):
+        while True:
+            receipt_id = self.queue.get()
+            if receipt_id is None:
+                return
+            self.score(receipt_id)
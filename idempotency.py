@@ -0,0 +1,94 @@
+"""
+Receipt Processor API - Idempotency Cache
+
+Maps resubmitted receipts to the id they got the first time. A receipt is
+identified by the hash of its canonical JSON payload, or by the
+Idempotency-Key header sent by the client. The cache is bounded: the least
+recently used entries are evicted first, and entries expire after a TTL.
+
+Written in Python 3.11.5 and Flask 2.3.3
+"""
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional, Tuple
+from uuid import UUID
+
+
+class Idempotency_Conflict(Exception):
+    """An Idempotency-Key was reused with a different payload"""
+
+
+class Idempotency_Cache:
+    """
+    A bounded LRU cache, with a TTL, from an idempotency key to the id of
+    the receipt processed with it and the fingerprint of its payload.
+    """
+
+    def __init__(self, max_entries: int = 100000, ttl: float = 86400):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries: OrderedDict = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key: str, fingerprint: str) -> Optional[UUID]:
+        """
+        Get the receipt id stored for a key, None if there's none. Raise
+        Idempotency_Conflict if it was stored for another payload.
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            receipt_id, stored_fingerprint, expires = entry
+            if expires <= time.monotonic():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+
+        if stored_fingerprint != fingerprint:
+            raise Idempotency_Conflict(
+                "The Idempotency-Key was already used with another receipt.")
+        return receipt_id
+
+    def put(self, key: str, fingerprint: str, receipt_id: UUID):
+        """Store the receipt id of a key"""
+        with self.lock:
+            self.entries[key] = (
+                receipt_id, fingerprint, time.monotonic() + self.ttl)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def discard(self, key: str):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+
+# Module helper functions
+
+def payload_fingerprint(payload) -> str:
+    """
+    Hash the canonical JSON of a payload: sorted keys and no whitespace, so
+    the same receipt always gets the same hash.
+    """
+    canonical = json.dumps(
+        payload, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+
+def idempotency_key(payload, header: Optional[str] = None) -> Tuple[str, str]:
+    """
+    Get the cache key and the payload fingerprint of a request. The key is
+    the Idempotency-Key header when the client sends one, otherwise the
+    fingerprint itself.
+    """
+    fingerprint = payload_fingerprint(payload)
+    if header:
+        return f"key:{header}", fingerprint
+    return f"sha256:{fingerprint}", fingerprint
@@ -0,0 +1,228 @@
+"""
+Receipt Processor API - Receipt Indexes
+
+Secondary indexes of the receipt pool, on the retailer, the purchase date
+and the points of the receipts, with running totals of the points. They
+are updated as the receipts are added and deleted, so the queries and the
+statistics of the /receipts and /stats/points endpoints only read the
+receipts that match, instead of scanning the whole pool.
+
+Written in Python 3.11.5 and Flask 2.3.3
+"""
+import threading
+from bisect import bisect_left, bisect_right, insort
+from itertools import islice
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+from uuid import UUID
+from receipts import Pool_Listener, Receipt
+
+
+class Sorted_Index:
+    """
+    The ids of the receipts by a key, with the keys kept sorted for range
+    queries, and the count and sum of the points of each key.
+    """
+
+    def __init__(self):
+        self.ids: Dict[object, Set[UUID]] = {}
+        self.keys: list = []
+        self.totals: Dict[object, int] = {}
+
+    def add(self, key, receipt_id: UUID, points: int):
+        ids = self.ids.get(key)
+        if ids is None:
+            ids = self.ids[key] = set()
+            self.totals[key] = 0
+            insort(self.keys, key)
+        ids.add(receipt_id)
+        self.totals[key] += points
+
+    def remove(self, key, receipt_id: UUID, points: int):
+        ids = self.ids[key]
+        ids.discard(receipt_id)
+        self.totals[key] -= points
+        if not ids:
+            del self.ids[key]
+            del self.totals[key]
+            del self.keys[bisect_left(self.keys, key)]
+
+    def range(self, low=None, high=None) -> list:
+        """Get the keys between `low` and `high`, both included"""
+        start = 0 if low is None else bisect_left(self.keys, low)
+        end = len(self.keys) if high is None else bisect_right(
+            self.keys, high)
+        return self.keys[start:end]
+
+    def count(self, keys: Iterable) -> int:
+        return sum(len(self.ids[key]) for key in keys)
+
+
+class Receipt_Indexes(Pool_Listener):
+    """
+    Indexes of the receipts of a pool by retailer, purchase date and
+    points. The retailers are matched case-insensitively. The receipts
+    stored without their payload are only indexed by their points.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # The indexed fields of each receipt: the retailer (casefolded),
+        # the purchase date and the points
+        self.entries: Dict[UUID, tuple] = {}
+        self.retailers = Sorted_Index()
+        # The name of each retailer, as first seen
+        self.retailer_names: Dict[str, str] = {}
+        self.dates = Sorted_Index()
+        self.points = Sorted_Index()
+        self.total_points = 0
+
+    def receipt_added(self, receipt: Receipt):
+        data = receipt.data or {}
+        retailer = data.get("retailer")
+        key = retailer.casefold() if retailer is not None else None
+        date = data.get("purchaseDate")
+        points = receipt.points
+
+        with self.lock:
+            if receipt.id in self.entries:
+                return
+            self.entries[receipt.id] = (key, date, points)
+            if key is not None:
+                self.retailer_names.setdefault(key, retailer)
+                self.retailers.add(key, receipt.id, points)
+            if date is not None:
+                self.dates.add(date, receipt.id, points)
+            self.points.add(points, receipt.id, points)
+            self.total_points += points
+
+    def receipt_deleted(self, receipt_id: UUID):
+        with self.lock:
+            entry = self.entries.pop(receipt_id, None)
+            if entry is None:
+                return
+            key, date, points = entry
+            if key is not None:
+                self.retailers.remove(key, receipt_id, points)
+                if key not in self.retailers.ids:
+                    del self.retailer_names[key]
+            if date is not None:
+                self.dates.remove(date, receipt_id, points)
+            self.points.remove(points, receipt_id, points)
+            self.total_points -= points
+
+    def rebuild(self, receipts: Iterable[Receipt]):
+        """Index the receipts already stored, like the persisted ones"""
+        for receipt in receipts:
+            self.receipt_added(receipt)
+
+    def query(self, retailer: str = None, date_from: str = None,
+              date_to: str = None, min_points: int = None,
+              max_points: int = None, limit: int = 100,
+              offset: int = 0) -> Tuple[int, List[tuple]]:
+        """
+        Find the receipts that match all the filters. Return the number of
+        matches and a page of them, as (id, retailer, date, points) tuples
+        by descending points (the ties in no particular order).
+
+        The candidates are read from the smallest of the retailer, date
+        and points indexes, and checked against the other filters, so the
+        cost grows with the matches and not with the pool.
+        """
+        with self.lock:
+            point_keys = self.points.range(min_points, max_points)
+            sources = [(self.points.count(point_keys), self.points,
+                        point_keys)]
+            if retailer is not None:
+                key = retailer.casefold()
+                keys = [key] if key in self.retailers.ids else []
+                sources.append(
+                    (self.retailers.count(keys), self.retailers, keys))
+            if date_from is not None or date_to is not None:
+                keys = self.dates.range(date_from, date_to)
+                sources.append((self.dates.count(keys), self.dates, keys))
+
+            # Without other filters the points index is already sorted, the
+            # page is read from the highest points down.
+            if len(sources) == 1:
+                total, index, keys = sources[0]
+                page = []
+                for points in reversed(keys):
+                    page.extend(islice(
+                        index.ids[points], offset + limit - len(page)))
+                    if len(page) == offset + limit:
+                        break
+                return total, [
+                    self.result(receipt_id) for receipt_id in page[offset:]]
+
+            _, index, keys = min(sources, key=lambda source: source[0])
+            matches = []
+            for key in keys:
+                for receipt_id in index.ids[key]:
+                    entry = self.entries[receipt_id]
+                    if self.matches(entry, retailer, date_from, date_to,
+                                    min_points, max_points):
+                        matches.append((entry[2], receipt_id))
+            matches.sort(key=lambda match: match[0], reverse=True)
+            return len(matches), [
+                self.result(receipt_id)
+                for _, receipt_id in matches[offset:offset + limit]]
+
+    def matches(self, entry: tuple, retailer: Optional[str],
+                date_from: Optional[str], date_to: Optional[str],
+                min_points: Optional[int], max_points: Optional[int]) -> bool:
+        key, date, points = entry
+        if retailer is not None and key != retailer.casefold():
+            return False
+        if date_from is not None and (date is None or date < date_from):
+            return False
+        if date_to is not None and (date is None or date > date_to):
+            return False
+        if min_points is not None and points < min_points:
+            return False
+        if max_points is not None and points > max_points:
+            return False
+        return True
+
+    def result(self, receipt_id: UUID) -> tuple:
+        key, date, points = self.entries[receipt_id]
+        return receipt_id, self.retailer_names.get(key), date, points
+
+    def stats(self, group_by: str = None) -> dict:
+        """
+        Get the count, sum, average, minimum and maximum of the points of
+        the receipts, and the count, sum and average of each retailer or
+        purchase date with `group_by`. Read from the running totals.
+        """
+        with self.lock:
+            count = len(self.entries)
+            stats = summary(count, self.total_points)
+            stats["min"] = self.points.keys[0] if count else None
+            stats["max"] = self.points.keys[-1] if count else None
+
+            if group_by == "retailer":
+                stats["groups"] = {
+                    self.retailer_names[key]: summary(
+                        len(self.retailers.ids[key]),
+                        self.retailers.totals[key])
+                    for key in self.retailers.keys
+                }
+            elif group_by == "date":
+                stats["groups"] = {
+                    date: summary(
+                        len(self.dates.ids[date]), self.dates.totals[date])
+                    for date in self.dates.keys
+                }
+            return stats
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+
+# Module helper functions
+
+def summary(count: int, total: int) -> dict:
+    return {
+        "count": count,
+        "total": total,
+        "average": round(total / count, 2) if count else None
+    }
@@ -0,0 +1,457 @@
+"""
+Receipt Processor API - Journaled Storage
+
+Durability for the in-memory storage backends. The receipts stay in the
+in-memory backend, and every add and delete also appends a compact binary
+record to an append-only journal, fsynced in groups: one fsync covers all
+the records written while the previous one was running.
+
+Every `snapshot_every` records the pool is written to a snapshot file and
+a new journal is started, so the journal doesn't grow forever. On startup
+the snapshot is memory-mapped and loaded, then the journal records written
+after it are replayed.
+
+Files of the journal directory, by generation:
+
+    snapshot-00000003.bin   the receipts when the journal 3 was started
+    journal-00000003.log    the adds and deletes since then
+
+Written in Python 3.11.5 and Flask 2.3.3
+"""
+import json
+import mmap
+import os
+import re
+import struct
+import threading
+import zlib
+from typing import Iterator, Optional, Tuple
+from uuid import UUID
+from storage import Storage_Backend
+
+
+# Magic bytes at the start of the files. The magic of a snapshot is
+# followed by its number of records.
+JOURNAL_MAGIC = b"RCPTJRN1"
+SNAPSHOT_MAGIC = b"RCPTSNP1"
+COUNT = struct.Struct("<Q")
+
+# Record operations
+ADD = 1
+DELETE = 2
+
+# A record is the CRC32 of the rest of the record, the header (operation,
+# id bytes, points and payload length) and the JSON payload. A torn write
+# at the end of the journal fails the CRC and is discarded on startup.
+CRC = struct.Struct("<I")
+HEADER = struct.Struct("<B16sqI")
+# Payload length of the receipts without a payload
+NO_PAYLOAD = 0xFFFFFFFF
+# The points have no upper limit. The points beyond 64 bits are marked in
+# the header, and follow it as a length-prefixed signed big-endian integer.
+LARGE_POINTS = -2 ** 63
+LARGE_LENGTH = struct.Struct("<H")
+
+FILE_NAME = re.compile(r"^(journal|snapshot)-(\d{8})\.(log|bin)$")
+
+
+class Journaled_Storage(Storage_Backend):
+    """
+    Wraps an in-memory backend with a journal in the `path` directory.
+
+    With `sync="group"` an add or delete returns once its record is on
+    disk. With `sync="interval"` it returns right away and the journal is
+    fsynced every `sync_interval` seconds, so a crash can lose the last
+    writes.
+    """
+
+    def __init__(self, storage: Storage_Backend, path: str,
+                 sync: str = "group", sync_interval: float = 1.0,
+                 snapshot_every: int = 1000000):
+        if sync not in ("group", "interval"):
+            raise ValueError(f"Unknown journal sync mode: {sync}")
+        self.storage = storage
+        self.path = path
+        self.sync_mode = sync
+        self.sync_interval = sync_interval
+        self.snapshot_every = snapshot_every
+        # Only the group mode waits on the disk
+        self.blocking = sync == "group"
+
+        # The lock orders the writes of the storage and the journal, the
+        # sync and snapshot locks allow a single fsync and a single
+        # snapshot at a time.
+        self.lock = threading.Lock()
+        self.sync_lock = threading.Lock()
+        self.snapshot_lock = threading.Lock()
+        self.synced = threading.Condition()
+        self.written_records = 0
+        self.synced_records = 0
+        self.records_since_snapshot = 0
+        self.closing = False
+        self.closed = False
+
+        os.makedirs(path, exist_ok=True)
+        self.generation = self.load()
+        self.file = self.open_journal(self.generation)
+
+        self.snapshot_due = threading.Event()
+        self.sync_thread = threading.Thread(
+            target=self.sync_loop, name="journal-sync", daemon=True)
+        self.sync_thread.start()
+        self.snapshot_thread = threading.Thread(
+            target=self.snapshot_loop, name="journal-snapshot", daemon=True)
+        self.snapshot_thread.start()
+
+    def add(self, receipt) -> bool:
+        # Encoded first, so a receipt that can't be journaled isn't stored
+        record = encode_record(ADD, receipt.id, receipt.points, receipt.data)
+        with self.lock:
+            if not self.storage.add(receipt):
+                return False
+            self.file.write(record)
+            records = self.written(1)
+        self.wait_synced(records)
+        return True
+
+    def add_many(self, receipts: list) -> list:
+        # The records of the whole group share a single fsync
+        records = [
+            encode_record(ADD, receipt.id, receipt.points, receipt.data)
+            for receipt in receipts
+        ]
+        with self.lock:
+            collisions = self.storage.add_many(receipts)
+            collided = {id(receipt) for receipt in collisions}
+            stored = [
+                record for receipt, record in zip(receipts, records)
+                if id(receipt) not in collided
+            ]
+            self.file.write(b"".join(stored))
+            records = self.written(len(stored))
+        self.wait_synced(records)
+        return collisions
+
+    def get(self, receipt_id: UUID):
+        return self.storage.get(receipt_id)
+
+    def get_many(self, receipt_ids: list) -> list:
+        return self.storage.get_many(receipt_ids)
+
+    def delete(self, receipt_id: UUID) -> bool:
+        record = encode_record(DELETE, receipt_id, 0, None)
+        with self.lock:
+            if not self.storage.delete(receipt_id):
+                return False
+            self.file.write(record)
+            records = self.written(1)
+        self.wait_synced(records)
+        return True
+
+    def __iter__(self) -> Iterator:
+        return iter(self.storage)
+
+    def __len__(self) -> int:
+        return len(self.storage)
+
+    def __contains__(self, receipt_id: UUID) -> bool:
+        return receipt_id in self.storage
+
+    def to_dict(self) -> dict:
+        return self.storage.to_dict()
+
+    # Group commit
+
+    def written(self, count: int) -> int:
+        """
+        Count the records written to the journal, with the lock held.
+        Return the number of records that must be synced to cover them.
+        """
+        self.written_records += count
+        self.records_since_snapshot += count
+        if self.records_since_snapshot >= self.snapshot_every:
+            self.records_since_snapshot = 0
+            self.snapshot_due.set()
+        return self.written_records
+
+    def wait_synced(self, records: int):
+        """In the group mode, wake the sync thread and wait for the fsync"""
+        if self.sync_mode != "group":
+            return
+        with self.synced:
+            self.synced.notify_all()
+            while self.synced_records < records and not self.closing:
+                self.synced.wait()
+
+    def sync(self):
+        """Write the buffered records and fsync the journal"""
+        with self.sync_lock:
+            with self.lock:
+                self.file.flush()
+                records = self.written_records
+                file = self.file
+            # The writers keep appending while the disk syncs, their
+            # records are covered by the next fsync.
+            os.fsync(file.fileno())
+            with self.synced:
+                self.synced_records = records
+                self.synced.notify_all()
+
+    def sync_loop(self):
+        """
+        Fsync the journal: in the group mode as soon as there are records
+        to sync, in the interval mode every `sync_interval` seconds.
+        """
+        while True:
+            with self.synced:
+                if self.sync_mode == "interval":
+                    self.synced.wait(self.sync_interval)
+                else:
+                    while (self.synced_records == self.written_records
+                           and not self.closing):
+                        self.synced.wait()
+                if self.closing:
+                    return
+                due = self.synced_records != self.written_records
+            if due:
+                self.sync()
+
+    # Snapshots
+
+    def snapshot(self):
+        """
+        Write the receipts to a snapshot and start a new journal. The
+        receipts added while the snapshot is written go to the new journal,
+        replaying them over the snapshot gives the same pool.
+        """
+        with self.snapshot_lock:
+            self.write_snapshot()
+
+    def write_snapshot(self):
+        with self.sync_lock:
+            with self.lock:
+                self.file.flush()
+                os.fsync(self.file.fileno())
+                self.file.close()
+                self.generation += 1
+                generation = self.generation
+                self.file = self.open_journal(generation)
+                records = self.written_records
+            with self.synced:
+                self.synced_records = records
+                self.synced.notify_all()
+
+        path = self.file_path("snapshot", generation)
+        temporary_path = path + ".tmp"
+        with open(temporary_path, "wb") as file:
+            file.write(SNAPSHOT_MAGIC + COUNT.pack(0))
+            count = 0
+            for receipt in self.storage:
+                file.write(encode_record(
+                    ADD, receipt.id, receipt.points, receipt.data))
+                count += 1
+            # The count is only known at the end
+            file.seek(len(SNAPSHOT_MAGIC))
+            file.write(COUNT.pack(count))
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temporary_path, path)
+        sync_directory(self.path)
+        self.remove_before(generation)
+
+    def snapshot_loop(self):
+        while True:
+            self.snapshot_due.wait()
+            self.snapshot_due.clear()
+            if self.closing:
+                return
+            self.snapshot()
+
+    # Startup
+
+    def load(self) -> int:
+        """
+        Load the latest snapshot and replay the journals written after it.
+        Return the generation of the current journal.
+        """
+        for name in os.listdir(self.path):
+            if name.endswith(".tmp"):
+                # A snapshot interrupted by a crash
+                os.remove(os.path.join(self.path, name))
+
+        snapshots, journals = self.list_files()
+        generation = snapshot = max(snapshots, default=0)
+        if snapshots:
+            path = self.file_path("snapshot", generation)
+            with open(path, "rb") as file:
+                file.seek(len(SNAPSHOT_MAGIC))
+                (count,) = COUNT.unpack(file.read(COUNT.size))
+            self.storage.load(
+                (record[1:] for record, _ in read_file(
+                    path, SNAPSHOT_MAGIC, COUNT.size)),
+                expected=count)
+
+        for journal in sorted(journals):
+            if journal < generation:
+                continue
+            path = self.file_path("journal", journal)
+            valid_length = 0
+            # The runs of additions are bulk loaded, the deletions are
+            # applied between them.
+            additions = []
+            for record, valid_length in read_file(path, JOURNAL_MAGIC):
+                if record[0] == ADD:
+                    additions.append(record[1:])
+                    continue
+                self.storage.load(additions)
+                additions = []
+                self.storage.delete(UUID(bytes=record[1]))
+            self.storage.load(additions)
+            # Discard a torn record at the end of the journal. An empty
+            # journal is rewritten, with its magic bytes, when it's opened.
+            if valid_length < os.path.getsize(path):
+                os.truncate(path, valid_length)
+            generation = journal
+
+        # Only the files replaced by the loaded snapshot are removed: after
+        # a crash between the start of a new journal and the rename of its
+        # snapshot, the older journal still holds receipts of the pool.
+        self.remove_before(snapshot)
+        return generation
+
+    def open_journal(self, generation: int):
+        """Open a journal to append records, creating it if needed"""
+        path = self.file_path("journal", generation)
+        if os.path.exists(path) and os.path.getsize(path) > 0:
+            return open(path, "ab")
+        file = open(path, "wb")
+        file.write(JOURNAL_MAGIC)
+        file.flush()
+        os.fsync(file.fileno())
+        sync_directory(self.path)
+        return file
+
+    def list_files(self) -> Tuple[list, list]:
+        """Get the generations of the snapshots and of the journals"""
+        snapshots = []
+        journals = []
+        for name in os.listdir(self.path):
+            match = FILE_NAME.match(name)
+            if match:
+                kind, generation = match.group(1), int(match.group(2))
+                if kind == "snapshot":
+                    snapshots.append(generation)
+                else:
+                    journals.append(generation)
+        return snapshots, journals
+
+    def remove_before(self, generation: int):
+        """Remove the snapshots and journals replaced by a generation"""
+        snapshots, journals = self.list_files()
+        for kind, generations in (
+                ("snapshot", snapshots), ("journal", journals)):
+            for old in generations:
+                if old < generation:
+                    os.remove(self.file_path(kind, old))
+
+    def file_path(self, kind: str, generation: int) -> str:
+        extension = "bin" if kind == "snapshot" else "log"
+        return os.path.join(
+            self.path, f"{kind}-{generation:08d}.{extension}")
+
+    def close(self):
+        """Sync the journal and stop the background threads, once"""
+        with self.lock:
+            if self.closed:
+                return
+            self.closed = True
+        self.sync()
+        with self.synced:
+            self.closing = True
+            self.synced.notify_all()
+        self.snapshot_due.set()
+        self.sync_thread.join()
+        self.snapshot_thread.join()
+        self.file.close()
+        self.storage.close()
+
+
+# Module helper functions
+
+def encode_record(operation: int, receipt_id: UUID, points: int,
+                  data: Optional[dict]) -> bytes:
+    """Encode a journal or snapshot record"""
+    if data is None:
+        payload = b""
+        length = NO_PAYLOAD
+    else:
+        payload = json.dumps(data, separators=(",", ":")).encode()
+        length = len(payload)
+    if LARGE_POINTS < points < 2 ** 63:
+        body = HEADER.pack(operation, receipt_id.bytes, points, length)
+    else:
+        # One more bit for the sign
+        number = points.to_bytes(
+            points.bit_length() // 8 + 1, "big", signed=True)
+        body = (HEADER.pack(operation, receipt_id.bytes, LARGE_POINTS, length)
+                + LARGE_LENGTH.pack(len(number)) + number)
+    body += payload
+    return CRC.pack(zlib.crc32(body)) + body
+
+
+def read_file(path: str, magic: bytes, skip: int = 0) -> Iterator[tuple]:
+    """
+    Read the records of a journal or snapshot file, memory-mapped, from
+    `skip` bytes after the magic. Yield each record and the length of the
+    file up to the end of the record.
+    """
+    with open(path, "rb") as file:
+        if os.fstat(file.fileno()).st_size < len(magic):
+            return
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            if data[:len(magic)] != magic:
+                raise ValueError(f"Not a receipt journal file: {path}")
+            yield from iter_records(data, len(magic) + skip)
+
+
+def iter_records(data, offset: int) -> Iterator[tuple]:
+    """
+    Decode the records of a buffer from an offset. Yield each record, an
+    (operation, id bytes, points, JSON payload) tuple, and the offset after
+    it, until the end of the buffer or a torn record.
+    """
+    size = len(data)
+    while offset + CRC.size + HEADER.size <= size:
+        (crc,) = CRC.unpack_from(data, offset)
+        operation, id_bytes, points, length = HEADER.unpack_from(
+            data, offset + CRC.size)
+        header_size = CRC.size + HEADER.size
+        if points == LARGE_POINTS:
+            if offset + header_size + LARGE_LENGTH.size > size:
+                return
+            (number_length,) = LARGE_LENGTH.unpack_from(
+                data, offset + header_size)
+            header_size += LARGE_LENGTH.size
+            points = int.from_bytes(
+                data[offset + header_size:
+                     offset + header_size + number_length],
+                "big", signed=True)
+            header_size += number_length
+        payload_length = 0 if length == NO_PAYLOAD else length
+        end = offset + header_size + payload_length
+        if end > size or zlib.crc32(data[offset + CRC.size:end]) != crc:
+            return
+        payload = None
+        if length != NO_PAYLOAD:
+            payload = data[offset + header_size:end]
+        yield (operation, id_bytes, points, payload), end
+        offset = end
+
+
+def sync_directory(path: str):
+    """Fsync a directory, so the files created or renamed in it persist"""
+    descriptor = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(descriptor)
+    finally:
+        os.close(descriptor)
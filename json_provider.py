@@ -0,0 +1,114 @@
+"""
+Receipt Processor API - JSON Provider
+
+Decoding the request bodies and encoding the responses is a visible share
+of the cost of a small receipt. The JSON functions of this module, and the
+Fast_JSON_Provider of the Flask app, use orjson when it's installed and
+fall back to the standard library json module when it's not. Both decode
+into the plain dictionaries, lists and strings the validators read.
+
+    set_json_library("auto")     # orjson if installed, else stdlib
+    body = dumps({"id": "..."})  # bytes
+    data = loads(body)
+
+Written in Python 3.11.5 and Flask 2.3.3
+"""
+import json
+from typing import Any, Union
+from flask.json.provider import DefaultJSONProvider
+
+# orjson is optional, it's only needed for the fast path
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+JSON_LIBRARIES = ("auto", "orjson", "stdlib")
+
+# The library in use, set with set_json_library
+library = "orjson" if orjson is not None else "stdlib"
+
+
+def set_json_library(name: str):
+    """
+    Select the JSON library: "orjson", "stdlib", or "auto" for orjson when
+    it's installed.
+    """
+    global library
+
+    if name not in JSON_LIBRARIES:
+        raise ValueError(f"Unknown JSON library: {name}")
+    if name == "orjson" and orjson is None:
+        raise ValueError("The orjson JSON library is not installed.")
+    if name == "auto":
+        name = "orjson" if orjson is not None else "stdlib"
+    library = name
+
+
+def get_json_library() -> str:
+    return library
+
+
+def loads(data: Union[bytes, str]) -> Any:
+    """Decode a JSON document. Raises a ValueError if it's not valid."""
+    if library == "orjson":
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def dumps(content: Any) -> bytes:
+    """Encode some content as compact JSON"""
+    if library == "orjson":
+        return orjson.dumps(content)
+    return json.dumps(content, separators=(",", ":")).encode()
+
+
+class Fast_JSON_Provider(DefaultJSONProvider):
+    """
+    The JSON provider of the app, with the selected library. It keeps the
+    behavior of the Flask provider (sorted keys, indented responses in
+    debug mode, the Flask conversions of the dates, decimals and UUIDs),
+    except that orjson doesn't escape the non-ASCII characters. The calls
+    with options orjson doesn't have go to the standard library.
+    """
+
+    def dumps(self, obj: Any, **kwargs: Any) -> str:
+        if library == "orjson" and orjson_options(kwargs):
+            return self.encode(obj, kwargs.get("indent")).decode()
+        return super().dumps(obj, **kwargs)
+
+    def loads(self, s: Union[bytes, str], **kwargs: Any) -> Any:
+        if library == "orjson" and not kwargs:
+            return orjson.loads(s)
+        return super().loads(s, **kwargs)
+
+    def response(self, *args: Any, **kwargs: Any):
+        if library != "orjson":
+            return super().response(*args, **kwargs)
+
+        # Encoded straight to bytes, without the str round trip
+        obj = self._prepare_response_obj(args, kwargs)
+        indent = None
+        if (self.compact is None and self._app.debug) or self.compact is False:
+            indent = 2
+        return self._app.response_class(
+            self.encode(obj, indent) + b"\n", mimetype=self.mimetype)
+
+    def encode(self, obj: Any, indent: int = None) -> bytes:
+        # The datetimes are left to the Flask conversion (HTTP dates), so
+        # the output is the same with both libraries.
+        option = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS
+        if self.sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        if indent:
+            option |= orjson.OPT_INDENT_2
+        return orjson.dumps(obj, default=self.default, option=option)
+
+
+# Module helper functions
+
+def orjson_options(kwargs: dict) -> bool:
+    """Whether orjson can encode with the options of a dumps call"""
+    return (set(kwargs) <= {"indent", "separators"}
+            and kwargs.get("indent") in (None, 2))
@@ -0,0 +1,267 @@
+"""
+Receipt Processor API - Metrics
+
+Counters, gauges and latency histograms of the application, exposed in the
+Prometheus text format by the /metrics endpoint. Recording a value is a
+lock, a bisect and a couple of additions, cheap enough to leave the
+metrics on in production (set METRICS_ENABLED=false to turn them off).
+
+Written in Python 3.11.5 and Flask 2.3.3
+"""
+import threading
+import time
+from bisect import bisect_left
+from typing import Callable, Dict, List, Tuple
+from profiling import record_stage
+
+
+# Latency buckets in seconds, from 10 microseconds to 1 second
+LATENCY_BUCKETS = (
+    0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025,
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0
+)
+
+
+class Metric:
+    """
+    Base class of the metrics. A metric with labels has a child per
+    combination of label values, created on first use.
+    """
+
+    type_name = "untyped"
+
+    def __init__(self, name: str, help_text: str,
+                 label_names: Tuple[str, ...] = ()):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        # Values of the labels of a child, set by its parent
+        self.label_values: Tuple[str, ...] = ()
+        self.children: Dict[Tuple[str, ...], "Metric"] = {}
+        self.lock = threading.Lock()
+
+    def labels(self, *values: str):
+        """Get the child of the metric for some label values"""
+        child = self.children.get(values)
+        if child is None:
+            with self.lock:
+                child = self.children.get(values)
+                if child is None:
+                    child = self.children[values] = self.new_child()
+                    child.label_values = values
+        return child
+
+    def new_child(self):
+        return type(self)(self.name, self.help_text)
+
+    def samples(self) -> List[Tuple[str, dict, float]]:
+        """Get the (suffix, labels, value) samples of the metric"""
+        if not self.label_names:
+            return self.own_samples()
+        samples = []
+        for values, child in list(self.children.items()):
+            labels = dict(zip(self.label_names, values))
+            for suffix, sample_labels, value in child.own_samples():
+                samples.append((suffix, {**labels, **sample_labels}, value))
+        return samples
+
+    def own_samples(self) -> List[Tuple[str, dict, float]]:
+        raise NotImplementedError
+
+
+class Counter(Metric):
+    """A value that only goes up, like a number of requests"""
+
+    type_name = "counter"
+
+    def __init__(self, name: str, help_text: str,
+                 label_names: Tuple[str, ...] = ()):
+        super().__init__(name, help_text, label_names)
+        self.value = 0
+
+    def inc(self, amount: float = 1):
+        if enabled:
+            with self.lock:
+                self.value += amount
+
+    def own_samples(self):
+        return [("_total", {}, self.value)]
+
+
+class Gauge(Metric):
+    """A value read when the metrics are collected, like the pool size"""
+
+    type_name = "gauge"
+
+    def __init__(self, name: str, help_text: str, function: Callable = None):
+        super().__init__(name, help_text)
+        self.function = function
+
+    def own_samples(self):
+        return [("", {}, self.function() if self.function else 0)]
+
+
+class Histogram(Metric):
+    """The distribution of a value, like the latency of a stage"""
+
+    type_name = "histogram"
+
+    def __init__(self, name: str, help_text: str,
+                 label_names: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        super().__init__(name, help_text, label_names)
+        self.buckets = buckets
+        # Observations per bucket, the last one is +Inf
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def new_child(self):
+        return Histogram(self.name, self.help_text, buckets=self.buckets)
+
+    def observe(self, value: float):
+        if enabled:
+            index = bisect_left(self.buckets, value)
+            with self.lock:
+                self.counts[index] += 1
+                self.sum += value
+                self.count += 1
+
+    def time(self) -> "Timer":
+        """Time a block of code: `with histogram.time(): ...`"""
+        return Timer(self)
+
+    def own_samples(self):
+        samples = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + ("+Inf",), self.counts):
+            cumulative += count
+            samples.append(("_bucket", {"le": str(bound)}, cumulative))
+        samples.append(("_sum", {}, self.sum))
+        samples.append(("_count", {}, self.count))
+        return samples
+
+
+class Timer:
+    """
+    Context manager that observes the time spent in its block. The time is
+    also added to the stage trace of the current request, if it's traced
+    (see profiling.py), under the label of the histogram.
+    """
+
+    __slots__ = ("histogram", "start")
+
+    def __init__(self, histogram: Histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        elapsed = time.perf_counter() - self.start
+        self.histogram.observe(elapsed)
+        record_stage(self.histogram.label_values[0]
+                     if self.histogram.label_values
+                     else self.histogram.name, elapsed)
+
+
+class Metrics_Registry:
+    """The metrics of the application, rendered for Prometheus"""
+
+    def __init__(self):
+        self.metrics: Dict[str, Metric] = {}
+
+    def register(self, metric: Metric) -> Metric:
+        self.metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        """Render the metrics in the Prometheus text format"""
+        lines = []
+        for metric in self.metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.help_text}")
+            lines.append(f"# TYPE {metric.name} {metric.type_name}")
+            for suffix, labels, value in metric.samples():
+                lines.append(
+                    f"{metric.name}{suffix}{format_labels(labels)} "
+                    f"{format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+# Module helper functions
+
+def format_labels(labels: dict) -> str:
+    if not labels:
+        return ""
+    pairs = ",".join(
+        f'{name}="{escape_label(str(value))}"'
+        for name, value in labels.items())
+    return "{" + pairs + "}"
+
+
+def escape_label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace(
+        '"', '\\"')
+
+
+def format_value(value: float) -> str:
+    if isinstance(value, float) and not value.is_integer():
+        return repr(value)
+    return str(int(value))
+
+
+def set_enabled(value: bool):
+    """Turn the recording of the metrics on or off"""
+    global enabled
+    enabled = value
+
+
+# Whether the metrics are recorded
+enabled = True
+
+# The metrics of the application
+registry = Metrics_Registry()
+
+STAGE_SECONDS = registry.register(Histogram(
+    "receipt_stage_seconds",
+    "Time spent in each stage of the receipt processing.",
+    ("stage",)))
+REQUEST_SECONDS = registry.register(Histogram(
+    "http_request_duration_seconds",
+    "Time spent handling the requests, by endpoint.",
+    ("endpoint",)))
+REQUESTS = registry.register(Counter(
+    "http_requests",
+    "Requests handled, by endpoint and status code.",
+    ("endpoint", "status")))
+RECEIPTS_PROCESSED = registry.register(Counter(
+    "receipts_processed", "Receipts validated, scored and stored."))
+VALIDATION_ERRORS = registry.register(Counter(
+    "receipt_validation_errors", "Receipts rejected by the validation."))
+IDEMPOTENT_REPLAYS = registry.register(Counter(
+    "idempotent_replays",
+    "Resubmitted receipts answered with the id they already had."))
+POINTS_LOOKUPS = registry.register(Counter(
+    "points_lookups", "Requests for the points of a receipt."))
+POINTS_NOT_FOUND = registry.register(Counter(
+    "points_not_found", "Requests for the points of an unknown receipt."))
+POINTS_CACHE_HITS = registry.register(Counter(
+    "points_cache_hits", "Points requests answered from the cache."))
+RECEIPTS_EVICTED = registry.register(Counter(
+    "receipts_evicted",
+    "Receipts evicted from the pool by the retention policy, by reason.",
+    ("reason",)))
+REQUESTS_SHED = registry.register(Counter(
+    "requests_shed",
+    "Requests rejected by the admission control, by reason.",
+    ("reason",)))
+
+# Timers of the stages of the receipt processing
+PARSE_JSON = STAGE_SECONDS.labels("parse_json")
+VALIDATE_RECEIPT = STAGE_SECONDS.labels("validate_receipt")
+CALCULATE_POINTS = STAGE_SECONDS.labels("calculate_points")
+ADD_RECEIPT = STAGE_SECONDS.labels("add_receipt")
+ADD_RECEIPTS = STAGE_SECONDS.labels("add_receipts")
+SCORE_BATCH = STAGE_SECONDS.labels("score_batch")
+LOG_RECORD = STAGE_SECONDS.labels("log_record")
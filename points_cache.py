@@ -0,0 +1,66 @@
+"""
+Receipt Processor API - Points Response Cache
+
+The points of a receipt never change, and the points endpoint takes many
+more reads than the receipts take writes. The Points_Cache keeps the
+serialized {"points": ...} response of the receipts already requested,
+keyed by the id as it appears in the path, so a cached read skips the id
+parsing, the pool lookup and the JSON encoding.
+
+Written in Python 3.11.5 and Flask 2.3.3
+"""
+from typing import Dict, Optional, Tuple
+from uuid import UUID
+from json_provider import dumps
+from receipts import Pool_Listener, Receipt
+
+
+# A cached response: the JSON body, the ETag without its quotes, and the id
+# of the receipt
+Points_Response = Tuple[bytes, str, UUID]
+
+
+class Points_Cache(Pool_Listener):
+    """
+    A bounded cache of the points responses, by receipt id. Only the ids in
+    their canonical form (lowercase with hyphens) are cached, so a deleted
+    receipt has a single entry to drop. When the cache is full the oldest
+    entries are evicted first.
+    """
+
+    def __init__(self, max_entries: int = 100000):
+        self.max_entries = max_entries
+        # Reads don't take a lock, a dictionary lookup is atomic
+        self.responses: Dict[str, Points_Response] = {}
+
+    def get(self, receipt_id: str) -> Optional[Points_Response]:
+        return self.responses.get(receipt_id)
+
+    def put(self, receipt_id: str, response: Points_Response):
+        while len(self.responses) >= self.max_entries:
+            try:
+                del self.responses[next(iter(self.responses))]
+            except (KeyError, RuntimeError, StopIteration):
+                # Evicted or changed by another thread
+                break
+        self.responses[receipt_id] = response
+
+    def discard(self, receipt_id: str):
+        self.responses.pop(receipt_id, None)
+
+    def receipt_deleted(self, receipt_id: UUID):
+        self.discard(str(receipt_id))
+
+    def __len__(self) -> int:
+        return len(self.responses)
+
+
+# Module helper functions
+
+def points_response(receipt: Receipt) -> Points_Response:
+    """
+    Serialize the points response of a receipt. The ETag is strong: the
+    points of a receipt id never change.
+    """
+    body = dumps({"points": str(receipt.points)})
+    return body, f"{receipt.id.hex}-{receipt.points}", receipt.id
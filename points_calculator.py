@@ -0,0 +1,321 @@
+"""
+Receipt Processor API - Points Calculator
+
+A small rule engine for the points awarded to a receipt. The rules are
+declared as data in a JSON (or YAML) file and compiled once into a flat
+evaluation plan, so the promotions can change without a code deploy.
+
+The money amounts are parsed into integer cents and the multipliers of
+the rules into fractions, so the arithmetic of the rules is exact: a 15.00
+item at 0.2 is worth 3 points, not the 4 of ceil(15.0 * 0.2).
+
+The same retailers and item descriptions come back receipt after receipt,
+so the alphanumeric count of a retailer and the trimmed length of a
+description are memoized, in bounded LRU caches with hit statistics.
+
+Written in Python 3.11.5 and Flask 2.3.3
+"""
+import json
+import os
+from fractions import Fraction
+from functools import lru_cache
+from typing import Callable, Dict, List, Tuple, Union
+
+
+# Rules file used when no other file is configured
+DEFAULT_RULES_FILE = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "static", "points_rules.json")
+
+# Maximum entries of the memo caches by default (0 for no cache)
+DEFAULT_RETAILER_MEMO_SIZE = 65536
+DEFAULT_DESCRIPTION_MEMO_SIZE = 0
+
+
+class Memo_Cache:
+    """
+    A bounded memo of a function of a string: the least recently used
+    results are evicted past `max_size` entries, and the hits and misses
+    are counted. With a `max_size` of 0 the function is called directly.
+    The cache is the functools LRU cache, safe to share between threads.
+    """
+
+    def __init__(self, function: Callable[[str], int], max_size: int):
+        self.function = function
+        self.resize(max_size)
+
+    def resize(self, max_size: int):
+        """Change the maximum entries of the cache, emptying it"""
+        self.max_size = max_size
+        self.get: Callable[[str], int] = (
+            lru_cache(maxsize=max_size)(self.function) if max_size > 0
+            else self.function)
+
+    def clear(self):
+        if self.max_size > 0:
+            self.get.cache_clear()
+
+    def stats(self) -> dict:
+        """Get the hits, misses, size and hit ratio of the cache"""
+        if self.max_size > 0:
+            hits, misses, _, size = self.get.cache_info()
+        else:
+            hits = misses = size = 0
+        lookups = hits + misses
+        return {
+            "hits": hits,
+            "misses": misses,
+            "size": size,
+            "max_size": self.max_size,
+            "hit_ratio": hits / lookups if lookups else 0.0,
+        }
+
+
+def count_alphanumeric(text: str) -> int:
+    """Count the alphanumeric characters of a string"""
+    return sum(1 for char in text if char.isalnum())
+
+
+def trimmed_length(text: str) -> int:
+    """Get the length of a string without its leading and trailing spaces"""
+    return len(text.strip())
+
+
+# Memo of the alphanumeric count of the retailers, for the
+# retailer_alphanumeric rule. Counting the characters in Python is the most
+# expensive part of a rule, and a hit costs a hash lookup.
+retailer_memo = Memo_Cache(count_alphanumeric, DEFAULT_RETAILER_MEMO_SIZE)
+# Memo of the trimmed length of the item descriptions. Off by default: the
+# strip is in C, and hashing a description costs about as much as trimming
+# it (see benchmarks/bench_memo.py).
+description_memo = Memo_Cache(trimmed_length, DEFAULT_DESCRIPTION_MEMO_SIZE)
+
+
+def set_memo_sizes(retailer_size: int, description_size: int):
+    """Set the maximum entries of the memo caches (0 to turn one off)"""
+    retailer_memo.resize(retailer_size)
+    description_memo.resize(description_size)
+
+
+def memo_stats() -> Dict[str, dict]:
+    """Get the statistics of the memo caches, by name"""
+    return {
+        "retailer": retailer_memo.stats(),
+        "description": description_memo.stats(),
+    }
+
+
+class Receipt_Facts:
+    """
+    The parsed values of a (validated) receipt that the rules are evaluated
+    against. Every field of the receipt is parsed a single time, no matter
+    how many rules use it: the money in integer cents, the purchase date
+    and time as integers, and the trimmed lengths of the descriptions.
+    """
+
+    __slots__ = ("retailer", "total", "items", "year", "month", "day",
+                 "minutes")
+
+    def __init__(self, receipt: dict):
+        self.retailer: str = receipt["retailer"]
+        self.total: int = parse_cents(receipt["total"])
+
+        # Pairs of (trimmed description length, price in cents) per item
+        description_length = description_memo.get
+        self.items: List[Tuple[int, int]] = [
+            (description_length(item["shortDescription"]),
+             parse_cents(item["price"]))
+            for item in receipt["items"]
+        ]
+
+        year, month, day = receipt["purchaseDate"].split("-")
+        self.year: int = int(year)
+        self.month: int = int(month)
+        self.day: int = int(day)
+
+        # Time of the purchase as minutes since midnight
+        self.minutes: int = parse_minutes(receipt["purchaseTime"])
+
+
+class Points_Calculator:
+    """
+    A class to calculate the points awarded to a receipt. The rules are
+    compiled when the calculator is created: receipt rules become a tuple
+    of functions over the receipt facts, and item rules are fused into a
+    single pass over the items of the receipt.
+    """
+
+    def __init__(self, rules: List[dict]):
+        self.rules: List[dict] = rules
+
+        receipt_plan = []
+        item_plan = []
+        for rule in rules:
+            scope, evaluate = compile_rule(rule)
+            if scope == "item":
+                item_plan.append(evaluate)
+            else:
+                receipt_plan.append(evaluate)
+
+        self.receipt_plan: Tuple[Callable, ...] = tuple(receipt_plan)
+        self.item_plan: Tuple[Callable, ...] = tuple(item_plan)
+
+    @classmethod
+    def from_file(cls, path: str = DEFAULT_RULES_FILE):
+        """Create a calculator from a JSON or YAML rules file"""
+        return cls(load_rules(path))
+
+    def calculate(self, receipt: Union[dict, Receipt_Facts]) -> int:
+        """
+        Calculates the points awarded for a (validated) receipt, or for its
+        already parsed facts.
+        """
+        facts = (receipt if isinstance(receipt, Receipt_Facts)
+                 else Receipt_Facts(receipt))
+        points = 0
+
+        for evaluate in self.receipt_plan:
+            points += evaluate(facts)
+
+        if self.item_plan:
+            for length, price in facts.items:
+                for evaluate in self.item_plan:
+                    points += evaluate(length, price)
+
+        return points
+
+
+# Rules loading and compilation
+
+def load_rules(path: str) -> List[dict]:
+    """
+    Load the rules from a JSON or YAML file. The file holds either a list
+    of rules or an object with the list under the "rules" key.
+    """
+    with open(path) as rules_file:
+        if path.endswith((".yml", ".yaml")):
+            # PyYAML is optional, it's only needed for YAML rules files
+            import yaml
+            content = yaml.safe_load(rules_file)
+        else:
+            content = json.load(rules_file)
+
+    if isinstance(content, dict):
+        content = content.get("rules")
+    if not isinstance(content, list):
+        raise ValueError(f"The rules file {path} doesn't have a rules list.")
+    return content
+
+
+# Compilers for each rule type. Each one returns the scope of the rule
+# ("receipt" or "item") and the function that evaluates it.
+RULE_COMPILERS: Dict[str, Tuple[str, Callable]] = {}
+
+
+def rule_type(name: str, scope: str = "receipt"):
+    """Register the compiler of a rule type"""
+    def register(compiler):
+        RULE_COMPILERS[name] = (scope, compiler)
+        return compiler
+    return register
+
+
+def compile_rule(rule: dict) -> Tuple[str, Callable]:
+    """Compile a rule declaration into its scope and evaluation function"""
+    if not isinstance(rule, dict) or "type" not in rule:
+        raise ValueError(f"Invalid points rule: {rule}")
+    if rule["type"] not in RULE_COMPILERS:
+        raise ValueError(f"Unknown points rule type: {rule['type']}")
+
+    scope, compiler = RULE_COMPILERS[rule["type"]]
+    try:
+        return scope, compiler(rule)
+    except (KeyError, TypeError, ValueError) as error:
+        raise ValueError(
+            f"Invalid points rule {rule.get('name', rule['type'])}: {error}")
+
+
+def parse_minutes(time_str: str) -> int:
+    """Get the minutes since midnight of a time string in the format HH:MM"""
+    hour, minute = time_str.split(":")
+    return int(hour) * 60 + int(minute)
+
+
+def parse_cents(money_str: str) -> int:
+    """Get the cents of a (validated) amount in the format 0.00"""
+    return int(money_str.replace(".", ""))
+
+
+def parse_fraction(value) -> Fraction:
+    """
+    Get the exact value of a number of a rule, like "0.25" or 0.2 (by its
+    shortest repr, so 0.2 is 1/5 and not the nearest binary float).
+    """
+    return Fraction(str(value))
+
+
+@rule_type("retailer_alphanumeric")
+def compile_retailer_alphanumeric(rule: dict) -> Callable:
+    # Points for every alphanumeric character in the retailer's name. The
+    # memo is looked up on each call, so it can be resized after compiling.
+    per_character = int(rule.get("points_per_character", 1))
+    return lambda facts: per_character * retailer_memo.get(facts.retailer)
+
+
+@rule_type("round_total")
+def compile_round_total(rule: dict) -> Callable:
+    # Points if the total is round dollar amount with no cents
+    points = int(rule["points"])
+    return lambda facts: points if facts.total % 100 == 0 else 0
+
+
+@rule_type("total_multiple")
+def compile_total_multiple(rule: dict) -> Callable:
+    # Points if the total is multiple of the given amount. In cents,
+    # total / 100 is a multiple of n / d when total * d % (100 * n) == 0.
+    points = int(rule["points"])
+    multiple = parse_fraction(rule["multiple"])
+    if multiple <= 0:
+        raise ValueError("the multiple must be positive")
+    numerator = multiple.numerator * 100
+    denominator = multiple.denominator
+    return lambda facts: (
+        points if facts.total * denominator % numerator == 0 else 0)
+
+
+@rule_type("item_groups")
+def compile_item_groups(rule: dict) -> Callable:
+    # Points for every group of items on the receipt
+    points = int(rule["points"])
+    group_size = int(rule["group_size"])
+    return lambda facts: (len(facts.items) // group_size) * points
+
+
+@rule_type("item_description_length", scope="item")
+def compile_item_description_length(rule: dict) -> Callable:
+    # If the trimmed lenght of the item description is a multiple of the
+    # given number, multiply the price and round up to the nearest integer.
+    # The price is in cents: ceil(price * n / (100 * d)), in integers.
+    multiple = int(rule["multiple"])
+    multiplier = parse_fraction(rule["price_multiplier"])
+    numerator = multiplier.numerator
+    denominator = multiplier.denominator * 100
+    return lambda length, price: (
+        -(-price * numerator // denominator) if length % multiple == 0
+        else 0)
+
+
+@rule_type("odd_day")
+def compile_odd_day(rule: dict) -> Callable:
+    # Points if the day in the purchase date is odd
+    points = int(rule["points"])
+    return lambda facts: points if facts.day % 2 == 1 else 0
+
+
+@rule_type("purchase_time_window")
+def compile_purchase_time_window(rule: dict) -> Callable:
+    # Points if the time of the purchase is after the start time and
+    # before the end time (both exclusive).
+    points = int(rule["points"])
+    start = parse_minutes(rule["start"])
+    end = parse_minutes(rule["end"])
+    return lambda facts: points if start < facts.minutes < end else 0
@@ -0,0 +1,137 @@
+"""
+Receipt Processor API - Profiling
+
+Two ways to see where the time of a slow request goes:
+
+- The Slow_Request_Recorder keeps the slowest requests, with the time
+  spent in each stage (parse_json, validate_receipt, calculate_points,
+  add_receipt, log_record, ...). The stage timers of the metrics add their
+  time to the trace of the current request, a dictionary in a context
+  variable, so a request only pays for a dictionary and a few additions.
+- The Request_Profiler runs cProfile on a single request, when the admin
+  asks for it with a header, and saves the stats for pstats or snakeviz.
+
+Written in Python 3.11.5 and Flask 2.3.3
+"""
+import heapq
+import hmac
+import itertools
+import os
+import re
+import threading
+import time
+from contextvars import ContextVar
+from typing import Dict, List, Optional
+
+
+# Characters of the request paths not kept in the profile file names
+UNSAFE_CHARACTERS = re.compile(r"[^A-Za-z0-9-]")
+
+# Seconds spent in each stage by the current request. None outside of the
+# traced requests, the stage timers then record nothing here.
+stage_trace: ContextVar[Optional[Dict[str, float]]] = ContextVar(
+    "stage_trace", default=None)
+
+
+def record_stage(stage: str, seconds: float):
+    """Add the time of a stage to the trace of the current request"""
+    trace = stage_trace.get()
+    if trace is not None:
+        trace[stage] = trace.get(stage, 0.0) + seconds
+
+
+class Slow_Request_Recorder:
+    """
+    Keeps the `size` slowest requests that took at least `threshold`
+    seconds, with their stage timings. A min-heap, so a request faster
+    than all of the kept ones is rejected without taking the lock.
+    """
+
+    def __init__(self, size: int = 50, threshold: float = 0.0):
+        self.size = size
+        self.threshold = threshold
+        self.lock = threading.Lock()
+        # Entries of (duration, sequence, request), the fastest first
+        self.heap: List[tuple] = []
+        self.sequence = itertools.count()
+
+    def record(self, duration: float, method: str, path: str,
+               status: Optional[int], stages: Dict[str, float]):
+        """Record a request, if it's one of the slowest"""
+        if duration < self.threshold:
+            return
+        heap = self.heap
+        if len(heap) >= self.size and duration <= heap[0][0]:
+            return
+
+        stages_ms = {stage: round(seconds * 1000, 3)
+                     for stage, seconds in stages.items()}
+        request = {
+            "method": method,
+            "path": path,
+            "status": status,
+            "duration_ms": round(duration * 1000, 3),
+            "stages_ms": stages_ms,
+            # The time outside of the timed stages: routing, hooks, ...
+            "other_ms": round(
+                (duration - sum(stages.values())) * 1000, 3),
+            "time": time.time(),
+        }
+        entry = (duration, next(self.sequence), request)
+        with self.lock:
+            if len(heap) < self.size:
+                heapq.heappush(heap, entry)
+            elif duration > heap[0][0]:
+                heapq.heapreplace(heap, entry)
+
+    def slowest(self) -> List[dict]:
+        """Get the recorded requests, the slowest first"""
+        with self.lock:
+            entries = sorted(self.heap, reverse=True)
+        return [request for _, _, request in entries]
+
+    def clear(self):
+        with self.lock:
+            self.heap.clear()
+
+
+class Request_Profiler:
+    """
+    Profiles the requests that carry the admin token in their profile
+    header, with cProfile, and saves the stats of each one in `directory`.
+    """
+
+    def __init__(self, directory: str, token: str):
+        self.directory = directory
+        self.token = token
+
+    def wanted(self, header_value: Optional[str]) -> bool:
+        """Whether the profile header of a request asks for a profile"""
+        return bool(header_value) and is_admin_token(
+            header_value, self.token)
+
+    def start(self):
+        """Start profiling the current thread. Return the profile."""
+        # Imported here, cProfile is only needed for the profiled requests
+        import cProfile
+        profile = cProfile.Profile()
+        profile.enable()
+        return profile
+
+    def stop(self, profile, method: str, path: str) -> str:
+        """Stop a profile and save its stats. Return the file name."""
+        profile.disable()
+        os.makedirs(self.directory, exist_ok=True)
+        # Unique and safe names, like 1700000000123456789-get_metrics.prof
+        name = "{}-{}{}.prof".format(
+            time.time_ns(), method.lower(), UNSAFE_CHARACTERS.sub("_", path))
+        profile.dump_stats(os.path.join(self.directory, name))
+        return name
+
+
+# Module helper functions
+
+def is_admin_token(value: Optional[str], token: str) -> bool:
+    """Check a token against the admin token, in constant time"""
+    return bool(token) and value is not None and hmac.compare_digest(
+        value.encode(), token.encode())
@@ -7,11 +7,24 @@ September 2023
 
 Written in Python 3.11.5 and Flask 2.3.3
 """
+import logging
 import os
-from typing import Dict
+from typing import Callable, Dict, Iterator, List, Union
 from uuid import UUID, uuid4  # From Python standard library for unique ids
 from marshmallow import Schema, fields, validate, ValidationError
-from math import ceil
+from points_calculator import Points_Calculator, Receipt_Facts
+from storage import Storage_Backend, Dict_Storage
+from metrics import (
+    ADD_RECEIPT, ADD_RECEIPTS, CALCULATE_POINTS, VALIDATE_RECEIPT
+)
+from validators import (
+    Fast_Receipt_Validator, check_structure, RETAILER_PATTERN, DATE_PATTERN,
+    TIME_PATTERN, MONEY_PATTERN, DESCRIPTION_PATTERN
+)
+
+
+# Logger of the receipt pool, a child of the app logger (app.py)
+logger = logging.getLogger("app.receipts")
 
 
 class Receipt:
@@ -28,16 +41,55 @@ class Receipt:
         # Attempt to validate the receipt. If validation fails,
         # the ValidationError exception will be raised and can be caught
         # outside this method in the specific route.
-        self.validate_receipt(receipt)
-
-        self.id: UUID = self.generate_id()
-        self.points: int = self.calculate_points(receipt)
         self.data: dict = receipt
+        self.points: int = None
+        self.score()
+        self.id: UUID = self.generate_id()
+
+    @classmethod
+    def deferred(cls, receipt: dict):
+        """
+        Create a receipt to score later, with score(). Only the structure
+        of the receipt is validated now: its fields may still be invalid.
+        """
+        errors = check_structure(receipt)
+        if errors:
+            raise ValidationError(f"Receipt validation failed: {errors}")
+        return cls.from_stored(uuid4(), None, receipt)
+
+    @classmethod
+    def from_stored(cls, receipt_id: UUID, points: int, data: dict):
+        """
+        Rebuild a receipt that was already validated and scored, like the
+        ones loaded from a storage backend.
+        """
+        receipt = cls.__new__(cls)
+        receipt.id = receipt_id
+        receipt.points = points
+        receipt.data = data
+        return receipt
+
+    def score(self) -> int:
+        """
+        Validate and score the receipt, once: the points are memoized. The
+        valid receipt is parsed once, into the facts the points rules are
+        evaluated on. Raises a ValidationError if the receipt is invalid.
+        """
+        if self.points is None:
+            with VALIDATE_RECEIPT.time():
+                self.validate_receipt(self.data)
+                facts = Receipt_Facts(self.data)
+            with CALCULATE_POINTS.time():
+                self.points = self.calculate_points(facts)
+        return self.points
 
     def validate_receipt(self, receipt: dict) -> bool:
-        """ Use Marshmallow schema to validate the receipt data """
-        schema = ReceiptSchema()
-        errors = schema.validate(receipt)
+        """
+        Validate the receipt data with the configured validator: the fast
+        path validator or the Marshmallow schema. Both report the same
+        errors.
+        """
+        errors = get_receipt_validator().validate(receipt)
         if errors:
             # If there are validation errors, raise an exception including
             # the detail errors
@@ -51,94 +103,182 @@ class Receipt:
         """
         return uuid4()
 
-    def calculate_points(self, receipt: dict) -> int:
+    def calculate_points(self, receipt: Union[dict, Receipt_Facts]) -> int:
         """
-        Calculates the points awarded for the receipt. It currently
-        uses hardcoded rules, but it will be extended to use
-        dynamic rules in the future. It will possible be refacttored
-        into a separate class: Points_Calculator.
+        Calculates the points awarded for the receipt, or its parsed facts.
+        The rules are declared in a rules file and applied by the
+        Points_Calculator compiled at startup.
         """
-        points = 0
+        return get_points_calculator().calculate(receipt)
 
-        # One point for every alphanumeric character in the retailer's name
-        points += count_alphanumeric(receipt["retailer"])
-        # print("1", points)
 
-        # 50 points if the total is round dollar amount with no cents
-        if has_zero_cents(receipt["total"]):
-            points += 50
-        # print("2", points)
-
-        # 25 points if the total is multiple of 0.25
-        if float(receipt["total"]) % 0.25 == 0:
-            points += 25
-        # print("3", points)
-
-        # 5 points for every two items on the receipt
-        points += (len(receipt["items"]) // 2) * 5
-        # print("4", points)
+class Pool_Listener:
+    """
+    Base class of the objects notified of the changes of a receipt pool,
+    like the caches that must drop the deleted receipts. The listeners
+    that set `tracks_reads` are also notified of the receipts read.
+    """
 
-        # If the trimmed lenght of the item description is a multiple of 3,
-        # multiply the price by 0.2 and round up to the nearest integer.
-        for item in receipt["items"]:
-            if len(item["shortDescription"].strip()) % 3 == 0:
-                points += ceil(float(item["price"]) * 0.2)
-        # print("5", points)
+    tracks_reads = False
 
-        # 6 points if the day in the purchase date is odd
-        if get_day(receipt["purchaseDate"]) % 2 == 1:
-            points += 6
-        # print("6", points)
+    def receipt_added(self, receipt: Receipt):
+        pass
 
-        # 10 points if the time of the purchase is after 2:00 PM (14:00)
-        # and before 4:00 PM (16:00)
-        hour, minute = split_time(receipt["purchaseTime"])
-        if hour == 15 or (hour == 14 and minute > 0):
-            points += 10
-        # print("7", points)
+    def receipt_deleted(self, receipt_id: UUID):
+        pass
 
-        return points
+    def receipt_read(self, receipt_id: UUID):
+        pass
 
 
 class Receipt_Pool:
     """
     A class to represent the receipt pool. It will be used to store
-    the receipts in memory.
+    the receipts, in memory or in the configured storage backend.
     """
 
-    def __init__(self):
-        self.data: Dict[UUID, Receipt] = {}
+    def __init__(self, storage: Storage_Backend = None,
+                 keep_payload: bool = True):
+        self.data: Storage_Backend = (
+            storage if storage is not None else Dict_Storage())
+        # Without keep_payload only the id and points of the receipts are
+        # stored, the raw payload is dropped after scoring.
+        self.keep_payload = keep_payload
+        self.listeners: List[Pool_Listener] = []
+        self.read_listeners: List[Pool_Listener] = []
+        # Called before the storage is closed, like the deferred scorer
+        # that still adds its queued receipts
+        self.close_hooks: List[Callable[[], None]] = []
+        self.closed = False
+
+    def add_listener(self, listener: Pool_Listener):
+        """Notify a listener of the receipts added and deleted"""
+        self.listeners.append(listener)
+        if listener.tracks_reads:
+            self.read_listeners.append(listener)
 
     def add_receipt(self, receipt: Receipt):
-        # Safety check to avoid id collisions
-        while receipt.id in self.data:
-            receipt.id = receipt.generate_id()
-
-        self.data[receipt.id] = receipt
-        app_logger = get_logger()
-        app_logger.info(f"Added receipt with ID {receipt.id} to the pool.")
+        # Safety check to avoid id collisions: the storage only adds the
+        # receipt if its id is not in use.
+        stored = self.stored_receipt(receipt)
+        with ADD_RECEIPT.time():
+            while not self.data.add(stored):
+                receipt.id = stored.id = receipt.generate_id()
+        # The listeners get the receipt with its payload, even when it's
+        # not stored.
+        for listener in self.listeners:
+            listener.receipt_added(receipt)
+
+        logger.info(f"Added receipt with ID {receipt.id} to the pool.")
+
+    def add_receipts(self, receipts: List[Receipt]):
+        """
+        Add several receipts to the pool at once. It logs a single
+        message for the whole group instead of one per receipt.
+        """
+        stored = [self.stored_receipt(receipt) for receipt in receipts]
+        with ADD_RECEIPTS.time():
+            collisions = self.data.add_many(stored)
+            if collisions:
+                originals = {
+                    id(copy): receipt
+                    for copy, receipt in zip(stored, receipts)}
+            for copy in collisions:
+                # Safety check to avoid id collisions
+                receipt = originals[id(copy)]
+                receipt.id = copy.id = receipt.generate_id()
+                while not self.data.add(copy):
+                    receipt.id = copy.id = receipt.generate_id()
+        for listener in self.listeners:
+            for receipt in receipts:
+                listener.receipt_added(receipt)
+
+        logger.info(f"Added {len(receipts)} receipts to the pool.")
+
+    def stored_receipt(self, receipt: Receipt) -> Receipt:
+        """Get the receipt to store: itself, or a copy without payload"""
+        if self.keep_payload or receipt.data is None:
+            return receipt
+        return Receipt.from_stored(receipt.id, receipt.points, None)
 
     def get_receipt(self, receipt_id: UUID) -> Receipt:
-        return self.data.get(receipt_id, None)
+        receipt = self.data.get(receipt_id)
+        if receipt is not None:
+            self.touch(receipt_id)
+        return receipt
+
+    def get_receipts(self, receipt_ids: List[UUID]) -> List[Receipt]:
+        """Get several receipts at once, None for the ones not found"""
+        receipts = self.data.get_many(receipt_ids)
+        if self.read_listeners:
+            for receipt in receipts:
+                if receipt is not None:
+                    self.touch(receipt.id)
+        return receipts
+
+    def touch(self, receipt_id: UUID):
+        """Notify the listeners that track the reads of a receipt read"""
+        for listener in self.read_listeners:
+            listener.receipt_read(receipt_id)
 
     def get_all_receipts(self) -> Dict[UUID, Receipt]:
-        return self.data
+        return self.data.to_dict()
+
+    def iter_receipts(self) -> Iterator[Receipt]:
+        """Iterate over the receipts without loading them all at once"""
+        return iter(self.data)
+
+    def __len__(self) -> int:
+        return len(self.data)
+
+    def __contains__(self, receipt_id: UUID) -> bool:
+        return receipt_id in self.data
+
+    def evict_receipts(self, receipt_ids: List[UUID]) -> int:
+        """
+        Delete several receipts, like the ones past their retention. It
+        logs a single message for the whole group. Return the number of
+        receipts deleted.
+        """
+        deleted = 0
+        for receipt_id in receipt_ids:
+            if self.data.delete(receipt_id):
+                deleted += 1
+                for listener in self.listeners:
+                    listener.receipt_deleted(receipt_id)
+
+        logger.info(f"Evicted {deleted} receipts from the pool.")
+        return deleted
 
     def delete_receipt(self, receipt_id: UUID) -> bool:
-        app_logger = get_logger()
-        if self.data.get(receipt_id, None):
-            del self.data[receipt_id]
-            app_logger.info(
+        if self.data.delete(receipt_id):
+            for listener in self.listeners:
+                listener.receipt_deleted(receipt_id)
+            logger.info(
                 f"Deleted receipt with ID {receipt_id} from the pool.")
             return True
 
         else:
-            app_logger.warning(
+            logger.warning(
                 f"Attempted to delete receipt with ID {receipt_id}"
                 ", but it was not found in the pool."
             )
             return False
 
+    def on_close(self, hook: Callable[[], None]):
+        """Call a function when the pool is closed, before its storage"""
+        self.close_hooks.append(hook)
+
+    def close(self):
+        """
+        Run the close hooks, then release the storage backend. It can be
+        called more than once.
+        """
+        for hook in self.close_hooks:
+            hook()
+        self.closed = True
+        self.data.close()
+
 
 # Validations Schemas for the Receipt class using marshmallow. The schemas
 # are base in the regex patterns provided in challenge OpenAPI specification.
@@ -150,11 +290,11 @@ class ItemSchema(Schema):
     # characters, spaces, and hyphens. Accepts descriptions with trailing and
     # leading spaces.
     shortDescription = fields.Str(
-        required=True, validate=validate.Regexp(r"^[\w\s\-]+$"))
+        required=True, validate=validate.Regexp(DESCRIPTION_PATTERN))
     # Validates that the price is in the format of digits, followed by
     # a period, and then exactly two digits.
     price = fields.Str(
-        required=True, validate=validate.Regexp(r"^\d+\.\d{2}$"))
+        required=True, validate=validate.Regexp(MONEY_PATTERN))
 
 
 # Schema for the receipt itself
@@ -166,16 +306,16 @@ class ReceiptSchema(Schema):
     # spaces at all! Which is obviously wrong considering the examples
     # provided in the same specification!
     retailer = fields.Str(
-        required=True, validate=validate.Regexp(r"^\S(.*\S)?$"))
+        required=True, validate=validate.Regexp(RETAILER_PATTERN))
     # Validates if the input is in the format "YYYY-MM-DD"
     purchaseDate = fields.Str(
         required=True,
-        validate=validate.Regexp(r"^\d{4}-\d{2}-\d{2}$")
+        validate=validate.Regexp(DATE_PATTERN)
     )
     # Validates if the input is in a 24-hour format like "HH:MM"
     purchaseTime = fields.Str(
         required=True,
-        validate=validate.Regexp(r"^([01]?[0-9]|2[0-3]):[0-5][0-9]$")
+        validate=validate.Regexp(TIME_PATTERN)
     )
     # Validates that there's at least one item in the receipt.
     items = fields.List(fields.Nested(ItemSchema),
@@ -183,15 +323,57 @@ class ReceiptSchema(Schema):
     # Similar to the item price, this validates that the total is
     # in the correct monetary format.
     total = fields.Str(
-        required=True, validate=validate.Regexp(r"^\d+\.\d{2}$"))
+        required=True, validate=validate.Regexp(MONEY_PATTERN))
 
 
 # Module helper functions
 
-def get_logger():
-    """Lazily import the app logger to avoid circular imports"""
-    from app import app_logger
-    return app_logger
+# Points calculator shared by all the receipts. The app sets it at startup
+# from the configured rules file, otherwise the default rules are compiled
+# the first time a receipt is scored.
+points_calculator = None
+
+
+def get_points_calculator() -> Points_Calculator:
+    """Get the points calculator, compiling the default rules if needed"""
+    global points_calculator
+    if points_calculator is None:
+        points_calculator = Points_Calculator.from_file()
+    return points_calculator
+
+
+def set_points_calculator(calculator: Points_Calculator):
+    """Replace the points calculator used to score the receipts"""
+    global points_calculator
+    points_calculator = calculator
+
+
+# Validators available for the receipts, by name. The Marshmallow schema is
+# stateless, so a single instance is shared by all the receipts.
+RECEIPT_VALIDATORS = {
+    "fast": Fast_Receipt_Validator,
+    "marshmallow": lambda: ReceiptSchema(),
+}
+
+# Validator shared by all the receipts. The app sets it at startup from
+# the configuration, otherwise the fast path validator is used.
+receipt_validator = None
+
+
+def get_receipt_validator():
+    """Get the receipt validator, creating the default one if needed"""
+    global receipt_validator
+    if receipt_validator is None:
+        receipt_validator = Fast_Receipt_Validator()
+    return receipt_validator
+
+
+def set_receipt_validator(name: str):
+    """Select the validator used for the receipts: fast or marshmallow"""
+    global receipt_validator
+    if name not in RECEIPT_VALIDATORS:
+        raise ValueError(f"Unknown receipt validator: {name}")
+    receipt_validator = RECEIPT_VALIDATORS[name]()
 
 
 def has_zero_cents(price_str: str) -> bool:
@@ -0,0 +1,150 @@
+"""
+Receipt Processor API - Retention Policy
+
+Bounds the memory of the receipt pool. The Retention_Policy tracks the
+receipts in the order they were added (fifo) or last read (lru), and a
+background sweeper evicts the oldest ones when the pool holds more than
+`max_receipts`, or when they are older than `max_age` seconds. Tracking a
+receipt is a dictionary insert or move, and the sweeper only pops from the
+head of the order, so the eviction is amortized O(1) per receipt and the
+request threads never wait on it.
+
+Written in Python 3.11.5 and Flask 2.3.3
+"""
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Iterable, List
+from uuid import UUID
+from metrics import RECEIPTS_EVICTED
+from receipts import Pool_Listener, Receipt, Receipt_Pool
+
+
+RETENTION_POLICIES = ("fifo", "lru")
+
+
+class Retention_Policy(Pool_Listener):
+    """
+    Evicts the receipts of a pool over `max_receipts` receipts, or older
+    than `max_age` seconds (0 for no limit). With the "fifo" policy the age
+    of a receipt counts from when it was added, with "lru" from when it was
+    last read, and the least recently read receipts are evicted first.
+    """
+
+    def __init__(self, pool: Receipt_Pool, max_receipts: int = 0,
+                 max_age: float = 0, policy: str = "fifo",
+                 sweep_interval: float = 1.0):
+        if policy not in RETENTION_POLICIES:
+            raise ValueError(f"Unknown retention policy: {policy}")
+        self.pool = pool
+        self.max_receipts = max_receipts
+        self.max_age = max_age
+        self.policy = policy
+        self.sweep_interval = sweep_interval
+        self.tracks_reads = policy == "lru"
+
+        self.lock = threading.Lock()
+        # The ids of the receipts, oldest first, with their monotonic time
+        # of addition (or of last read with lru)
+        self.receipts: Dict[UUID, float] = OrderedDict()
+        # Set to wake up the sweeper before its interval
+        self.wakeup = threading.Event()
+        self.stopped = threading.Event()
+        self.sweeper = None
+
+    # Pool listener
+
+    def receipt_added(self, receipt: Receipt):
+        with self.lock:
+            self.receipts[receipt.id] = time.monotonic()
+            self.receipts.move_to_end(receipt.id)
+            over_limit = (self.max_receipts
+                          and len(self.receipts) > self.max_receipts)
+        if over_limit:
+            self.wakeup.set()
+
+    def receipt_deleted(self, receipt_id: UUID):
+        with self.lock:
+            self.receipts.pop(receipt_id, None)
+
+    def receipt_read(self, receipt_id: UUID):
+        with self.lock:
+            if receipt_id in self.receipts:
+                self.receipts[receipt_id] = time.monotonic()
+                self.receipts.move_to_end(receipt_id)
+
+    def rebuild(self, receipts: Iterable[Receipt]):
+        """Track the receipts already stored, like the persisted ones"""
+        now = time.monotonic()
+        with self.lock:
+            for receipt in receipts:
+                self.receipts.setdefault(receipt.id, now)
+
+    # Sweeper
+
+    def start(self):
+        """Start the background sweeper thread"""
+        if self.sweeper is None:
+            self.sweeper = threading.Thread(
+                target=self.run, name="retention-sweeper", daemon=True)
+            self.sweeper.start()
+
+    def stop(self):
+        """Stop the sweeper thread"""
+        self.stopped.set()
+        self.wakeup.set()
+        if self.sweeper is not None:
+            self.sweeper.join()
+            self.sweeper = None
+
+    def run(self):
+        while not self.stopped.is_set():
+            self.wakeup.wait(self.sweep_interval)
+            self.wakeup.clear()
+            if not self.stopped.is_set():
+                self.sweep()
+
+    def sweep(self, now: float = None) -> int:
+        """
+        Evict the receipts over the limits, oldest first. Return the number
+        of receipts evicted.
+        """
+        if now is None:
+            now = time.monotonic()
+        over_count = self.expired(now, self.max_receipts, 0)
+        over_age = self.expired(now, 0, self.max_age) if self.max_age else []
+
+        # The pool is updated out of the lock: the deletes notify this
+        # listener, which takes it again.
+        evicted = 0
+        for reason, ids in (("max_receipts", over_count),
+                            ("max_age", over_age)):
+            if ids:
+                deleted = self.pool.evict_receipts(ids)
+                RECEIPTS_EVICTED.labels(reason).inc(deleted)
+                evicted += deleted
+        return evicted
+
+    def expired(self, now: float, max_receipts: int,
+                max_age: float) -> List[UUID]:
+        """
+        Remove from the head of the order the receipts over `max_receipts`,
+        or older than `max_age`, and return their ids.
+        """
+        ids = []
+        with self.lock:
+            if max_receipts:
+                while len(self.receipts) > max_receipts:
+                    ids.append(self.receipts.popitem(last=False)[0])
+            if max_age:
+                deadline = now - max_age
+                while self.receipts:
+                    receipt_id, timestamp = next(iter(self.receipts.items()))
+                    if timestamp > deadline:
+                        break
+                    del self.receipts[receipt_id]
+                    ids.append(receipt_id)
+        return ids
+
+    def __len__(self) -> int:
+        return len(self.receipts)
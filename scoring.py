@@ -0,0 +1,128 @@
+"""
+Receipt Processor API - Scoring Pool
+
+Validating and scoring a receipt is pure Python CPU work, so a single
+process is bound by the GIL. The Scoring_Pool sends chunks of receipts to
+warm worker processes: the rules and the validator are loaded once per
+worker, and each receipt comes back as a compact (id bytes, points) tuple,
+or its error message, instead of a pickled Receipt.
+
+Written in Python 3.11.5 and Flask 2.3.3
+"""
+from collections import deque
+from itertools import islice
+from typing import Iterable, Iterator, List, Union
+from marshmallow import ValidationError
+from receipts import (
+    Receipt, get_points_calculator, set_points_calculator,
+    set_receipt_validator
+)
+from points_calculator import (
+    Points_Calculator, description_memo, retailer_memo, set_memo_sizes
+)
+
+
+# Result of scoring a receipt: its (id bytes, points), or its error
+Score = Union[tuple, str]
+
+
+class Scoring_Pool:
+    """
+    Scores receipts in `workers` processes, `chunk_size` receipts per task.
+    With 0 workers the receipts are scored in this process, with the same
+    results.
+    """
+
+    def __init__(self, workers: int, validator: str = "fast",
+                 chunk_size: int = 1000):
+        self.workers = workers
+        self.chunk_size = chunk_size
+        self.executor = None
+        if workers > 0:
+            # Imported here, multiprocessing is only needed with workers
+            from concurrent.futures import ProcessPoolExecutor
+            self.executor = ProcessPoolExecutor(
+                workers, initializer=init_worker,
+                initargs=(get_points_calculator().rules, validator,
+                          retailer_memo.max_size, description_memo.max_size))
+            # Start the workers now, so the first request doesn't pay for
+            # the process startup and the loading of the rules.
+            for future in [self.executor.submit(int)
+                           for _ in range(workers)]:
+                future.result()
+
+    def score(self, payloads: List[dict]) -> List[Score]:
+        """Score a list of receipts, in order"""
+        chunks = chunked(payloads, self.chunk_size)
+        results = []
+        for _, scores in self.score_chunks((None, chunk) for chunk in chunks):
+            results.extend(scores)
+        return results
+
+    def score_chunks(self, chunks: Iterable[tuple]) -> Iterator[tuple]:
+        """
+        Score a stream of (context, receipts) chunks. Yield the (context,
+        scores) of each chunk, in order. At most two chunks per worker are
+        in flight, so the stream is only read as fast as it's scored.
+        """
+        if self.executor is None:
+            for context, payloads in chunks:
+                yield context, score_chunk(payloads)
+            return
+
+        pending = deque()
+        for context, payloads in chunks:
+            pending.append(
+                (context, self.executor.submit(score_chunk, payloads)))
+            if len(pending) >= self.workers * 2:
+                context, future = pending.popleft()
+                yield context, future.result()
+        for context, future in pending:
+            yield context, future.result()
+
+    def close(self):
+        """Stop the worker processes"""
+        if self.executor is not None:
+            self.executor.shutdown(cancel_futures=True)
+            self.executor = None
+
+
+# Worker functions
+
+def init_worker(rules: list, validator: str, retailer_memo_size: int,
+                description_memo_size: int):
+    """
+    Load the points rules and the validator of a worker process, and size
+    its memo caches like the ones of the app
+    """
+    set_points_calculator(Points_Calculator(rules))
+    set_receipt_validator(validator)
+    set_memo_sizes(retailer_memo_size, description_memo_size)
+
+
+def score_chunk(payloads: List[dict]) -> List[Score]:
+    """Validate and score the receipts of a chunk"""
+    results = []
+    for payload in payloads:
+        try:
+            receipt = Receipt(payload)
+            results.append((receipt.id.bytes, receipt.points))
+
+        except ValidationError as error:
+            results.append(str(error))
+
+        except Exception:
+            results.append("An error occurred processing the receipt.")
+    return results
+
+
+# Module helper functions
+
+def chunked(entries: Iterable, size: int) -> Iterator[list]:
+    """Group the entries in lists of up to `size` entries"""
+    entries = iter(entries)
+    while True:
+        chunk = list(islice(entries, size))
+        if not chunk:
+            return
+        yield chunk
@@ -0,0 +1,620 @@
+"""
+Receipt Processor API - Storage Backends
+
+The storage backends of the Receipt_Pool. Every backend offers the same
+interface (add, get, delete and iterate) so the pool can keep the receipts
+in memory or persist them, depending on the configuration.
+
+Written in Python 3.11.5 and Flask 2.3.3
+"""
+import json
+import threading
+import time
+import zlib
+from array import array
+from typing import Dict, Iterable, Iterator
+from uuid import UUID
+
+
+class Storage_Backend:
+    """
+    Interface of the storage backends. The add method only inserts the
+    receipt when its id is not in use, so the pool can detect collisions
+    without a separate lookup.
+    """
+
+    def add(self, receipt) -> bool:
+        """Store the receipt, return False if its id is already in use"""
+        raise NotImplementedError
+
+    def add_many(self, receipts: list) -> list:
+        """
+        Store several receipts, return the ones that were not stored
+        because their id is already in use.
+        """
+        return [receipt for receipt in receipts if not self.add(receipt)]
+
+    def get(self, receipt_id: UUID):
+        """Get a receipt by its id, or None if it's not stored"""
+        raise NotImplementedError
+
+    def get_many(self, receipt_ids: list) -> list:
+        """Get several receipts by id, None for the ones not stored"""
+        return [self.get(receipt_id) for receipt_id in receipt_ids]
+
+    def delete(self, receipt_id: UUID) -> bool:
+        """Delete a receipt, return False if it was not stored"""
+        raise NotImplementedError
+
+    def __iter__(self) -> Iterator:
+        """Iterate over the stored receipts"""
+        raise NotImplementedError
+
+    def __len__(self) -> int:
+        raise NotImplementedError
+
+    def __contains__(self, receipt_id: UUID) -> bool:
+        return self.get(receipt_id) is not None
+
+    def to_dict(self) -> dict:
+        """Get all the receipts in a dictionary by id"""
+        return {receipt.id: receipt for receipt in self}
+
+    def load(self, records: Iterable[tuple], expected: int = 0):
+        """
+        Bulk load stored receipts, as (id bytes, points, JSON payload)
+        records, skipping the ids already in use. `expected` is the number
+        of records, when it's known.
+        """
+        for id_bytes, points, payload in records:
+            data = json.loads(payload) if payload is not None else None
+            self.add(make_receipt(UUID(bytes=id_bytes), points, data))
+
+    def close(self):
+        """
+        Release the resources of the backend. Closing a closed backend does
+        nothing: the pool is closed on shutdown and again at exit.
+        """
+
+
+class Dict_Storage(Storage_Backend):
+    """
+    The in-memory backend: a plain dictionary of Receipt objects by id.
+    It's the fastest backend, but the receipts are lost on a restart.
+    """
+
+    def __init__(self):
+        self.receipts: Dict[UUID, object] = {}
+
+    def add(self, receipt) -> bool:
+        # setdefault checks and inserts in a single step, so two threads
+        # can't store receipts with the same id.
+        return self.receipts.setdefault(receipt.id, receipt) is receipt
+
+    def get(self, receipt_id: UUID):
+        return self.receipts.get(receipt_id, None)
+
+    def delete(self, receipt_id: UUID) -> bool:
+        return self.receipts.pop(receipt_id, None) is not None
+
+    def __iter__(self) -> Iterator:
+        return iter(list(self.receipts.values()))
+
+    def __len__(self) -> int:
+        return len(self.receipts)
+
+    def __contains__(self, receipt_id: UUID) -> bool:
+        return receipt_id in self.receipts
+
+    def to_dict(self) -> dict:
+        return self.receipts
+
+
+class Sharded_Storage(Storage_Backend):
+    """
+    A thread-safe in-memory backend for multi-threaded servers. The
+    receipts are partitioned in shards by the low bits of their id (random
+    bits in a uuid4), and each shard is a dictionary with its own lock, so
+    threads working on different shards don't wait for each other.
+    """
+
+    def __init__(self, shards: int = 16):
+        # The number of shards is rounded up to a power of two, so the
+        # shard of an id is a simple mask of its bits.
+        count = 1
+        while count < shards:
+            count *= 2
+        self.mask = count - 1
+        self.shards = [{} for _ in range(count)]
+        self.locks = [threading.Lock() for _ in range(count)]
+
+    def add(self, receipt) -> bool:
+        shard = receipt.id.int & self.mask
+        receipts = self.shards[shard]
+        with self.locks[shard]:
+            if receipt.id in receipts:
+                return False
+            receipts[receipt.id] = receipt
+            return True
+
+    def add_many(self, receipts: list) -> list:
+        # Group the receipts by shard, so each lock is taken once
+        collisions = []
+        for shard, group in self.group_by_shard(receipts).items():
+            shard_receipts = self.shards[shard]
+            with self.locks[shard]:
+                for receipt in group:
+                    if receipt.id in shard_receipts:
+                        collisions.append(receipt)
+                    else:
+                        shard_receipts[receipt.id] = receipt
+        return collisions
+
+    def get(self, receipt_id: UUID):
+        # A single dictionary lookup is atomic, it doesn't need the lock
+        return self.shards[receipt_id.int & self.mask].get(receipt_id, None)
+
+    def get_many(self, receipt_ids: list) -> list:
+        shards = self.shards
+        mask = self.mask
+        return [
+            shards[receipt_id.int & mask].get(receipt_id, None)
+            for receipt_id in receipt_ids
+        ]
+
+    def delete(self, receipt_id: UUID) -> bool:
+        shard = receipt_id.int & self.mask
+        with self.locks[shard]:
+            return self.shards[shard].pop(receipt_id, None) is not None
+
+    def group_by_shard(self, receipts: list) -> Dict[int, list]:
+        """Group receipts by the shard of their id"""
+        groups: Dict[int, list] = {}
+        mask = self.mask
+        for receipt in receipts:
+            groups.setdefault(receipt.id.int & mask, []).append(receipt)
+        return groups
+
+    def __iter__(self) -> Iterator:
+        for shard, receipts in enumerate(self.shards):
+            with self.locks[shard]:
+                values = list(receipts.values())
+            yield from values
+
+    def __len__(self) -> int:
+        return sum(len(receipts) for receipts in self.shards)
+
+    def __contains__(self, receipt_id: UUID) -> bool:
+        return receipt_id in self.shards[receipt_id.int & self.mask]
+
+
+class SQLite_Storage(Storage_Backend):
+    """
+    A persistent backend on a SQLite database, so the receipts survive
+    restarts and the pool can hold more receipts than fit in memory.
+
+    The database runs in WAL mode and the receipts table is clustered on
+    the receipt id (a WITHOUT ROWID table), which is the index used by
+    every lookup. Writes are committed in batches: every `commit_every`
+    writes, when the last commit is older than `commit_interval` seconds,
+    or when the backend is flushed or closed. A background thread commits
+    the writes left pending when no other write comes.
+    """
+
+    # The operations wait on the database, the ASGI application runs them
+    # in a thread instead of the event loop.
+    blocking = True
+
+    # SQL statements. They are constants, so the sqlite3 module prepares
+    # each one once and reuses it from its statement cache.
+    CREATE_TABLE = (
+        "CREATE TABLE IF NOT EXISTS receipts ("
+        "id BLOB PRIMARY KEY, points INTEGER NOT NULL, data TEXT"
+        ") WITHOUT ROWID"
+    )
+    INSERT = (
+        "INSERT OR IGNORE INTO receipts (id, points, data) VALUES (?, ?, ?)"
+    )
+    SELECT = "SELECT id, points, data FROM receipts WHERE id = ?"
+    DELETE = "DELETE FROM receipts WHERE id = ?"
+    COUNT = "SELECT COUNT(*) FROM receipts"
+    PAGE = (
+        "SELECT id, points, data FROM receipts WHERE id > ? "
+        "ORDER BY id LIMIT ?"
+    )
+
+    def __init__(self, path: str, commit_every: int = 100,
+                 commit_interval: float = 1.0, timeout: float = 5.0):
+        self.path = path
+        self.commit_every = max(1, commit_every)
+        self.commit_interval = commit_interval
+        self.pending_writes = 0
+        self.last_commit = time.monotonic()
+        self.lock = threading.Lock()
+
+        # Imported here, so the apps with the other backends don't pay for
+        # the import at startup
+        import sqlite3
+        self.connection = sqlite3.connect(
+            path, timeout=timeout, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute(self.CREATE_TABLE)
+        self.connection.commit()
+
+        self.closed = False
+        self.closing = threading.Event()
+        self.flush_thread = None
+        if commit_interval > 0:
+            self.flush_thread = threading.Thread(
+                target=self.flush_loop, name="sqlite-flush", daemon=True)
+            self.flush_thread.start()
+
+    def add(self, receipt) -> bool:
+        with self.lock:
+            cursor = self.connection.execute(self.INSERT, to_row(receipt))
+            self.written(cursor.rowcount)
+            return cursor.rowcount == 1
+
+    def add_many(self, receipts: list) -> list:
+        # A single transaction for the whole group of receipts
+        collisions = []
+        with self.lock:
+            for receipt in receipts:
+                cursor = self.connection.execute(self.INSERT, to_row(receipt))
+                if cursor.rowcount != 1:
+                    collisions.append(receipt)
+            self.written(len(receipts) - len(collisions))
+        return collisions
+
+    def get(self, receipt_id: UUID):
+        with self.lock:
+            row = self.connection.execute(
+                self.SELECT, (receipt_id.bytes,)).fetchone()
+        return from_row(row) if row else None
+
+    def delete(self, receipt_id: UUID) -> bool:
+        with self.lock:
+            cursor = self.connection.execute(
+                self.DELETE, (receipt_id.bytes,))
+            self.written(cursor.rowcount)
+            return cursor.rowcount == 1
+
+    def __iter__(self) -> Iterator:
+        # Iterate page by page over the id index, so the memory used and
+        # the time the lock is held stay bounded.
+        last_id = b""
+        while True:
+            with self.lock:
+                rows = self.connection.execute(
+                    self.PAGE, (last_id, 500)).fetchall()
+            if not rows:
+                return
+            for row in rows:
+                yield from_row(row)
+            last_id = rows[-1][0]
+
+    def __len__(self) -> int:
+        with self.lock:
+            return self.connection.execute(self.COUNT).fetchone()[0]
+
+    def __contains__(self, receipt_id: UUID) -> bool:
+        with self.lock:
+            return self.connection.execute(
+                self.SELECT, (receipt_id.bytes,)).fetchone() is not None
+
+    def written(self, count: int):
+        """Count the pending writes and commit them if the batch is due"""
+        self.pending_writes += count
+        if self.pending_writes >= self.commit_every or (
+                time.monotonic() - self.last_commit >= self.commit_interval):
+            self.commit()
+
+    def commit(self):
+        self.connection.commit()
+        self.pending_writes = 0
+        self.last_commit = time.monotonic()
+
+    def flush(self):
+        """Commit the pending writes"""
+        with self.lock:
+            self.commit()
+
+    def flush_loop(self):
+        """
+        Commit the pending writes once they are `commit_interval` seconds
+        old, so the last writes of a burst don't wait for the next write
+        (and the write lock of the database is released).
+        """
+        while not self.closing.wait(self.commit_interval):
+            with self.lock:
+                if self.pending_writes and (
+                        time.monotonic() - self.last_commit
+                        >= self.commit_interval):
+                    self.commit()
+
+    def close(self):
+        """Commit the pending writes and close the database, once"""
+        with self.lock:
+            if self.closed:
+                return
+            self.closed = True
+        self.closing.set()
+        if self.flush_thread is not None:
+            self.flush_thread.join()
+        with self.lock:
+            self.commit()
+            self.connection.close()
+
+
+class Compact_Storage(Storage_Backend):
+    """
+    A compact in-memory backend. Instead of a Receipt object per receipt,
+    it keeps packed columns: the 16 bytes of each id in a bytearray and
+    the points in an array of 64-bit integers, indexed by an open
+    addressing hash table of slot numbers. The raw payloads are only kept
+    when `store_payload` is set, compressed with zlib. The points that
+    don't fit in 64 bits (the amounts of the receipts have no limit) are
+    kept in a side dictionary, with a marker in the array.
+
+    A receipt takes about 40 bytes this way, against the hundreds of bytes
+    of a Receipt object with its UUID, its dictionary and its payload.
+    """
+
+    # Markers of the hash table entries that don't point to a slot
+    EMPTY = -1
+    DELETED = -2
+    # Marker of the points kept in the large_points dictionary, the points
+    # are never negative
+    LARGE_POINTS = -2 ** 63
+
+    def __init__(self, store_payload: bool = False, capacity: int = 1024):
+        self.store_payload = store_payload
+        self.lock = threading.Lock()
+
+        # Columns, indexed by slot
+        self.ids = bytearray()
+        self.points = array("q")
+        self.large_points: Dict[int, int] = {}
+        self.payloads: Dict[int, bytes] = {}
+        # Slots of the deleted receipts, reused by the next additions
+        self.free_slots = array("q")
+
+        # Hash table of slots, its size is always a power of two
+        size = 8
+        while size < capacity * 2:
+            size *= 2
+        self.table = array("q", [self.EMPTY]) * size
+        self.count = 0
+        self.deleted = 0
+
+    def find(self, id_bytes: bytes, hash_value: int) -> tuple:
+        """
+        Find an id in the hash table. Return the table position and slot
+        of the id, or the position where it can be inserted and -1.
+        """
+        table = self.table
+        ids = self.ids
+        mask = len(table) - 1
+        position = hash_value & mask
+        insert_position = -1
+        while True:
+            slot = table[position]
+            if slot == self.EMPTY:
+                if insert_position < 0:
+                    insert_position = position
+                return insert_position, -1
+            if slot == self.DELETED:
+                if insert_position < 0:
+                    insert_position = position
+            elif ids[slot * 16:slot * 16 + 16] == id_bytes:
+                return position, slot
+            position = (position + 1) & mask
+
+    def add(self, receipt) -> bool:
+        payload = None
+        if self.store_payload and receipt.data is not None:
+            payload = json.dumps(receipt.data, separators=(",", ":")).encode()
+        with self.lock:
+            return self.insert(
+                receipt.id.bytes, receipt.id.int, receipt.points, payload)
+
+    def load(self, records: Iterable[tuple], expected: int = 0):
+        # The records are inserted as they are, without building UUID and
+        # Receipt objects or decoding the payloads, in a hash table sized
+        # for all of them.
+        with self.lock:
+            if (self.count + expected) * 3 > len(self.table) * 2:
+                self.resize(self.count + expected)
+            for id_bytes, points, payload in records:
+                self.insert(
+                    id_bytes, int.from_bytes(id_bytes, "big"), points,
+                    payload if self.store_payload else None)
+
+    def insert(self, id_bytes: bytes, hash_value: int, points: int,
+               payload: bytes = None) -> bool:
+        """Insert a receipt with the lock held, False if its id is in use"""
+        position, slot = self.find(id_bytes, hash_value)
+        if slot >= 0:
+            return False
+
+        stored_points = points
+        if not self.LARGE_POINTS < points < 2 ** 63:
+            stored_points = self.LARGE_POINTS
+        if self.free_slots:
+            slot = self.free_slots.pop()
+            self.ids[slot * 16:slot * 16 + 16] = id_bytes
+            self.points[slot] = stored_points
+        else:
+            slot = len(self.points)
+            self.ids += id_bytes
+            self.points.append(stored_points)
+        if stored_points == self.LARGE_POINTS:
+            self.large_points[slot] = points
+
+        if payload is not None:
+            self.payloads[slot] = zlib.compress(payload)
+
+        if self.table[position] == self.DELETED:
+            self.deleted -= 1
+        self.table[position] = slot
+        self.count += 1
+
+        # Keep the hash table at most 2/3 full, counting deletions
+        if (self.count + self.deleted) * 3 > len(self.table) * 2:
+            self.resize()
+        return True
+
+    def get(self, receipt_id: UUID):
+        with self.lock:
+            _, slot = self.find(receipt_id.bytes, receipt_id.int)
+            if slot < 0:
+                return None
+            points = self.get_points(slot)
+            payload = self.payloads.get(slot)
+
+        data = json.loads(zlib.decompress(payload)) if payload else None
+        return make_receipt(receipt_id, points, data)
+
+    def get_points(self, slot: int) -> int:
+        """Get the points of a slot, with the lock held"""
+        points = self.points[slot]
+        if points == self.LARGE_POINTS:
+            return self.large_points[slot]
+        return points
+
+    def delete(self, receipt_id: UUID) -> bool:
+        with self.lock:
+            position, slot = self.find(receipt_id.bytes, receipt_id.int)
+            if slot < 0:
+                return False
+
+            self.table[position] = self.DELETED
+            self.ids[slot * 16:slot * 16 + 16] = bytes(16)
+            self.payloads.pop(slot, None)
+            self.large_points.pop(slot, None)
+            self.free_slots.append(slot)
+            self.count -= 1
+            self.deleted += 1
+            return True
+
+    def resize(self, expected: int = 0):
+        """
+        Rebuild the hash table with room for the live receipts, or for the
+        `expected` receipts if there will be more.
+        """
+        size = len(self.table)
+        while max(self.count, expected) * 3 > size:
+            size *= 2
+
+        table = array("q", [self.EMPTY]) * size
+        mask = size - 1
+        free_slots = set(self.free_slots)
+        for slot in range(len(self.points)):
+            if slot in free_slots:
+                continue
+            position = int.from_bytes(
+                self.ids[slot * 16:slot * 16 + 16], "big") & mask
+            while table[position] != self.EMPTY:
+                position = (position + 1) & mask
+            table[position] = slot
+
+        self.table = table
+        self.deleted = 0
+
+    def __iter__(self) -> Iterator:
+        with self.lock:
+            slots = len(self.points)
+            free_slots = set(self.free_slots)
+        for slot in range(slots):
+            if slot in free_slots:
+                continue
+            with self.lock:
+                id_bytes = bytes(self.ids[slot * 16:slot * 16 + 16])
+                points = self.get_points(slot)
+                payload = self.payloads.get(slot)
+            if id_bytes == bytes(16):
+                # Deleted while iterating
+                continue
+            data = json.loads(zlib.decompress(payload)) if payload else None
+            yield make_receipt(UUID(bytes=id_bytes), points, data)
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __contains__(self, receipt_id: UUID) -> bool:
+        with self.lock:
+            return self.find(receipt_id.bytes, receipt_id.int)[1] >= 0
+
+
+# Module helper functions
+
+def to_row(receipt) -> tuple:
+    """
+    Get the database row of a receipt. The points that don't fit in the 64
+    bits of a SQLite integer are stored as a blob of their decimal digits
+    (a text would be converted to a lossy real by the INTEGER column).
+    """
+    data = json.dumps(receipt.data) if receipt.data is not None else None
+    points = receipt.points
+    if not -2 ** 63 <= points < 2 ** 63:
+        points = str(points).encode()
+    return receipt.id.bytes, points, data
+
+
+def from_row(row: tuple):
+    """Rebuild a receipt from its database row"""
+    receipt_id, points, data = row
+    if isinstance(points, bytes):
+        points = int(points)
+    return make_receipt(
+        UUID(bytes=receipt_id), points,
+        json.loads(data) if data is not None else None
+    )
+
+
+def make_receipt(receipt_id: UUID, points: int, data: dict):
+    """Rebuild a stored receipt"""
+    # Imported here to avoid a circular import with the receipts module
+    from receipts import Receipt
+    return Receipt.from_stored(receipt_id, points, data)
+
+
+def create_storage(config) -> Storage_Backend:
+    """
+    Create the storage backend selected in the configuration, behind a
+    journal when JOURNAL_DIR is set.
+    """
+    if config.get("JOURNAL_DIR"):
+        # Imported here to avoid a circular import with the journal module
+        from journal import Journaled_Storage
+        if config.get("RECEIPT_STORAGE", "memory") == "sqlite":
+            raise ValueError("The journal is only for the in-memory "
+                             "storage backends, SQLite persists itself.")
+        return Journaled_Storage(
+            create_backend(config), config["JOURNAL_DIR"],
+            sync=config.get("JOURNAL_SYNC", "group"),
+            sync_interval=float(config.get("JOURNAL_SYNC_INTERVAL", 1.0)),
+            snapshot_every=int(
+                config.get("JOURNAL_SNAPSHOT_EVERY", 1000000))
+        )
+    return create_backend(config)
+
+
+def create_backend(config) -> Storage_Backend:
+    """Create the storage backend of the receipts"""
+    backend = config.get("RECEIPT_STORAGE", "memory")
+    if backend == "memory":
+        return Dict_Storage()
+    if backend == "sharded":
+        return Sharded_Storage(int(config.get("RECEIPT_SHARDS", 16)))
+    if backend == "compact":
+        return Compact_Storage(
+            store_payload=bool(config.get("COMPACT_STORE_PAYLOAD", False)))
+    if backend == "sqlite":
+        return SQLite_Storage(
+            config.get("SQLITE_PATH", "receipts.db"),
+            commit_every=int(config.get("SQLITE_COMMIT_EVERY", 100)),
+            commit_interval=float(config.get("SQLITE_COMMIT_INTERVAL", 1.0))
+        )
+    raise ValueError(f"Unknown receipt storage backend: {backend}")
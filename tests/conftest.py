@@ -1,7 +1,13 @@
 import pytest
-from app import app as flask_app
+import app as app_module
+from config import Config
 from receipts import Receipt, Receipt_Pool
 
+# The apps of the tests write no log file, instead of the log of the
+# repository. Set before the default app is created, on its first use.
+Config.LOG_FILE = ""
+flask_app = app_module.app
+
 
 @pytest.fixture
 def app():
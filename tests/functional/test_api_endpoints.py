@@ -1,6 +1,7 @@
 import json
 from receipts import Receipt
 from app import receipt_pool
+from uuid import UUID
 
 
 def test_process_valid_receipts(app, sample_receipt_data):
@@ -49,3 +50,316 @@ def test_get_receipts_valid_id(
         assert response.status_code == 200
         response_data = json.loads(response.data)
         assert response_data["points"] == points
+
+
+def test_process_batch_json_array(
+        app,
+        sample_receipt_data,
+        invalid_receipt_data):
+    """Test processing a batch with valid and invalid receipts."""
+    batch = sample_receipt_data + invalid_receipt_data
+    response = app.post('/receipts/process/batch', json=batch)
+    assert response.status_code == 200
+    response_data = json.loads(response.data)
+
+    # One id per entry, None for the invalid ones
+    assert len(response_data["ids"]) == len(batch)
+    valid_ids = response_data["ids"][:len(sample_receipt_data)]
+    assert all(valid_ids)
+    assert not any(response_data["ids"][len(sample_receipt_data):])
+
+    # One error per invalid entry, pointing to its position in the batch
+    error_indexes = [error["index"] for error in response_data["errors"]]
+    assert error_indexes == list(
+        range(len(sample_receipt_data), len(batch)))
+
+    # The valid receipts are retrievable with their points
+    for receipt_id, points in zip(valid_ids, ["12", "109", "28"]):
+        response = app.get(f'/receipts/{receipt_id}/points')
+        assert response.status_code == 200
+        assert json.loads(response.data)["points"] == points
+
+
+def test_process_batch_ndjson(app, sample_receipt_data):
+    """Test processing a batch sent as NDJSON with a malformed line."""
+    lines = [json.dumps(data) for data in sample_receipt_data]
+    lines.insert(1, "{not valid json")
+    response = app.post(
+        '/receipts/process/batch',
+        data="\n".join(lines),
+        content_type='application/x-ndjson'
+    )
+    assert response.status_code == 200
+    response_data = json.loads(response.data)
+    assert len(response_data["ids"]) == len(lines)
+    assert response_data["ids"][1] is None
+    assert [error["index"] for error in response_data["errors"]] == [1]
+
+
+def test_process_batch_in_workers(
+        app,
+        sample_receipt_data,
+        invalid_receipt_data,
+        monkeypatch):
+    """Test that a batch scored in worker processes gets the same results."""
+    from app import app as flask_app, get_state
+    from scoring import Scoring_Pool
+
+    batch = sample_receipt_data + invalid_receipt_data
+    expected = json.loads(app.post('/receipts/process/batch', json=batch).data)
+
+    scoring_pool = Scoring_Pool(2, chunk_size=2)
+    monkeypatch.setattr(get_state(flask_app), "scoring_pool", scoring_pool)
+    monkeypatch.setitem(flask_app.config, "SCORING_MIN_BATCH", 1)
+    try:
+        response = app.post('/receipts/process/batch', json=batch)
+    finally:
+        scoring_pool.close()
+    response_data = json.loads(response.data)
+
+    assert response_data["errors"] == expected["errors"]
+    valid_ids = response_data["ids"][:len(sample_receipt_data)]
+    for receipt_id, points in zip(valid_ids, ["12", "109", "28"]):
+        response = app.get(f'/receipts/{receipt_id}/points')
+        assert json.loads(response.data)["points"] == points
+
+
+def test_process_batch_invalid_payload(app, sample_receipt_data):
+    """Test that a batch that is not a JSON array is rejected."""
+    response = app.post('/receipts/process/batch', json=sample_receipt_data[0])
+    assert response.status_code == 400
+    assert "error" in json.loads(response.data)
+
+
+def test_metrics_endpoint(app, sample_receipt_data, invalid_receipt_data):
+    """Test the metrics of the processing stages and the errors."""
+    app.post('/receipts/process', json=sample_receipt_data[0])
+    app.post('/receipts/process', json=invalid_receipt_data[0])
+    app.get('/receipts/adb6b560-0eef-42bc-9d16-df48f30e89b2/points')
+
+    response = app.get('/metrics')
+    assert response.status_code == 200
+    assert response.content_type.startswith("text/plain")
+    text = response.get_data(as_text=True)
+    for stage in ("parse_json", "validate_receipt", "calculate_points",
+                  "add_receipt"):
+        assert f'receipt_stage_seconds_count{{stage="{stage}"}}' in text
+    for name in ("receipt_pool_size", "receipt_validation_error_ratio",
+                 "points_not_found_ratio", "receipts_processed_total",
+                 "points_not_found_total"):
+        assert f"\n{name} " in text
+    assert 'endpoint="process_receipt",status="400"' in text
+
+
+def test_idempotent_resubmission(sample_receipt_data):
+    """Test that resubmitted receipts get the id they already have."""
+    from app import create_app, get_state
+    idempotent_app = create_app({"IDEMPOTENCY_ENABLED": True})
+    receipt_pool = get_state(idempotent_app).receipt_pool
+    app = idempotent_app.test_client()
+
+    first = json.loads(app.post(
+        '/receipts/process', json=sample_receipt_data[0]).data)
+    response = app.post('/receipts/process', json=sample_receipt_data[0])
+    assert response.headers.get("Idempotent-Replayed") == "true"
+    assert json.loads(response.data)["id"] == first["id"]
+
+    # With an Idempotency-Key, the key identifies the receipt
+    headers = {"Idempotency-Key": "client-retry-1"}
+    keyed = json.loads(app.post(
+        '/receipts/process', json=sample_receipt_data[1],
+        headers=headers).data)
+    assert keyed["id"] != first["id"]
+    response = app.post(
+        '/receipts/process', json=sample_receipt_data[1], headers=headers)
+    assert json.loads(response.data)["id"] == keyed["id"]
+    response = app.post(
+        '/receipts/process', json=sample_receipt_data[2], headers=headers)
+    assert response.status_code == 422
+
+    # A deleted receipt is processed again, with a new id
+    receipt_pool.delete_receipt(UUID(first["id"]))
+    response = app.post('/receipts/process', json=sample_receipt_data[0])
+    assert "Idempotent-Replayed" not in response.headers
+    assert json.loads(response.data)["id"] != first["id"]
+
+
+def test_points_cache(app, sample_receipt_data):
+    """Test the cached points responses, their ETag and invalidation."""
+    from app import points_cache
+    receipt_id = json.loads(app.post(
+        '/receipts/process', json=sample_receipt_data[0]).data)["id"]
+
+    first = app.get(f'/receipts/{receipt_id}/points')
+    assert points_cache.get(receipt_id) is not None
+    cached = app.get(f'/receipts/{receipt_id}/points')
+    assert json.loads(cached.data) == json.loads(first.data) == {
+        "points": "12"}
+    etag = cached.headers["ETag"]
+    assert etag == first.headers["ETag"]
+    assert cached.headers["Cache-Control"] == "no-cache"
+
+    # Revalidation with the ETag
+    response = app.get(
+        f'/receipts/{receipt_id}/points', headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.data == b""
+
+    # Deleting the receipt drops its cached response
+    receipt_pool.delete_receipt(UUID(receipt_id))
+    assert points_cache.get(receipt_id) is None
+    response = app.get(f'/receipts/{receipt_id}/points')
+    assert response.status_code == 404
+
+
+def test_query_receipts(app, sample_receipt_data):
+    """Test the receipt queries and the points statistics."""
+    receipt = dict(sample_receipt_data[1], retailer="Query Test Market",
+                   purchaseDate="1999-12-31")
+    receipt_id = json.loads(
+        app.post('/receipts/process', json=receipt).data)["id"]
+    points = int(json.loads(
+        app.get(f'/receipts/{receipt_id}/points').data)["points"])
+
+    response = app.get('/receipts?retailer=query test market'
+                       '&from=1999-01-01&to=1999-12-31')
+    assert response.status_code == 200
+    assert json.loads(response.data) == {
+        "count": 1,
+        "receipts": [{
+            "id": receipt_id,
+            "retailer": "Query Test Market",
+            "purchaseDate": "1999-12-31",
+            "points": points
+        }]
+    }
+
+    stats = json.loads(app.get('/stats/points?group_by=retailer').data)
+    assert stats["count"] == len(receipt_pool)
+    assert stats["groups"]["Query Test Market"]["total"] == points
+
+    for query in ('from=1999-1-1', 'limit=0', 'min_points=x'):
+        assert app.get(f'/receipts?{query}').status_code == 400
+    assert app.get('/stats/points?group_by=items').status_code == 400
+
+
+def test_create_app(sample_receipt_data):
+    """Test that each app created by the factory has its own receipts."""
+    from app import create_app, get_state
+    first = create_app({"INDEXES_ENABLED": False})
+    second = create_app()
+
+    response = first.test_client().post(
+        '/receipts/process', json=sample_receipt_data[0])
+    assert response.status_code == 200
+    assert len(get_state(first).receipt_pool) == 1
+    assert len(get_state(second).receipt_pool) == 0
+
+    assert first.test_client().get('/receipts').status_code == 501
+    assert second.test_client().get('/receipts').status_code == 200
+
+    # The gauges of each app read its own state, whichever app is the last
+    for flask_app, size in ((first, 1), (second, 0)):
+        text = flask_app.test_client().get('/metrics').get_data(as_text=True)
+        assert f'receipt_pool_size {size}\n' in text
+
+
+def test_deferred_scoring(sample_receipt_data):
+    """Test the deferred mode, with a receipt that fails its scoring."""
+    from app import create_app, get_state
+    deferred_app = create_app({"SCORING_MODE": "deferred"})
+    app = deferred_app.test_client()
+
+    receipt_id = json.loads(app.post(
+        '/receipts/process', json=sample_receipt_data[1]).data)["id"]
+    response = app.get(f'/receipts/{receipt_id}/points')
+    assert json.loads(response.data)["points"] == "109"
+
+    # Only the structure is checked on submit
+    response = app.post('/receipts/process', json={"retailer": "Target"})
+    assert response.status_code == 400
+    invalid = dict(sample_receipt_data[0], total="6.4")
+    receipt_id = json.loads(app.post(
+        '/receipts/process', json=invalid).data)["id"]
+    response = app.get(f'/receipts/{receipt_id}/points')
+    assert response.status_code == 422
+    assert "total" in json.loads(response.data)["error"]
+
+    get_state(deferred_app).deferred_scorer.stop()
+
+
+def test_slow_requests_and_profiles(tmp_path, sample_receipt_data):
+    """Test the slow request recorder and the profiled requests."""
+    from app import create_app
+    admin_app = create_app({
+        "ADMIN_TOKEN": "secret", "PROFILE_DIR": str(tmp_path),
+        "SLOW_REQUESTS_SIZE": 2})
+    app = admin_app.test_client()
+
+    for data in sample_receipt_data:
+        app.post('/receipts/process', json=data)
+    # The admin request is only recorded once it's done
+    response = app.get('/admin/slow-requests',
+                       headers={'X-Admin-Token': 'secret'})
+    requests = json.loads(response.data)["requests"]
+    assert len(requests) == 2
+    assert requests[0]["duration_ms"] >= requests[1]["duration_ms"]
+    assert requests[0]["path"] == "/receipts/process"
+    assert requests[0]["status"] == 200
+    assert {"parse_json", "validate_receipt", "calculate_points",
+            "add_receipt"} <= set(requests[0]["stages_ms"])
+
+    assert app.get('/admin/slow-requests').status_code == 403
+    response = app.delete('/admin/slow-requests',
+                          headers={'X-Admin-Token': 'secret'})
+    assert response.status_code == 204
+
+    # A profiled request, and a request with a wrong token that isn't
+    response = app.post('/receipts/process', json=sample_receipt_data[0],
+                        headers={'X-Profile': 'secret'})
+    assert (tmp_path / response.headers['Profile-File']).exists()
+    response = app.post('/receipts/process', json=sample_receipt_data[0],
+                        headers={'X-Profile': 'wrong'})
+    assert 'Profile-File' not in response.headers
+    assert len(list(tmp_path.iterdir())) == 1
+
+    # Without an admin token there is no admin endpoint
+    app = create_app().test_client()
+    assert app.get('/admin/slow-requests').status_code == 404
+
+
+def test_admission_control(sample_receipt_data):
+    """Test the shed requests and the limit of the request bodies."""
+    from app import create_app, get_state
+    limited_app = create_app({
+        "MAX_IN_FLIGHT": 2, "ADMISSION_RESERVED": 1,
+        "ADMISSION_RETRY_AFTER": 3, "MAX_CONTENT_LENGTH": 1024})
+    app = limited_app.test_client()
+    admission = get_state(limited_app).admission
+
+    receipt_id = json.loads(app.post(
+        '/receipts/process', json=sample_receipt_data[0]).data)["id"]
+    assert len(admission) == 0
+
+    # A request in flight: the writes are over their share, not the reads
+    admission.acquire()
+    response = app.post('/receipts/process', json=sample_receipt_data[0])
+    assert response.status_code == 429
+    assert response.headers['Retry-After'] == '3'
+    assert app.get(f'/receipts/{receipt_id}/points').status_code == 200
+
+    # Full: the reads are shed too, but not the metrics
+    admission.acquire(priority=True)
+    response = app.get(f'/receipts/{receipt_id}/points')
+    assert response.status_code == 503
+    assert 'Retry-After' in response.headers
+    assert app.get('/metrics').status_code == 200
+    admission.release()
+    admission.release()
+
+    # A body over MAX_CONTENT_LENGTH
+    batch = [sample_receipt_data[1]] * 10
+    response = app.post('/receipts/process/batch', json=batch)
+    assert response.status_code == 413
+    assert "too large" in json.loads(response.data)["error"]
+    assert len(admission) == 0
@@ -0,0 +1,223 @@
+import asyncio
+import json
+import sys
+import pytest
+from asgi import application
+from metrics import REQUEST_SECONDS, REQUESTS
+
+
+def send_request(method, path, body=b"", headers=()):
+    """Send a request to the ASGI application and return the messages."""
+    messages = [{"type": "http.request", "body": body, "more_body": False}]
+    sent = []
+
+    async def receive():
+        return messages.pop(0)
+
+    async def send(message):
+        sent.append(message)
+
+    scope = {"type": "http", "method": method, "path": path,
+             "headers": list(headers)}
+    asyncio.run(application(scope, receive, send))
+    return sent
+
+
+def call(method, path, body=b""):
+    """Send a request to the ASGI application and return the response."""
+    sent = send_request(method, path, body)
+    status = sent[0]["status"]
+    return status, json.loads(sent[1]["body"])
+
+
+def test_asgi_process_and_get_points(sample_receipt_data):
+    """Test processing receipts and getting their points."""
+    for data, points in zip(sample_receipt_data, ["12", "109", "28"]):
+        status, response = call(
+            "POST", "/receipts/process", json.dumps(data).encode())
+        assert status == 200
+
+        status, response = call("GET", f"/receipts/{response['id']}/points")
+        assert status == 200
+        assert response["points"] == points
+
+
+def test_asgi_invalid_requests(invalid_receipt_data, invalid_receipt_ids):
+    """Test the errors of the ASGI application."""
+    for data in invalid_receipt_data:
+        status, response = call(
+            "POST", "/receipts/process", json.dumps(data).encode())
+        assert status == 400
+        assert "error" in response
+
+    status, _ = call("POST", "/receipts/process", b"{not json")
+    assert status == 400
+
+    for invalid_id in invalid_receipt_ids:
+        status, _ = call("GET", f"/receipts/{invalid_id}/points")
+        assert status in (400, 404)
+
+    status, _ = call("GET", "/receipts/process")
+    assert status == 405
+    status, _ = call("POST", "/receipts/process/unknown")
+    assert status == 404
+    status, _ = call("GET", "/unknown")
+    assert status == 404
+
+
+def test_asgi_metrics():
+    """Test the metrics endpoint of the ASGI application."""
+    messages = [{"type": "http.request", "body": b""}]
+    sent = []
+
+    async def receive():
+        return messages.pop(0)
+
+    async def send(message):
+        sent.append(message)
+
+    # The requests are counted and timed by endpoint and status
+    errors = REQUESTS.labels("process_receipt", "400")
+    timings = REQUEST_SECONDS.labels("process_receipt")
+    before = errors.value, timings.count
+    status, _ = call("POST", "/receipts/process", b"{not json")
+    assert status == 400
+    assert (errors.value, timings.count) == (before[0] + 1, before[1] + 1)
+
+    scope = {"type": "http", "method": "GET", "path": "/metrics"}
+    asyncio.run(application(scope, receive, send))
+    assert sent[0]["status"] == 200
+    assert b"receipt_stage_seconds" in sent[1]["body"]
+    assert b'endpoint="process_receipt",status="400"' in sent[1]["body"]
+
+
+def test_asgi_points_etag(sample_receipt_data):
+    """Test the ETag revalidation of the points of the ASGI application."""
+    body = json.dumps(sample_receipt_data[0]).encode()
+    _, response = call("POST", "/receipts/process", body)
+    path = f"/receipts/{response['id']}/points"
+
+    def get(if_none_match):
+        sent = []
+
+        async def receive():
+            return {"type": "http.request", "body": b""}
+
+        async def send(message):
+            sent.append(message)
+
+        scope = {"type": "http", "method": "GET", "path": path,
+                 "headers": [(b"if-none-match", if_none_match)]}
+        asyncio.run(application(scope, receive, send))
+        return sent[0]["status"], dict(sent[0]["headers"])
+
+    status, headers = get(b"")
+    assert status == 200
+    status, _ = get(headers[b"etag"])
+    assert status == 304
+
+
+def test_asgi_slow_requests(sample_receipt_data):
+    """Test that the ASGI requests are traced for the slow requests."""
+    from app import app, get_state
+    slow_requests = get_state(app).slow_requests
+    slow_requests.clear()
+    call("POST", "/receipts/process",
+         json.dumps(sample_receipt_data[0]).encode())
+
+    request = slow_requests.slowest()[0]
+    assert request["path"] == "/receipts/process"
+    assert request["status"] == 200
+    assert "calculate_points" in request["stages_ms"]
+
+
+def test_asgi_admission_control(monkeypatch, sample_receipt_data):
+    """Test the shed requests and the body limit of the ASGI application."""
+    from app import app, get_state
+    admission = get_state(app).admission
+    for _ in range(admission.max_regular):
+        admission.acquire()
+    try:
+        status, response = call(
+            "POST", "/receipts/process",
+            json.dumps(sample_receipt_data[0]).encode())
+        assert status == 429
+        status, _ = call("GET", "/receipts/unknown/points")
+        assert status == 400
+    finally:
+        for _ in range(admission.max_regular):
+            admission.release()
+
+    monkeypatch.setitem(app.config, "MAX_CONTENT_LENGTH", 100)
+    status, _ = call("POST", "/receipts/process",
+                     json.dumps(sample_receipt_data[0]).encode())
+    assert status == 413
+
+
+def test_asgi_idempotency(monkeypatch, sample_receipt_data):
+    """Test that a resubmitted receipt gets its first id."""
+    from app import app, get_state
+    from idempotency import Idempotency_Cache
+
+    monkeypatch.setattr(
+        get_state(app), "idempotency_cache", Idempotency_Cache())
+    body = json.dumps(sample_receipt_data[1]).encode()
+    first = send_request("POST", "/receipts/process", body)
+    second = send_request("POST", "/receipts/process", body)
+    assert second[0]["status"] == 200
+    assert json.loads(second[1]["body"]) == json.loads(first[1]["body"])
+    assert (b"idempotent-replayed", b"true") in second[0]["headers"]
+
+    # An Idempotency-Key reused with another receipt is rejected
+    key = [(b"idempotency-key", b"retry-1")]
+    sent = send_request("POST", "/receipts/process", body, key)
+    assert sent[0]["status"] == 200
+    other = json.dumps(sample_receipt_data[0]).encode()
+    sent = send_request("POST", "/receipts/process", other, key)
+    assert sent[0]["status"] == 422
+
+
+def test_asgi_shutdown_scores_deferred_receipts(
+        monkeypatch, tmp_path, sample_receipt_data):
+    """Test that the shutdown scores the queued receipts before closing."""
+    import app as app_module
+    from app import create_app, get_state
+    from asgi import lifespan
+    from storage import SQLite_Storage
+
+    path = str(tmp_path / "receipts.db")
+    deferred_app = create_app({
+        "SCORING_MODE": "deferred", "RECEIPT_STORAGE": "sqlite",
+        "SQLITE_PATH": path})
+    monkeypatch.setattr(app_module, "app", deferred_app)
+    scorer = get_state(deferred_app).deferred_scorer
+    for data in sample_receipt_data * 50:
+        scorer.submit(data)
+
+    messages = [{"type": "lifespan.shutdown"}]
+    sent = []
+
+    async def receive():
+        return messages.pop(0)
+
+    async def send(message):
+        sent.append(message)
+
+    asyncio.run(lifespan(receive, send))
+    assert sent == [{"type": "lifespan.shutdown.complete"}]
+
+    storage = SQLite_Storage(path)
+    assert len(storage) == len(sample_receipt_data) * 50
+    storage.close()
+
+
+def test_asgi_deferred_needs_one_worker(monkeypatch):
+    """Test that the deferred mode is refused with several workers."""
+    from asgi import main
+
+    monkeypatch.setenv("RECEIPT_STORAGE", "sqlite")
+    monkeypatch.setenv("SQLITE_COMMIT_EVERY", "1")
+    monkeypatch.setenv("SCORING_MODE", "deferred")
+    monkeypatch.setattr(sys, "argv", ["asgi.py", "--workers", "2"])
+    with pytest.raises(SystemExit):
+        main()
@@ -0,0 +1,104 @@
+import json
+import pytest
+from uuid import UUID
+from app import app as flask_app, receipt_pool
+
+
+def write_ndjson(path, entries):
+    path.write_text("".join(json.dumps(entry) + "\n" for entry in entries))
+
+
+@pytest.mark.parametrize("workers", [0, 2])
+def test_import_receipts(tmp_path, sample_receipt_data, workers):
+    """Test importing an NDJSON file of receipts, with invalid lines."""
+    source = tmp_path / "receipts.jsonl"
+    write_ndjson(source, sample_receipt_data)
+    with source.open("a") as file:
+        file.write("{not json\n\n")
+        file.write(json.dumps({"retailer": "Target"}) + "\n")
+    errors = tmp_path / "errors.jsonl"
+
+    size = len(receipt_pool)
+    result = flask_app.test_cli_runner().invoke(args=[
+        "receipts", "import", str(source), "--workers", str(workers),
+        "--chunk-size", "2", "--errors", str(errors)])
+
+    assert result.exit_code == 0, result.output
+    assert len(receipt_pool) == size + len(sample_receipt_data)
+    lines = [json.loads(line) for line in errors.read_text().splitlines()]
+    assert [line["line"] for line in lines] == [4, 6]
+
+
+def test_export_and_import_round_trip(tmp_path, sample_receipt_data):
+    """Test that the exported receipts are imported with their ids."""
+    runner = flask_app.test_cli_runner()
+    write_ndjson(tmp_path / "receipts.jsonl", sample_receipt_data)
+    runner.invoke(args=[
+        "receipts", "import", str(tmp_path / "receipts.jsonl")])
+
+    snapshot = tmp_path / "snapshot.jsonl"
+    result = runner.invoke(args=["receipts", "export", str(snapshot)])
+    assert result.exit_code == 0, result.output
+    records = [json.loads(line) for line in snapshot.read_text().splitlines()]
+    assert len(records) == len(receipt_pool)
+
+    # Importing the snapshot again keeps the ids and points of the receipts
+    ids = [UUID(record["id"]) for record in records]
+    for receipt_id in ids:
+        receipt_pool.delete_receipt(receipt_id)
+    result = runner.invoke(args=["receipts", "import", str(snapshot)])
+    assert result.exit_code == 0, result.output
+    for record, receipt in zip(records, receipt_pool.get_receipts(ids)):
+        assert receipt.points == record["points"]
+        assert receipt.data == record["receipt"]
+
+
+def test_import_export_twice(tmp_path, sample_receipt_data):
+    """Test that importing an export again doesn't add its receipts."""
+    runner = flask_app.test_cli_runner()
+    write_ndjson(tmp_path / "receipts.jsonl", sample_receipt_data)
+    runner.invoke(args=[
+        "receipts", "import", str(tmp_path / "receipts.jsonl")])
+    snapshot = tmp_path / "snapshot.jsonl"
+    result = runner.invoke(args=["receipts", "export", str(snapshot)])
+    assert result.exit_code == 0, result.output
+    # The same receipt twice in a file is imported once
+    records = snapshot.read_text().splitlines()
+    with snapshot.open("a") as file:
+        file.write(records[0] + "\n")
+
+    size = len(receipt_pool)
+    result = runner.invoke(args=["receipts", "import", str(snapshot)])
+    assert result.exit_code == 0, result.output
+    assert len(receipt_pool) == size
+    assert f"{len(records) + 1} already in the pool" in result.output
+
+    for record in records:
+        receipt_pool.delete_receipt(UUID(json.loads(record)["id"]))
+    for _ in range(2):
+        result = runner.invoke(args=["receipts", "import", str(snapshot)])
+        assert result.exit_code == 0, result.output
+        assert len(receipt_pool) == size
+
+
+def test_archive_and_totals(tmp_path, sample_receipt_data):
+    """Test archiving the pool and summing the points of the archive."""
+    runner = flask_app.test_cli_runner()
+    write_ndjson(tmp_path / "receipts.jsonl", sample_receipt_data)
+    runner.invoke(args=[
+        "receipts", "import", str(tmp_path / "receipts.jsonl")])
+
+    archive = tmp_path / "receipts.rca"
+    result = runner.invoke(args=["receipts", "archive", str(archive)])
+    assert result.exit_code == 0, result.output
+    result = runner.invoke(args=[
+        "receipts", "totals", str(archive), "--by", "day",
+        "--value", "receipts"])
+    assert result.exit_code == 0, result.output
+
+    totals = [json.loads(line) for line in result.stdout.splitlines()]
+    assert sum(total["receipts"] for total in totals) == len(receipt_pool)
+    # The pool is shared by the tests, the largest totals come first
+    counts = [total["receipts"] for total in totals]
+    assert counts == sorted(counts, reverse=True)
+    assert "2022-03-20" in {total["day"] for total in totals}
@@ -0,0 +1,30 @@
+import pytest
+from admission import Admission_Controller, Overloaded
+
+
+def test_reserved_slots_for_priority_requests():
+    admission = Admission_Controller(3, reserved=1, retry_after=2)
+    admission.acquire()
+    admission.acquire()
+
+    # The regular requests are over their share, the priority ones get in
+    with pytest.raises(Overloaded) as error:
+        admission.acquire()
+    assert error.value.status == 429
+    admission.acquire(priority=True)
+    assert len(admission) == 3
+
+    # Full: every request is shed
+    with pytest.raises(Overloaded) as error:
+        admission.acquire(priority=True)
+    assert error.value.status == 503
+
+    admission.release()
+    admission.release()
+    admission.acquire()
+    assert len(admission) == 2
+
+
+def test_invalid_reserve():
+    with pytest.raises(ValueError):
+        Admission_Controller(2, reserved=2)
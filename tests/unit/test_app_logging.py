@@ -0,0 +1,54 @@
+import logging
+import queue
+from app_logging import (
+    Body_Log_Policy, Dropping_Queue_Handler, configure_logging
+)
+
+
+def make_record(level, message):
+    return logging.LogRecord(
+        "test", level, __file__, 1, message, None, None)
+
+
+def test_queue_handler_drops_when_full():
+    # The records that don't fit in the queue are dropped and counted
+    handler = Dropping_Queue_Handler(queue.Queue(maxsize=2),
+                                     block_timeout=0.01)
+    for number in range(3):
+        handler.handle(make_record(logging.INFO, f"info {number}"))
+    handler.handle(make_record(logging.ERROR, "error"))
+
+    assert handler.queue.qsize() == 2
+    assert handler.dropped == 2
+
+
+def test_queue_handler_snapshots_message():
+    handler = Dropping_Queue_Handler(queue.Queue())
+    arguments = {"body": "original"}
+    record = logging.LogRecord(
+        "test", logging.INFO, __file__, 1, "Body: %s", (arguments,), None)
+    handler.handle(record)
+    arguments["body"] = "changed"
+
+    assert handler.queue.get_nowait().msg == "Body: {'body': 'original'}"
+
+
+def test_body_log_policy():
+    policy = Body_Log_Policy(sample_rate=0, max_bytes=4)
+    assert not any(policy.should_log() for _ in range(100))
+    assert policy.truncate(b"abcdefgh") == b"abcd... (8 bytes)"
+    assert policy.truncate(b"abc") == b"abc"
+    assert Body_Log_Policy(sample_rate=1).should_log()
+
+
+def test_queue_logging_writes_file(tmp_path):
+    logger = logging.getLogger("test_queue_logging")
+    logger.setLevel(logging.INFO)
+    log_file = tmp_path / "logs" / "app.log"
+    handler = configure_logging(
+        logger, {"LOG_FILE": str(log_file), "LOG_MODE": "queue"})
+    logger.info("Queued message")
+
+    # Wait for the writer thread to empty the queue
+    handler.queue.join()
+    assert "Queued message" in log_file.read_text()
@@ -0,0 +1,131 @@
+import pytest
+from datetime import date
+import archive
+from archive import Receipt_Archive, write_archive
+from points_calculator import parse_cents
+from receipts import Receipt
+
+
+@pytest.fixture
+def receipts(sample_receipt_data):
+    """Provide the sample receipts, scored, and one without payload."""
+    scored = [Receipt(data) for data in sample_receipt_data]
+    return scored + [Receipt.from_stored(scored[0].generate_id(), 7, None)]
+
+
+@pytest.fixture
+def archive_path(tmp_path, receipts):
+    path = str(tmp_path / "receipts.rca")
+    assert write_archive(path, receipts) == (len(receipts), 0)
+    return path
+
+
+def test_archive_round_trip(archive_path, receipts):
+    with Receipt_Archive(archive_path, use_numpy=False) as reader:
+        assert len(reader) == len(receipts)
+        # The retailers and descriptions are stored once each
+        assert sorted(reader.retailers()) == ["M&M Corner Market", "Target"]
+        archived = list(reader)
+
+    for receipt, row in zip(receipts, archived):
+        assert row.id == receipt.id
+        assert row.points == receipt.points
+        if receipt.data is None:
+            assert row[2:] == (None, None, None, [])
+            continue
+        assert row.total_cents == parse_cents(receipt.data["total"])
+        assert row.purchase_date.isoformat() == receipt.data["purchaseDate"]
+        assert row.retailer == receipt.data["retailer"]
+        assert row.items == [
+            (item["shortDescription"], parse_cents(item["price"]))
+            for item in receipt.data["items"]]
+
+
+def test_archive_totals(archive_path, receipts):
+    expected = {}
+    for receipt in receipts[:-1]:
+        retailer = receipt.data["retailer"]
+        expected[retailer] = expected.get(retailer, 0) + receipt.points
+
+    with Receipt_Archive(archive_path, use_numpy=False) as reader:
+        # The receipt without payload is left out
+        assert reader.totals("retailer") == expected
+        assert reader.totals("day", "receipts") == {
+            date(2022, 1, 1): 2, date(2022, 3, 20): 1}
+        assert reader.totals("day", "total_cents") == {
+            date(2022, 1, 1): 649 + 3535, date(2022, 3, 20): 900}
+        with pytest.raises(ValueError):
+            reader.totals("week")
+
+
+@pytest.mark.skipif(archive.numpy is None, reason="NumPy is not installed")
+def test_archive_totals_with_numpy(archive_path):
+    with Receipt_Archive(archive_path, use_numpy=False) as reader:
+        expected = [reader.totals(by, value)
+                    for by in archive.GROUPS for value in archive.VALUES]
+    with Receipt_Archive(archive_path, use_numpy=True) as reader:
+        assert [reader.totals(by, value) for by in archive.GROUPS
+                for value in archive.VALUES] == expected
+
+
+@pytest.mark.skipif(archive.numpy is None, reason="NumPy is not installed")
+def test_archive_large_totals_with_numpy(tmp_path, sample_receipt_data):
+    # Points past 2**53, that float64 can't sum exactly, and total amounts
+    # whose sum overflows 64 bits
+    receipts = [Receipt(dict(sample_receipt_data[0], total=total, items=[
+        {"price": price, "shortDescription": "ABC"}]))
+        for price, total in [("50000000000000001.00", "50000000000000000.00"),
+                             ("50000000000000003.00", "60000000000000000.00")]]
+    assert receipts[0].points > 2 ** 53
+    path = str(tmp_path / "receipts.rca")
+    assert write_archive(path, receipts) == (2, 0)
+
+    with Receipt_Archive(path, use_numpy=False) as reader:
+        expected = [reader.totals(by, value)
+                    for by in archive.GROUPS for value in archive.VALUES]
+    assert expected[0]["Target"] == sum(
+        receipt.points for receipt in receipts)
+    assert expected[1]["Target"] > 2 ** 63
+    with Receipt_Archive(path, use_numpy=True) as reader:
+        assert [reader.totals(by, value) for by in archive.GROUPS
+                for value in archive.VALUES] == expected
+
+
+def test_archive_unusual_receipts(tmp_path, sample_receipt_data):
+    # The validation accepts dates that don't exist and unbounded amounts
+    impossible_date = Receipt(dict(sample_receipt_data[0],
+                                   purchaseDate="2022-02-30"))
+    large_points = Receipt(dict(sample_receipt_data[0], items=[
+        {"price": "99999999999.00", "shortDescription": "ABC"}]))
+    huge_amount = Receipt(dict(sample_receipt_data[0], items=[
+        {"price": "999999999999999999999.00", "shortDescription": "ABC"}]))
+    assert large_points.points > 2 ** 31
+
+    path = str(tmp_path / "receipts.rca")
+    assert write_archive(
+        path, [impossible_date, large_points, huge_amount]) == (2, 1)
+    with Receipt_Archive(path, use_numpy=False) as reader:
+        archived = list(reader)
+        assert archived[0].purchase_date is None
+        assert archived[0].retailer == "Target"
+        assert archived[1].points == large_points.points
+        assert reader.totals("day", "receipts") == {date(2022, 1, 1): 1}
+        assert reader.totals("retailer") == {
+            "Target": impossible_date.points + large_points.points}
+
+
+def test_empty_and_invalid_archives(tmp_path):
+    path = str(tmp_path / "empty.rca")
+    write_archive(path, [])
+    with Receipt_Archive(path) as reader:
+        assert len(reader) == 0
+        assert list(reader) == []
+        assert reader.totals("day") == {}
+
+    with open(path, "r+b") as file:
+        file.write(b"NOTARCH!")
+    with pytest.raises(ValueError):
+        Receipt_Archive(path)
+    (tmp_path / "short.rca").write_bytes(b"RCPT")
+    with pytest.raises(ValueError):
+        Receipt_Archive(str(tmp_path / "short.rca"))
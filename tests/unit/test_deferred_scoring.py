@@ -0,0 +1,83 @@
+import pytest
+from marshmallow import ValidationError
+from deferred_scoring import Deferred_Scorer
+from receipts import Receipt_Pool
+
+
+def test_score_on_demand(sample_receipt_data):
+    pool = Receipt_Pool()
+    scorer = Deferred_Scorer(pool)
+    receipt_id = scorer.submit(sample_receipt_data[0])
+
+    # Pending until scored: not in the pool yet
+    assert receipt_id in scorer
+    assert receipt_id not in pool
+
+    scorer.score(receipt_id)
+    assert receipt_id not in scorer
+    assert pool.get_receipt(receipt_id).points == 12
+    # Scoring again is a no-op
+    scorer.score(receipt_id)
+    assert len(pool) == 1
+
+
+def test_invalid_receipts(sample_receipt_data):
+    scorer = Deferred_Scorer(Receipt_Pool())
+
+    # The structure is checked on submit...
+    with pytest.raises(ValidationError):
+        scorer.submit({"retailer": "Target"})
+    with pytest.raises(ValidationError):
+        scorer.submit(dict(sample_receipt_data[0], items=[]))
+
+    # ...the fields when the receipt is scored
+    receipt_id = scorer.submit(
+        dict(sample_receipt_data[0], purchaseDate="01/01/2022"))
+    assert scorer.get_failure(receipt_id) is None
+    scorer.score(receipt_id)
+    assert "purchaseDate" in scorer.get_failure(receipt_id)
+    assert receipt_id not in scorer
+    assert receipt_id not in scorer.pool
+
+
+def test_background_thread(sample_receipt_data):
+    pool = Receipt_Pool()
+    scorer = Deferred_Scorer(pool)
+    scorer.start()
+    receipt_ids = [scorer.submit(data) for data in sample_receipt_data]
+
+    # Stopping scores the receipts still queued
+    scorer.stop()
+    assert len(scorer) == 0
+    assert [pool.get_receipt(receipt_id).points
+            for receipt_id in receipt_ids] == [12, 109, 28]
+
+
+def test_full_queue(sample_receipt_data):
+    # Without room in the queue, the receipt is scored on submit
+    pool = Receipt_Pool()
+    scorer = Deferred_Scorer(pool, queue_size=1)
+    first = scorer.submit(sample_receipt_data[0])
+    second = scorer.submit(sample_receipt_data[1])
+    assert first in scorer
+    assert second in pool
+
+
+def test_pool_close_stops_the_scorer(sample_receipt_data, caplog):
+    pool = Receipt_Pool()
+    scorer = Deferred_Scorer(pool)
+    scorer.start()
+    receipt_ids = [scorer.submit(data) for data in sample_receipt_data]
+
+    # The queued receipts are stored before the storage is closed
+    pool.close()
+    assert scorer.thread is None
+    assert len(scorer) == 0
+    assert all(receipt_id in pool for receipt_id in receipt_ids)
+
+    # A receipt scored after the close fails, without a traceback
+    receipt_id = scorer.submit(sample_receipt_data[0])
+    scorer.score(receipt_id)
+    assert receipt_id not in pool
+    assert scorer.get_failure(receipt_id) == "The receipt pool is closed."
+    assert not any(record.exc_info for record in caplog.records)
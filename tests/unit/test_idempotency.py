@@ -0,0 +1,51 @@
+import time
+import pytest
+from uuid import uuid4
+from idempotency import (
+    Idempotency_Cache, Idempotency_Conflict, idempotency_key,
+    payload_fingerprint
+)
+
+
+def test_fingerprint_is_canonical(sample_receipt_data):
+    # The order of the keys doesn't change the fingerprint
+    receipt = sample_receipt_data[0]
+    reordered = dict(reversed(list(receipt.items())))
+    assert payload_fingerprint(receipt) == payload_fingerprint(reordered)
+    assert payload_fingerprint(receipt) != payload_fingerprint(
+        sample_receipt_data[1])
+
+
+def test_cache_lru_eviction():
+    cache = Idempotency_Cache(max_entries=2)
+    ids = [uuid4() for _ in range(3)]
+    cache.put("a", "fa", ids[0])
+    cache.put("b", "fb", ids[1])
+    # Using "a" makes "b" the least recently used entry
+    assert cache.get("a", "fa") == ids[0]
+    cache.put("c", "fc", ids[2])
+
+    assert len(cache) == 2
+    assert cache.get("b", "fb") is None
+    assert cache.get("a", "fa") == ids[0]
+    assert cache.get("c", "fc") == ids[2]
+
+
+def test_cache_ttl():
+    cache = Idempotency_Cache(ttl=0.01)
+    cache.put("a", "fa", uuid4())
+    time.sleep(0.02)
+    assert cache.get("a", "fa") is None
+    assert len(cache) == 0
+
+
+def test_idempotency_key_conflict(sample_receipt_data):
+    cache = Idempotency_Cache()
+    key, fingerprint = idempotency_key(sample_receipt_data[0], "retry-1")
+    assert key == "key:retry-1"
+    cache.put(key, fingerprint, uuid4())
+
+    # The same key with another receipt is a conflict
+    key, fingerprint = idempotency_key(sample_receipt_data[1], "retry-1")
+    with pytest.raises(Idempotency_Conflict):
+        cache.get(key, fingerprint)
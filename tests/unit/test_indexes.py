@@ -0,0 +1,68 @@
+from receipts import Receipt, Receipt_Pool
+from indexes import Receipt_Indexes
+
+
+def make_pool(sample_receipt_data):
+    pool = Receipt_Pool()
+    indexes = Receipt_Indexes()
+    pool.add_listener(indexes)
+    receipts = [Receipt(data) for data in sample_receipt_data]
+    pool.add_receipts(receipts)
+    return pool, indexes, receipts
+
+
+def test_query(sample_receipt_data):
+    pool, indexes, receipts = make_pool(sample_receipt_data)
+    by_id = {receipt.id: receipt for receipt in receipts}
+
+    # All the receipts, by descending points
+    count, results = indexes.query()
+    assert count == len(receipts)
+    assert [points for *_, points in results] == sorted(
+        (receipt.points for receipt in receipts), reverse=True)
+
+    # Retailers match case-insensitively
+    count, results = indexes.query(retailer="target")
+    assert count == 2
+    assert {result[1] for result in results} == {"Target"}
+
+    count, results = indexes.query(
+        date_from="2022-03-01", date_to="2022-03-31")
+    assert [by_id[result[0]].data["retailer"] for result in results] == [
+        "M&M Corner Market"]
+
+    count, results = indexes.query(retailer="Target", min_points=20)
+    assert count == 1
+    assert results[0][3] == 28
+
+    # Paging
+    count, results = indexes.query(limit=1, offset=1)
+    assert count == len(receipts)
+    assert len(results) == 1
+    assert results[0][3] == 28
+
+
+def test_stats(sample_receipt_data):
+    pool, indexes, receipts = make_pool(sample_receipt_data)
+    stats = indexes.stats("retailer")
+    assert stats["count"] == 3
+    assert stats["total"] == 12 + 109 + 28
+    assert (stats["min"], stats["max"]) == (12, 109)
+    assert stats["groups"]["Target"] == {
+        "count": 2, "total": 40, "average": 20.0}
+
+    # The deleted receipts leave the indexes and the totals
+    pool.delete_receipt(receipts[1].id)
+    stats = indexes.stats("date")
+    assert stats["total"] == 40
+    assert stats["max"] == 28
+    assert list(stats["groups"]) == ["2022-01-01"]
+    assert indexes.query(retailer="M&M Corner Market") == (0, [])
+
+
+def test_rebuild(sample_receipt_data):
+    pool = Receipt_Pool()
+    pool.add_receipts([Receipt(data) for data in sample_receipt_data])
+    indexes = Receipt_Indexes()
+    indexes.rebuild(pool.iter_receipts())
+    assert len(indexes) == len(sample_receipt_data)
@@ -0,0 +1,137 @@
+import os
+import pytest
+from receipts import Receipt, Receipt_Pool
+from journal import Journaled_Storage
+from storage import Compact_Storage, Dict_Storage, create_storage
+
+
+def reopen(path, **options):
+    return Journaled_Storage(Dict_Storage(), str(path), **options)
+
+
+def test_journal_survives_restart(tmp_path, sample_receipt_data):
+    storage = reopen(tmp_path)
+    receipts = [Receipt(data) for data in sample_receipt_data]
+    assert storage.add(receipts[0])
+    assert storage.add_many(receipts[1:]) == []
+    assert storage.delete(receipts[1].id)
+    storage.close()
+
+    storage = reopen(tmp_path)
+    assert len(storage) == len(receipts) - 1
+    assert storage.get(receipts[1].id) is None
+    stored = storage.get(receipts[2].id)
+    assert stored.points == receipts[2].points
+    assert stored.data == receipts[2].data
+    storage.close()
+
+
+@pytest.mark.parametrize("sync", ["group", "interval"])
+def test_journal_snapshot(tmp_path, sample_receipt_data, sync):
+    # A snapshot every 2 records, the last receipts are in the journal
+    storage = reopen(
+        tmp_path, sync=sync, sync_interval=0.01, snapshot_every=2)
+    pool = Receipt_Pool(storage)
+    receipts = [Receipt(data) for data in sample_receipt_data * 3]
+    for receipt in receipts:
+        pool.add_receipt(receipt)
+    storage.snapshot()
+    pool.add_receipt(Receipt(sample_receipt_data[0]))
+    pool.close()
+
+    names = sorted(os.listdir(tmp_path))
+    assert len(names) == 2
+    assert names[0].startswith("journal-") and names[1].startswith("snapshot")
+
+    storage = reopen(tmp_path)
+    assert len(storage) == len(receipts) + 1
+    for receipt in receipts:
+        assert storage.get(receipt.id).points == receipt.points
+    storage.close()
+
+
+def test_journal_snapshot_interrupted(tmp_path, sample_receipt_data,
+                                      monkeypatch):
+    # A crash after the new journal is started, before the snapshot is
+    # renamed: the previous snapshot and journal are still needed.
+    storage = reopen(tmp_path)
+    receipts = [Receipt(data) for data in sample_receipt_data * 3]
+    storage.add_many(receipts[:3])
+    storage.snapshot()
+    storage.add_many(receipts[3:6])
+
+    def crash(source, target):
+        raise OSError("Crashed before the rename")
+
+    with monkeypatch.context() as patch:
+        patch.setattr(os, "replace", crash)
+        with pytest.raises(OSError):
+            storage.snapshot()
+    storage.add_many(receipts[6:])
+    storage.close()
+
+    # The pool survives the restarts, not only the first one
+    for _ in range(2):
+        storage = reopen(tmp_path)
+        assert len(storage) == len(receipts)
+        for receipt in receipts:
+            assert storage.get(receipt.id).points == receipt.points
+        storage.close()
+
+
+def test_journal_torn_record(tmp_path, sample_receipt_data):
+    storage = reopen(tmp_path)
+    receipts = [Receipt(data) for data in sample_receipt_data]
+    storage.add_many(receipts)
+    storage.close()
+
+    # Cut the last record in half, like a crash in the middle of a write
+    path = tmp_path / sorted(os.listdir(tmp_path))[0]
+    os.truncate(path, os.path.getsize(path) - 10)
+
+    storage = reopen(tmp_path)
+    assert len(storage) == len(receipts) - 1
+    # The torn record is discarded, the next ones are readable
+    storage.add(receipts[-1])
+    storage.close()
+    storage = reopen(tmp_path)
+    assert len(storage) == len(receipts)
+    storage.close()
+
+
+def test_journal_compact_storage(tmp_path, sample_receipt_data):
+    storage = Journaled_Storage(Compact_Storage(), str(tmp_path))
+    receipt = Receipt(sample_receipt_data[0])
+    storage.add(receipt)
+    storage.close()
+
+    storage = Journaled_Storage(Compact_Storage(), str(tmp_path))
+    assert storage.get(receipt.id).points == receipt.points
+    storage.close()
+
+
+@pytest.mark.parametrize("backend", [Dict_Storage, Compact_Storage])
+def test_journal_large_points(tmp_path, sample_receipt_data, backend):
+    # The points have no upper limit, nor the prices of the items
+    receipts = [Receipt(dict(sample_receipt_data[0], items=[
+        {"price": price, "shortDescription": "ABC"}]))
+        for price in ("100000000000000000000000.00", "9223372036854775.00")]
+    assert receipts[0].points > 2 ** 64
+    storage = Journaled_Storage(backend(), str(tmp_path))
+    assert storage.add(receipts[0])
+    assert storage.add_many(receipts[1:]) == []
+    storage.close()
+
+    # Replayed from the journal, then from a snapshot
+    for _ in range(2):
+        storage = Journaled_Storage(backend(), str(tmp_path))
+        for receipt in receipts:
+            assert storage.get(receipt.id).points == receipt.points
+        storage.snapshot()
+        storage.close()
+
+
+def test_journal_with_sqlite(tmp_path):
+    with pytest.raises(ValueError):
+        create_storage({
+            "RECEIPT_STORAGE": "sqlite", "JOURNAL_DIR": str(tmp_path)})
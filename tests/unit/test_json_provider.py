@@ -0,0 +1,63 @@
+import datetime
+import decimal
+import uuid
+import pytest
+from flask import Flask
+import json_provider
+from json_provider import (
+    Fast_JSON_Provider, dumps, get_json_library, loads, set_json_library
+)
+
+
+LIBRARIES = ["stdlib"] + (["orjson"] if json_provider.orjson else [])
+
+
+@pytest.fixture(params=LIBRARIES)
+def library(request):
+    previous = get_json_library()
+    set_json_library(request.param)
+    yield request.param
+    set_json_library(previous)
+
+
+def test_round_trip(library, sample_receipt_data):
+    for data in sample_receipt_data:
+        assert loads(dumps(data)) == data
+        assert loads(dumps(data).decode()) == data
+
+
+def test_invalid_json(library):
+    with pytest.raises(ValueError):
+        loads(b"{not valid json")
+
+
+def test_provider_matches_flask(library):
+    """The responses are the ones of the default Flask provider"""
+    app = Flask(__name__)
+    content = {
+        "b": [1, 2.5, None, True],
+        "a": str(uuid.UUID(int=1)),
+        "id": uuid.UUID(int=2),
+        "total": decimal.Decimal("6.49"),
+        "date": datetime.date(2022, 1, 1),
+    }
+    with app.app_context():
+        expected = app.json.response(content).get_data()
+        app.json = Fast_JSON_Provider(app)
+        assert app.json.response(content).get_data() == expected
+        assert app.json.loads(expected) == app.json.loads(
+            expected.decode())
+        assert app.json.dumps(content, indent=4).count("\n") > 1
+
+
+def test_select_library():
+    previous = get_json_library()
+    try:
+        set_json_library("stdlib")
+        assert get_json_library() == "stdlib"
+        set_json_library("auto")
+        assert get_json_library() == LIBRARIES[-1]
+        with pytest.raises(ValueError):
+            set_json_library("simplejson")
+    finally:
+        set_json_library(previous)
@@ -0,0 +1,36 @@
+from metrics import Counter, Histogram, Metrics_Registry
+
+
+def test_histogram_buckets():
+    histogram = Histogram("stage_seconds", "Stage time.", ("stage",),
+                          buckets=(0.1, 1.0))
+    child = histogram.labels("parse")
+    for value in (0.05, 0.1, 0.5, 2.0):
+        child.observe(value)
+
+    samples = {
+        (suffix, labels.get("le")): value
+        for suffix, labels, value in histogram.samples()
+    }
+    assert samples[("_bucket", "0.1")] == 2
+    assert samples[("_bucket", "1.0")] == 3
+    assert samples[("_bucket", "+Inf")] == 4
+    assert samples[("_count", None)] == 4
+    assert samples[("_sum", None)] == 2.65
+
+
+def test_registry_render():
+    registry = Metrics_Registry()
+    counter = registry.register(
+        Counter("requests", "Requests.", ("endpoint",)))
+    counter.labels("get_points").inc()
+    counter.labels("get_points").inc(2)
+    histogram = registry.register(Histogram("latency_seconds", "Latency."))
+    with histogram.time():
+        pass
+
+    text = registry.render()
+    assert "# TYPE requests counter" in text
+    assert 'requests_total{endpoint="get_points"} 3' in text
+    assert "# TYPE latency_seconds histogram" in text
+    assert "latency_seconds_count 1" in text
@@ -0,0 +1,96 @@
+import json
+import pytest
+from points_calculator import Points_Calculator
+
+
+def test_default_rules_points(sample_receipt_data):
+    # The default rules file awards the same points as the challenge rules
+    calculator = Points_Calculator.from_file()
+    expected_points = [12, 109, 28]
+
+    for data, points in zip(sample_receipt_data, expected_points):
+        assert calculator.calculate(data) == points
+
+
+def test_item_rules_are_fused(sample_receipt_data):
+    # Item rules are evaluated in the single pass over the items
+    calculator = Points_Calculator.from_file()
+    assert len(calculator.item_plan) == 1
+    assert len(calculator.receipt_plan) == len(calculator.rules) - 1
+
+
+def test_custom_rules_file(tmp_path, sample_receipt_data):
+    # A promotion declared as data, without touching the code
+    rules_file = tmp_path / "rules.json"
+    rules_file.write_text(json.dumps({"rules": [
+        {"type": "item_groups", "group_size": 1, "points": 3},
+        {"type": "purchase_time_window", "start": "13:00",
+         "end": "14:00", "points": 100}
+    ]}))
+    calculator = Points_Calculator.from_file(str(rules_file))
+
+    assert calculator.calculate(sample_receipt_data[0]) == 103
+    assert calculator.calculate(sample_receipt_data[1]) == 12
+
+
+def test_invalid_rules():
+    with pytest.raises(ValueError):
+        Points_Calculator([{"type": "unknown_rule"}])
+
+    with pytest.raises(ValueError):
+        Points_Calculator([{"type": "round_total"}])  # Missing points
+
+
+def test_exact_money_arithmetic(sample_receipt_data):
+    # 15.00 * 0.2 is 3.0000000000000004 in floats, which rounds up to 4
+    calculator = Points_Calculator([
+        {"type": "item_description_length", "multiple": 3,
+         "price_multiplier": "0.2"}
+    ])
+    receipt = dict(sample_receipt_data[0], items=[
+        {"shortDescription": "Big Pizza", "price": "15.00"},
+        {"shortDescription": "Soda", "price": "0.35"}
+    ])
+    assert calculator.calculate(receipt) == 3
+
+    # 0.30 % 0.1 is 0.09999999999999998 in floats
+    calculator = Points_Calculator([
+        {"type": "total_multiple", "multiple": 0.1, "points": 5},
+        {"type": "round_total", "points": 50}
+    ])
+    for total, points in [("0.30", 5), ("0.35", 0), ("7.00", 55)]:
+        assert calculator.calculate(dict(receipt, total=total)) == points
+
+
+def test_memo_caches(sample_receipt_data):
+    # Memoized or not, the points are the same, and the repeated
+    # retailers and descriptions are hits
+    import points_calculator
+    from points_calculator import memo_stats, set_memo_sizes
+
+    calculator = Points_Calculator.from_file()
+    expected = [calculator.calculate(data) for data in sample_receipt_data]
+    previous = (points_calculator.retailer_memo.max_size,
+                points_calculator.description_memo.max_size)
+    try:
+        set_memo_sizes(2, 16)
+        for _ in range(3):
+            assert [calculator.calculate(data)
+                    for data in sample_receipt_data] == expected
+
+        stats = memo_stats()
+        # The cache never holds more than its maximum entries
+        assert stats["retailer"]["size"] <= 2
+        assert stats["retailer"]["hits"] + stats["retailer"]["misses"] == 9
+        assert stats["description"]["misses"] == len(
+            {item["shortDescription"] for data in sample_receipt_data
+             for item in data["items"]})
+        assert stats["description"]["hit_ratio"] > 0.5
+
+        set_memo_sizes(0, 0)
+        assert calculator.calculate(sample_receipt_data[0]) == expected[0]
+        assert memo_stats()["retailer"] == {
+            "hits": 0, "misses": 0, "size": 0, "max_size": 0,
+            "hit_ratio": 0.0}
+    finally:
+        set_memo_sizes(*previous)
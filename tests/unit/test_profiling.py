@@ -0,0 +1,61 @@
+import pstats
+from metrics import CALCULATE_POINTS
+from profiling import (
+    Request_Profiler, Slow_Request_Recorder, is_admin_token, record_stage,
+    stage_trace
+)
+
+
+def test_stage_trace():
+    # The stage timers add their time to the trace of the request
+    record_stage("parse_json", 1.0)
+    trace = {}
+    token = stage_trace.set(trace)
+    try:
+        record_stage("parse_json", 0.5)
+        record_stage("parse_json", 0.25)
+        with CALCULATE_POINTS.time():
+            pass
+    finally:
+        stage_trace.reset(token)
+    record_stage("parse_json", 1.0)
+
+    assert trace["parse_json"] == 0.75
+    assert set(trace) == {"parse_json", "calculate_points"}
+
+
+def test_slow_request_recorder():
+    recorder = Slow_Request_Recorder(size=2, threshold=0.01)
+    for duration in (0.005, 0.02, 0.5, 0.1, 0.03):
+        recorder.record(duration, "GET", f"/{duration}", 200,
+                        {"parse_json": 0.001})
+
+    # The two slowest, above the threshold, the slowest first
+    requests = recorder.slowest()
+    assert [request["duration_ms"] for request in requests] == [500, 100]
+    assert requests[0]["path"] == "/0.5"
+    assert requests[0]["stages_ms"] == {"parse_json": 1}
+    assert requests[0]["other_ms"] == 499
+
+    recorder.clear()
+    assert recorder.slowest() == []
+
+
+def test_request_profiler(tmp_path):
+    profiler = Request_Profiler(str(tmp_path), "secret")
+    assert profiler.wanted("secret")
+    assert not profiler.wanted("wrong")
+    assert not profiler.wanted(None)
+
+    profile = profiler.start()
+    sum(range(1000))
+    name = profiler.stop(profile, "GET", "/receipts/../points")
+    assert name.endswith("-get_receipts____points.prof")
+    assert pstats.Stats(str(tmp_path / name)).total_calls > 0
+
+
+def test_admin_token():
+    assert is_admin_token("secret", "secret")
+    assert not is_admin_token("secret", "")
+    assert not is_admin_token("", "secret")
+    assert not is_admin_token(None, "secret")
@@ -0,0 +1,86 @@
+import pytest
+from receipts import Receipt, Receipt_Pool
+from retention import Retention_Policy
+
+
+def make_pool(sample_receipt_data, **options):
+    pool = Receipt_Pool()
+    retention = Retention_Policy(pool, **options)
+    pool.add_listener(retention)
+    receipts = [Receipt(data) for data in sample_receipt_data]
+    for receipt in receipts:
+        pool.add_receipt(receipt)
+    return pool, retention, receipts
+
+
+def test_max_receipts_fifo(sample_receipt_data):
+    pool, retention, receipts = make_pool(
+        sample_receipt_data, max_receipts=2)
+    assert len(pool) == 3
+
+    # The oldest receipt is evicted, even if it was just read
+    pool.get_receipt(receipts[0].id)
+    assert retention.sweep() == 1
+    assert len(pool) == len(retention) == 2
+    assert receipts[0].id not in pool
+
+
+def test_max_receipts_lru(sample_receipt_data):
+    pool, retention, receipts = make_pool(
+        sample_receipt_data, max_receipts=2, policy="lru")
+
+    # The least recently read receipt is evicted
+    pool.get_receipt(receipts[0].id)
+    retention.sweep()
+    assert receipts[0].id in pool
+    assert receipts[1].id not in pool
+
+
+def test_max_age(sample_receipt_data):
+    pool, retention, receipts = make_pool(
+        sample_receipt_data, max_age=60)
+    now = retention.receipts[receipts[-1].id]
+
+    assert retention.sweep(now + 30) == 0
+    assert retention.sweep(now + 61) == 3
+    assert len(pool) == len(retention) == 0
+
+
+def test_deleted_receipts_are_untracked(sample_receipt_data):
+    pool, retention, receipts = make_pool(
+        sample_receipt_data, max_receipts=2)
+    pool.delete_receipt(receipts[0].id)
+    assert len(retention) == 2
+    assert retention.sweep() == 0
+
+
+def test_sweeper_thread(sample_receipt_data):
+    pool, retention, receipts = make_pool(
+        sample_receipt_data, max_receipts=1, sweep_interval=0.01)
+    retention.start()
+    try:
+        for _ in range(100):
+            if len(pool) == 1:
+                break
+            retention.stopped.wait(0.01)
+    finally:
+        retention.stop()
+    assert len(pool) == 1
+    assert receipts[-1].id in pool
+
+
+def test_unknown_policy():
+    with pytest.raises(ValueError):
+        Retention_Policy(Receipt_Pool(), max_receipts=1, policy="random")
+
+
+def test_pool_without_payload(sample_receipt_data):
+    pool = Receipt_Pool(keep_payload=False)
+    receipts = [Receipt(data) for data in sample_receipt_data]
+    pool.add_receipts(receipts)
+
+    # The points are kept, the payload is dropped from the stored copy only
+    stored = pool.get_receipt(receipts[0].id)
+    assert stored.points == receipts[0].points
+    assert stored.data is None
+    assert receipts[0].data is not None
@@ -0,0 +1,27 @@
+import pytest
+from receipts import Receipt
+from scoring import Scoring_Pool, chunked
+
+
+def test_chunked():
+    assert list(chunked(range(5), 2)) == [[0, 1], [2, 3], [4]]
+    assert list(chunked([], 2)) == []
+
+
+@pytest.mark.parametrize("workers", [0, 2])
+def test_scoring_pool(sample_receipt_data, invalid_receipt_data, workers):
+    """Test that the pool scores the receipts like the Receipt class."""
+    payloads = sample_receipt_data + invalid_receipt_data
+    scoring_pool = Scoring_Pool(workers, chunk_size=2)
+    try:
+        scores = scoring_pool.score(payloads)
+    finally:
+        scoring_pool.close()
+
+    assert len(scores) == len(payloads)
+    for payload, score in zip(sample_receipt_data, scores):
+        id_bytes, points = score
+        assert len(id_bytes) == 16
+        assert points == Receipt(payload).points
+    for score in scores[len(sample_receipt_data):]:
+        assert score.startswith("Receipt validation failed")
@@ -0,0 +1,206 @@
+import pytest
+from receipts import Receipt, Receipt_Pool
+import threading
+import time
+from uuid import uuid4
+from storage import (
+    Compact_Storage, Dict_Storage, Sharded_Storage, SQLite_Storage,
+    create_storage
+)
+
+
+@pytest.fixture(params=["memory", "sharded", "compact", "sqlite", "journal"])
+def storage(request, tmp_path):
+    """Provide each storage backend, empty."""
+    journaled = request.param == "journal"
+    backend = create_storage({
+        "RECEIPT_STORAGE": "sharded" if journaled else request.param,
+        "SQLITE_PATH": str(tmp_path / "receipts.db"),
+        "COMPACT_STORE_PAYLOAD": True,
+        "JOURNAL_DIR": str(tmp_path / "journal") if journaled else ""
+    })
+    yield backend
+    backend.close()
+
+
+def test_add_get_delete(storage, sample_receipt_data):
+    receipts = [Receipt(data) for data in sample_receipt_data]
+    for receipt in receipts:
+        assert storage.add(receipt)
+
+    assert len(storage) == len(receipts)
+    for receipt in receipts:
+        assert receipt.id in storage
+        stored = storage.get(receipt.id)
+        assert stored.id == receipt.id
+        assert stored.points == receipt.points
+        assert stored.data == receipt.data
+
+    assert storage.delete(receipts[0].id)
+    assert not storage.delete(receipts[0].id)
+    assert storage.get(receipts[0].id) is None
+    assert {receipt.id for receipt in storage} == {
+        receipt.id for receipt in receipts[1:]}
+
+
+def test_add_collision(storage, sample_receipt_data):
+    # A receipt is not stored when its id is already in use
+    first, second = Receipt(sample_receipt_data[0]), Receipt(
+        sample_receipt_data[1])
+    second.id = first.id
+    assert storage.add(first)
+    assert not storage.add(second)
+    assert storage.add_many([second]) == [second]
+    assert storage.get(first.id).points == first.points
+
+
+def test_pool_with_storage(storage, sample_receipt_data):
+    # The pool resolves id collisions on any backend
+    pool = Receipt_Pool(storage)
+    receipts = [Receipt(data) for data in sample_receipt_data]
+    receipts[1].id = receipts[0].id
+    pool.add_receipts(receipts)
+
+    assert len(pool) == len(receipts)
+    assert len({receipt.id for receipt in receipts}) == len(receipts)
+    for receipt in receipts:
+        assert pool.get_receipt(receipt.id).points == receipt.points
+    assert len(pool.get_all_receipts()) == len(receipts)
+
+
+def test_close_twice(storage, sample_receipt_data):
+    # The ASGI shutdown and the atexit hook both close the pool
+    storage.add(Receipt(sample_receipt_data[0]))
+    storage.close()
+    storage.close()
+
+
+def test_sqlite_survives_restart(tmp_path, sample_receipt_data):
+    path = str(tmp_path / "receipts.db")
+    storage = SQLite_Storage(path, commit_every=1000)
+    receipts = [Receipt(data) for data in sample_receipt_data]
+    storage.add_many(receipts)
+    storage.close()
+
+    storage = SQLite_Storage(path)
+    assert len(storage) == len(receipts)
+    for receipt in receipts:
+        assert storage.get(receipt.id).points == receipt.points
+    storage.close()
+
+
+def test_sqlite_large_points(tmp_path):
+    # Points beyond 64 bits, from huge amounts, survive a restart
+    path = str(tmp_path / "receipts.db")
+    storage = SQLite_Storage(path)
+    receipts = [Receipt.from_stored(uuid4(), points, None)
+                for points in (2 ** 70, 2 ** 63 - 1, 7)]
+    assert storage.add_many(receipts) == []
+    storage.close()
+
+    storage = SQLite_Storage(path)
+    for receipt in receipts:
+        assert storage.get(receipt.id).points == receipt.points
+    assert sorted(receipt.points for receipt in storage) == [
+        7, 2 ** 63 - 1, 2 ** 70]
+    storage.close()
+
+
+def test_sqlite_commits_idle_writes(tmp_path, sample_receipt_data):
+    # The last writes of a burst are committed without another write
+    path = str(tmp_path / "receipts.db")
+    storage = SQLite_Storage(path, commit_every=1000, commit_interval=0.05)
+    storage.add(Receipt(sample_receipt_data[0]))
+    reader = SQLite_Storage(path, commit_interval=0)
+    try:
+        deadline = time.monotonic() + 5
+        while len(reader) == 0 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert len(reader) == 1
+        assert storage.pending_writes == 0
+    finally:
+        reader.close()
+        storage.close()
+
+
+def test_compact_storage_large_points():
+    # Points beyond 64 bits, from huge amounts, go to the side dictionary
+    storage = Compact_Storage()
+    large = Receipt.from_stored(uuid4(), 2 ** 70, None)
+    small = Receipt.from_stored(uuid4(), 7, None)
+    assert storage.add(large) and storage.add(small)
+    assert storage.get(large.id).points == 2 ** 70
+    assert sorted(receipt.points for receipt in storage) == [7, 2 ** 70]
+
+    # A reused slot doesn't keep the large points
+    assert storage.delete(large.id)
+    reused = Receipt.from_stored(uuid4(), 3, None)
+    storage.add(reused)
+    assert storage.get(reused.id).points == 3
+    assert storage.large_points == {}
+
+
+def test_compact_storage_many_receipts():
+    # Grow the hash table and reuse the slots of deleted receipts
+    storage = Compact_Storage(capacity=4)
+    receipts = [
+        Receipt.from_stored(uuid4(), points, {"retailer": "Target"})
+        for points in range(5000)
+    ]
+    for receipt in receipts:
+        assert storage.add(receipt)
+    for receipt in receipts[::2]:
+        assert storage.delete(receipt.id)
+    for receipt in receipts[::2]:
+        assert storage.add(receipt)
+
+    assert len(storage) == len(receipts)
+    assert len(storage.points) == len(receipts)
+    for receipt in receipts:
+        stored = storage.get(receipt.id)
+        assert stored.points == receipt.points
+        # The payload is not kept unless requested
+        assert stored.data is None
+    assert storage.get(uuid4()) is None
+    assert sorted(receipt.points for receipt in storage) == list(range(5000))
+
+
+def test_get_many(storage, sample_receipt_data):
+    receipts = [Receipt(data) for data in sample_receipt_data]
+    storage.add_many(receipts)
+    missing_id = uuid4()
+    found = storage.get_many([receipt.id for receipt in receipts] + [
+        missing_id])
+    assert [receipt.id for receipt in found[:-1]] == [
+        receipt.id for receipt in receipts]
+    assert found[-1] is None
+
+
+def test_sharded_storage_threads():
+    # Threads adding receipts with the same ids store each id only once
+    storage = Sharded_Storage(shards=6)
+    assert len(storage.shards) == 8
+    ids = [uuid4() for _ in range(2000)]
+    stored = []
+
+    def add_all():
+        count = 0
+        for receipt_id in ids:
+            if storage.add(Receipt.from_stored(receipt_id, 1, None)):
+                count += 1
+        stored.append(count)
+
+    threads = [threading.Thread(target=add_all) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert sum(stored) == len(ids)
+    assert len(storage) == len(ids)
+
+
+def test_unknown_storage():
+    assert isinstance(create_storage({}), Dict_Storage)
+    with pytest.raises(ValueError):
+        create_storage({"RECEIPT_STORAGE": "unknown"})
@@ -0,0 +1,101 @@
+import copy
+import random
+import pytest
+from marshmallow import ValidationError
+from receipts import (
+    Receipt, ReceiptSchema, get_receipt_validator, set_receipt_validator
+)
+from validators import Fast_Receipt_Validator
+
+# Values used to replace the fields of a valid receipt
+FIELD_VALUES = [
+    None, 5, 1.5, True, [], {}, "", " ", "x", "Target ", " Target",
+    "M&M Corner Market", "2022-01-01", "2022-1-1", "13:01", "9:05", "24:00",
+    "6.49", "6.4", "6.49\n", "-6.49", "00.00", b"6.49", b"\xff", "Gatorade",
+    "Klarbrunn 12-PK", "Café éclair", "Dew!", "\t", "\n"
+]
+ITEM_VALUES = [
+    None, 1, "item", [], {}, {"price": "1.00"}, {"shortDescription": "a"},
+    {"shortDescription": "a", "price": "1.00", "extra": 1},
+]
+
+
+def mutations(receipt):
+    """Yield variations of a receipt, valid and invalid"""
+    yield receipt
+    for field in list(receipt):
+        missing = dict(receipt)
+        del missing[field]
+        yield missing
+        for value in FIELD_VALUES:
+            yield dict(receipt, **{field: value})
+
+    yield dict(receipt, unknown="field")
+    for value in ITEM_VALUES:
+        yield dict(receipt, items=receipt["items"] + [value])
+    for field in ("shortDescription", "price"):
+        for value in FIELD_VALUES:
+            changed = copy.deepcopy(receipt)
+            changed["items"][0][field] = value
+            yield changed
+
+
+def random_mutations(receipt, count=500, seed=2023):
+    """Yield random combinations of field changes"""
+    rng = random.Random(seed)
+    for _ in range(count):
+        changed = copy.deepcopy(receipt)
+        for _ in range(rng.randint(1, 3)):
+            # Change a field of the receipt or of one of its items
+            items = changed.get("items")
+            targets = [changed] + [
+                item for item in (items if isinstance(items, list) else [])
+                if isinstance(item, dict) and item
+            ]
+            target = rng.choice(targets)
+            field = rng.choice(list(target))
+            if rng.random() < 0.2:
+                del target[field]
+            else:
+                target[field] = rng.choice(FIELD_VALUES + ITEM_VALUES)
+        yield changed
+
+
+def test_validators_agree(sample_receipt_data):
+    # The fast path validator reports exactly the marshmallow errors
+    fast = Fast_Receipt_Validator()
+    schema = ReceiptSchema()
+
+    for receipt in sample_receipt_data:
+        for data in mutations(receipt):
+            assert fast.validate(data) == schema.validate(data), data
+        for data in random_mutations(receipt):
+            assert fast.validate(data) == schema.validate(data), data
+
+    for data in [None, [], "receipt", 1, {}]:
+        assert fast.validate(data) == schema.validate(data)
+
+
+@pytest.mark.parametrize("name", ["fast", "marshmallow"])
+def test_receipt_validator_setting(
+        name,
+        sample_receipt_data,
+        invalid_receipt_data):
+    # Receipts are validated the same way with either validator
+    default_validator = get_receipt_validator()
+    set_receipt_validator(name)
+    try:
+        for data in sample_receipt_data:
+            assert Receipt(data) is not None
+        for data in invalid_receipt_data:
+            with pytest.raises(ValidationError):
+                Receipt(data)
+    finally:
+        set_receipt_validator(
+            "marshmallow" if isinstance(default_validator, ReceiptSchema)
+            else "fast")
+
+
+def test_unknown_receipt_validator():
+    with pytest.raises(ValueError):
+        set_receipt_validator("unknown")
@@ -0,0 +1,163 @@
+"""
+Receipt Processor API - Receipt Validators
+
+A fast path validator for the receipts. It checks the same rules as the
+marshmallow ReceiptSchema and ItemSchema, and reports the errors with the
+same structure, but with precompiled patterns and a single pass over the
+items instead of building a schema for every receipt.
+
+Written in Python 3.11.5 and Flask 2.3.3
+"""
+import re
+from typing import Optional
+
+
+# Regex patterns of the receipt fields. They are shared with the marshmallow
+# schemas, so both validators always check the same formats.
+RETAILER_PATTERN = r"^\S(.*\S)?$"
+DATE_PATTERN = r"^\d{4}-\d{2}-\d{2}$"
+TIME_PATTERN = r"^([01]?[0-9]|2[0-3]):[0-5][0-9]$"
+MONEY_PATTERN = r"^\d+\.\d{2}$"
+DESCRIPTION_PATTERN = r"^[\w\s\-]+$"
+
+# Error messages, the same ones marshmallow reports
+MISSING_ERROR = "Missing data for required field."
+NULL_ERROR = "Field may not be null."
+STRING_ERROR = "Not a valid string."
+UTF8_ERROR = "Not a valid utf-8 string."
+PATTERN_ERROR = "String does not match expected pattern."
+LIST_ERROR = "Not a valid list."
+LENGTH_ERROR = "Shorter than minimum length 1."
+UNKNOWN_ERROR = "Unknown field."
+INPUT_ERROR = "Invalid input type."
+
+# Fields of a receipt
+RECEIPT_FIELDS = ("retailer", "purchaseDate", "purchaseTime", "items", "total")
+
+
+class Fast_Receipt_Validator:
+    """
+    A class to validate the receipts without marshmallow. The validate
+    method returns a dictionary of errors just like Schema.validate: an
+    empty dictionary means that the receipt is valid.
+    """
+
+    def __init__(self):
+        # Fields of the receipt and the items, with their compiled pattern
+        self.receipt_fields = (
+            ("retailer", re.compile(RETAILER_PATTERN)),
+            ("purchaseDate", re.compile(DATE_PATTERN)),
+            ("purchaseTime", re.compile(TIME_PATTERN)),
+            ("total", re.compile(MONEY_PATTERN)),
+        )
+        self.item_fields = (
+            ("shortDescription", re.compile(DESCRIPTION_PATTERN)),
+            ("price", re.compile(MONEY_PATTERN)),
+        )
+        self.receipt_keys = frozenset(
+            [name for name, _ in self.receipt_fields] + ["items"])
+        self.item_keys = frozenset(name for name, _ in self.item_fields)
+
+    def validate(self, receipt) -> dict:
+        """Validate a receipt and return the errors found, if any"""
+        if not isinstance(receipt, dict):
+            return {"_schema": [INPUT_ERROR]}
+
+        errors = check_fields(receipt, self.receipt_fields, self.receipt_keys)
+
+        # Validates that there's at least one valid item in the receipt
+        if "items" not in receipt:
+            errors["items"] = [MISSING_ERROR]
+        else:
+            items_errors = self.validate_items(receipt["items"])
+            if items_errors:
+                errors["items"] = items_errors
+
+        return errors
+
+    def validate_items(self, items):
+        """Validate the list of items in a single pass"""
+        if items is None:
+            return [NULL_ERROR]
+        if not isinstance(items, (list, tuple)):
+            return [LIST_ERROR]
+        if not items:
+            return [LENGTH_ERROR]
+
+        errors = {}
+        item_fields = self.item_fields
+        item_keys = self.item_keys
+        for index, item in enumerate(items):
+            if item is None:
+                errors[index] = [NULL_ERROR]
+            elif not isinstance(item, dict):
+                errors[index] = {"_schema": [INPUT_ERROR]}
+            else:
+                item_errors = check_fields(item, item_fields, item_keys)
+                if item_errors:
+                    errors[index] = item_errors
+        return errors
+
+
+# Module helper functions
+
+def check_structure(receipt) -> dict:
+    """
+    Check only the structure of a receipt: an object with all the fields
+    and a non-empty list of items. It's the cheap check of the deferred
+    scoring, the fields themselves are validated when the receipt is
+    scored. The errors have the same structure as the validate ones.
+    """
+    if not isinstance(receipt, dict):
+        return {"_schema": [INPUT_ERROR]}
+
+    errors = {
+        name: [MISSING_ERROR] for name in RECEIPT_FIELDS
+        if name not in receipt
+    }
+    items = receipt.get("items", ())
+    if items is None:
+        errors["items"] = [NULL_ERROR]
+    elif not isinstance(items, (list, tuple)):
+        errors["items"] = [LIST_ERROR]
+    elif "items" in receipt and not items:
+        errors["items"] = [LENGTH_ERROR]
+    return errors
+
+
+def check_fields(data: dict, field_patterns: tuple, known_keys) -> dict:
+    """Check the string fields of a dictionary against their patterns"""
+    errors = {}
+    for name, pattern in field_patterns:
+        if name not in data:
+            errors[name] = [MISSING_ERROR]
+            continue
+
+        error = check_string(data[name], pattern)
+        if error:
+            errors[name] = [error]
+
+    # Like the marshmallow schemas, reject fields that are not declared
+    if not known_keys.issuperset(data):
+        for name in data:
+            if name not in known_keys:
+                errors[name] = [UNKNOWN_ERROR]
+
+    return errors
+
+
+def check_string(value, pattern: re.Pattern) -> Optional[str]:
+    """Get the error of a string field, or None if it's valid"""
+    if value is None:
+        return NULL_ERROR
+    if not isinstance(value, str):
+        if not isinstance(value, bytes):
+            return STRING_ERROR
+        try:
+            value = value.decode("utf-8")
+        except UnicodeDecodeError:
+            return UTF8_ERROR
+
+    if pattern.match(value) is None:
+        return PATTERN_ERROR
+    return None